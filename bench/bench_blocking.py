@@ -0,0 +1,153 @@
+"""
+Measures what resource blocking saves when Chrome loads a result page.
+
+Serves a corpus page from a local fixture server whose photos, web fonts, ad
+and tracker scripts are rewritten to local URLs with realistic sizes and
+delays. The page is then loaded in headless Chrome with blocking off and on.
+Reports bytes served, request count and time until the listing selector shows
+up. Needs Chrome, but no network access.
+
+    python bench/bench_blocking.py [--runs 5] [--page results_02.html]
+"""
+import argparse
+import statistics
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+CORPUS_DIR = Path(__file__).parent / "corpus"
+LISTING_SELECTOR = 'div.flex.flex-col.sm\\:flex-row'
+
+# path prefix -> (content type, body size, server delay in seconds)
+RESOURCES = {
+    "/valentina_media/": ("image/jpeg", 120_000, 0.05),
+    "/_nuxt/fonts/": ("font/woff2", 60_000, 0.05),
+    "/tag/js/gpt.js": ("application/javascript", 150_000, 0.3),
+    "/gtm.js": ("application/javascript", 90_000, 0.2),
+    "/_nuxt/entry.css": ("text/css", 40_000, 0.0),
+}
+
+
+class FixtureServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, page: str):
+        super().__init__(("127.0.0.1", 0), FixtureHandler)
+        self.page = page.encode("utf-8")
+        self.bytes_sent = 0
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def count(self, size: int):
+        with self.lock:
+            self.bytes_sent += size
+            self.requests += 1
+
+    def reset(self):
+        with self.lock:
+            self.bytes_sent = 0
+            self.requests = 0
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path in ("/", "/index.html"):
+            self._reply("text/html; charset=utf-8", self.server.page)
+            return
+        for prefix, (content_type, size, delay) in RESOURCES.items():
+            if self.path.startswith(prefix):
+                time.sleep(delay)
+                self._reply(content_type, b"\0" * size)
+                return
+        self._reply("text/plain", b"", status=404)
+
+    def _reply(self, content_type: str, body: bytes, status: int = 200):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Cache-Control", "no-store")
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.count(len(body))
+
+    def log_message(self, *args):
+        pass
+
+
+def localize(page: str) -> str:
+    """
+    Points the page's third-party resources at the fixture server and adds the usual trackers.
+    """
+    page = page.replace("https://cloud.funda.nl/valentina_media/", "/valentina_media/")
+    page = page.replace("https://securepubads.g.doubleclick.net/tag/js/gpt.js", "/tag/js/gpt.js")
+    page = page.replace(
+        "</head>",
+        '<script async src="/gtm.js?id=GTM-XXXX"></script>'
+        '<style>@font-face{font-family:P;src:url(/_nuxt/fonts/ProximaNova-Bold.woff2)}body{font-family:P}</style>'
+        "</head>",
+    )
+    # Real result pages load the photos eagerly for the first screen of cards
+    return page.replace(' loading="lazy"', "")
+
+
+def measure(url: str, server: FixtureServer, blocking: bool, runs: int):
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support import expected_conditions as EC
+    from selenium.webdriver.support.ui import WebDriverWait
+
+    from browser import block_resources, create_driver
+    from settings import DEFAULT_BLOCKED_URL_PATTERNS
+
+    driver = create_driver()
+    try:
+        driver.execute_cdp_cmd("Network.enable", {})
+        driver.execute_cdp_cmd("Network.setCacheDisabled", {"cacheDisabled": True})
+        if blocking:
+            block_resources(driver, DEFAULT_BLOCKED_URL_PATTERNS)
+        timings, transferred, requests = [], [], []
+        for _ in range(runs):
+            server.reset()
+            start = time.perf_counter()
+            driver.get(url)
+            WebDriverWait(driver, 30).until(EC.presence_of_element_located((By.CSS_SELECTOR, LISTING_SELECTOR)))
+            timings.append(time.perf_counter() - start)
+            # Let late async requests land before reading the counters
+            time.sleep(0.5)
+            transferred.append(server.bytes_sent)
+            requests.append(server.requests)
+        return timings, transferred, requests
+    finally:
+        driver.quit()
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--runs", type=int, default=5)
+    arg_parser.add_argument("--page", default="results_02.html", help="corpus page to serve")
+    args = arg_parser.parse_args()
+
+    server = FixtureServer(localize((CORPUS_DIR / args.page).read_text(encoding="utf-8")))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/"
+
+    print(f"{'blocking':<10}{'time-to-selector ms':>21}{'KiB served':>12}{'requests':>10}")
+    try:
+        for blocking in (False, True):
+            timings, transferred, requests = measure(url, server, blocking, args.runs)
+            print(
+                f"{'on' if blocking else 'off':<10}"
+                f"{statistics.median(timings) * 1000:>21.0f}"
+                f"{statistics.median(transferred) / 1024:>12.0f}"
+                f"{statistics.median(requests):>10.0f}"
+            )
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+"""
+Offline benchmark of the result page parser engines over the checked-in corpus.
+
+Every engine runs in a fresh process, so peak RSS is not polluted by the others.
+Reports pages/sec, µs per listing, peak Python and RSS memory, and how many
+fields match corpus/expected.json, plus the cost of the fingerprint that lets
+unchanged pages skip the parse and of classifying a listing's list items.
+
+    python bench/bench_parser.py [--engine lxml] [--repeat 20] [--check]
+
+With --check, the exit status is non-zero when an engine misses listings, gets
+fewer than --min-fields of the values right, overall or in any one field, or
+disagrees with another engine, so selector breakage is visible in CI.
+"""
+import argparse
+import json
+import multiprocessing
+import resource
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+CORPUS_DIR = Path(__file__).parent / "corpus"
+FIELDS = (
+    "url", "street_house", "postal_code_city", "price",
+    "size", "bedrooms", "energy_rating", "makelaar_text",
+)
+
+
+def load_corpus(corpus_dir: Path):
+    with open(corpus_dir / "expected.json", encoding="utf-8") as f:
+        expected = json.load(f)
+    pages = {name: (corpus_dir / name).read_text(encoding="utf-8") for name in sorted(expected)}
+    return pages, expected
+
+
+def run_engine(engine: str, corpus_dir: str, repeat: int):
+    """
+    Benchmarks one engine. Runs inside a fresh child process.
+    """
+    from loguru import logger
+    from parsing import parse_homes
+
+    logger.remove()
+    pages, expected = load_corpus(Path(corpus_dir))
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # Warm up and collect the output used for the correctness report
+    results = {name: [{field: getattr(home, field) for field in FIELDS} for home in parse_homes(source, engine)]
+               for name, source in pages.items()}
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for source in pages.values():
+            parse_homes(source, engine)
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    python_peak = 0
+    for source in pages.values():
+        tracemalloc.reset_peak()
+        parse_homes(source, engine)
+        python_peak = max(python_peak, tracemalloc.get_traced_memory()[1])
+    tracemalloc.stop()
+
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return {
+        "engine": engine,
+        "elapsed": elapsed,
+        "pages": len(pages) * repeat,
+        "listings": sum(len(homes) for homes in results.values()) * repeat,
+        "python_peak": python_peak,
+        # ru_maxrss is in KiB on Linux
+        "rss_growth": (rss_after - rss_before) * 1024,
+        "results": results,
+    }
+
+
+def time_fingerprint(corpus_dir: Path, repeat: int) -> float:
+    """
+    Returns the seconds per page of the change-detection fingerprint that runs before a parse.
+    """
+    from parsing import page_fingerprint
+
+    pages, _ = load_corpus(corpus_dir)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for source in pages.values():
+            page_fingerprint(source)
+    return (time.perf_counter() - start) / (len(pages) * repeat)
+
+
+def time_classifier(corpus_dir: Path, repeat: int) -> tuple[float, int]:
+    """
+    Returns the seconds per listing of classifying its list items, and the number of items seen.
+    """
+    from lxml import html
+    from parsing import XP_CONTAINERS, XP_LIST_ITEMS, XP_SVG_PATH, _text, classify_list_items
+
+    pages, _ = load_corpus(corpus_dir)
+    listings = []
+    for source in pages.values():
+        for container in XP_CONTAINERS(html.fromstring(source)):
+            listings.append([(_text(item), XP_SVG_PATH(item)[0].get("d", ""))
+                             for item in XP_LIST_ITEMS(container) if XP_SVG_PATH(item)])
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for items in listings:
+            classify_list_items(items)
+    return (time.perf_counter() - start) / (len(listings) * repeat), sum(map(len, listings))
+
+
+def score(results: dict, expected: dict):
+    """
+    Returns the number of listings found and the per-field count of correct values.
+    """
+    found = 0
+    correct = dict.fromkeys(FIELDS, 0)
+    for name, wanted in expected.items():
+        parsed = {home["url"]: home for home in results.get(name, [])}
+        for listing in wanted:
+            home = parsed.get(listing["url"])
+            if home is None:
+                continue
+            found += 1
+            for field in FIELDS:
+                if home[field] == listing[field]:
+                    correct[field] += 1
+    return found, correct
+
+
+def main():
+    from parsing import PARSER_ENGINES
+
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--engine", action="append", choices=sorted(PARSER_ENGINES),
+                            help="engine to benchmark, may be repeated (default: all)")
+    arg_parser.add_argument("--repeat", type=int, default=20, help="timed passes over the corpus")
+    arg_parser.add_argument("--corpus", type=Path, default=CORPUS_DIR)
+    arg_parser.add_argument("--check", action="store_true", help="fail on missed listings, wrong fields or engine disagreement")
+    arg_parser.add_argument("--min-fields", type=float, default=0.9,
+                            help="share of correct values, overall and per field, below which --check fails")
+    args = arg_parser.parse_args()
+
+    engines = args.engine or sorted(PARSER_ENGINES)
+    _, expected = load_corpus(args.corpus)
+    total_listings = sum(len(listings) for listings in expected.values())
+
+    context = multiprocessing.get_context("spawn")
+    reports = []
+    for engine in engines:
+        with context.Pool(1) as pool:
+            reports.append(pool.apply(run_engine, (engine, str(args.corpus), args.repeat)))
+
+    print(f"Corpus: {len(expected)} pages, {total_listings} listings, {args.repeat} passes\n")
+    print(f"{'engine':<8}{'pages/s':>10}{'µs/listing':>12}{'py peak KiB':>13}{'rss +MiB':>10}{'found':>9}{'fields ok':>11}")
+    failed = False
+    for report in reports:
+        found, correct = score(report["results"], expected)
+        fields_ok = sum(correct.values()) / (total_listings * len(FIELDS)) if total_listings else 1.0
+        per_listing = report["elapsed"] / report["listings"] * 1e6 if report["listings"] else 0.0
+        print(
+            f"{report['engine']:<8}"
+            f"{report['pages'] / report['elapsed']:>10.1f}"
+            f"{per_listing:>12.1f}"
+            f"{report['python_peak'] / 1024:>13.0f}"
+            f"{report['rss_growth'] / 2 ** 20:>10.1f}"
+            f"{f'{found}/{total_listings}':>9}"
+            f"{fields_ok:>10.1%}"
+        )
+        report["correct"] = correct
+        failed |= found != total_listings or fields_ok < args.min_fields
+        # A single field can be mislabelled on every listing while the overall share stays high
+        failed |= any(correct[field] < total_listings * args.min_fields for field in FIELDS)
+
+    print("\nField completeness (share of listings with the expected value):")
+    print(f"{'field':<18}" + "".join(f"{report['engine']:>8}" for report in reports))
+    for field in FIELDS:
+        row = "".join(
+            f"{report['correct'][field] / total_listings if total_listings else 1.0:>8.0%}" for report in reports
+        )
+        print(f"{field:<18}{row}")
+
+    fingerprint = time_fingerprint(args.corpus, args.repeat)
+    print(f"\nUnchanged-page fingerprint: {fingerprint * 1e6:.0f} µs/page, "
+          + ", ".join(f"{fingerprint / (report['elapsed'] / report['pages']):.0%} of a {report['engine']} parse"
+                      for report in reports))
+    classify, items = time_classifier(args.corpus, args.repeat)
+    print(f"List item classification: {classify * 1e6:.1f} µs/listing ({items} items in the corpus)")
+
+    reference = reports[0]
+    for report in reports[1:]:
+        if report["results"] != reference["results"]:
+            print(f"\n{report['engine']} output differs from {reference['engine']}")
+            failed = True
+
+    if args.check and failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
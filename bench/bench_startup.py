@@ -0,0 +1,218 @@
+"""
+Measures how fast the bot comes up.
+
+Reports the import time of main.py and of the parser stack it defers, then
+starts `python main.py` against a local fake Telegram Bot API server
+(TELEGRAM_API_SERVER). The fake server hands the bot a /start command as soon as it
+polls for updates. Reported times run from process start to:
+
+- the first getUpdates, when the dispatcher answers commands
+- the reply to /start
+- the owner's "Scanner ready" message, or the error report when the browsers
+  cannot start (e.g. without Chrome)
+
+Runs in a temporary directory with a copy of settings.json. Needs no network access.
+
+    python bench/bench_startup.py [--runs 3] [--timeout 60]
+"""
+import argparse
+import json
+import os
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs
+
+ROOT = Path(__file__).resolve().parent.parent
+OWNER_ID = 1000
+TOKEN = "123456:bench"
+
+
+class FakeTelegram(ThreadingHTTPServer):
+    """
+    Just enough of the Bot API for the bot to start, poll and answer.
+    """
+    daemon_threads = True
+
+    def __init__(self, handler=None):
+        super().__init__(("127.0.0.1", 0), handler or FakeTelegramHandler)
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.events: list[tuple[float, str, dict]] = []  # (time, method, fields)
+            self.command_sent = False
+
+    def record(self, method: str, fields: dict):
+        with self.lock:
+            self.events.append((time.monotonic(), method, fields))
+
+    def first(self, predicate) -> float | None:
+        with self.lock:
+            return next((at for at, method, fields in self.events if predicate(method, fields)), None)
+
+
+class FakeTelegramHandler(BaseHTTPRequestHandler):
+    server: FakeTelegram
+
+    def log_message(self, format, *args):
+        pass
+
+    def fields(self) -> dict:
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        content_type = self.headers.get("Content-Type", "")
+        if content_type.startswith("multipart/"):
+            message = BytesParser(policy=HTTP).parsebytes(
+                f"Content-Type: {content_type}\r\n\r\n".encode() + body
+            )
+            return {part.get_param("name", header="content-disposition"): part.get_content()
+                    for part in message.iter_parts()}
+        return {key: values[0] for key, values in parse_qs(body.decode()).items()}
+
+    def do_POST(self):
+        method = self.path.rsplit("/", 1)[-1]
+        fields = self.fields()
+        self.server.record(method, fields)
+        response = self.reply(method, fields)
+        self.respond(response, response.get("error_code", 200))
+
+    def reply(self, method: str, fields: dict) -> dict:
+        """
+        Returns the Bot API response to a method call.
+        """
+        if method == "getMe":
+            result = {"id": 42, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+        elif method == "getUpdates":
+            result = []
+            with self.server.lock:
+                send_command = not self.server.command_sent
+                self.server.command_sent = True
+            if send_command:
+                result = [{"update_id": 1, "message": {
+                    "message_id": 1, "date": int(time.time()), "text": "/start",
+                    "chat": {"id": OWNER_ID, "type": "private"},
+                    "from": {"id": OWNER_ID, "is_bot": False, "first_name": "Owner"},
+                    "entities": [{"type": "bot_command", "offset": 0, "length": 6}],
+                }}]
+            else:
+                time.sleep(1)  # a short long poll
+        elif method == "sendMessage":
+            result = {"message_id": len(self.server.events), "date": int(time.time()), "text": fields.get("text", ""),
+                      "chat": {"id": int(fields.get("chat_id", 0)), "type": "private"}}
+        else:
+            result = True
+        return {"ok": True, "result": result}
+
+    def respond(self, response: dict, status: int = 200):
+        payload = json.dumps(response).encode()
+        try:
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # The bot was stopped during a long poll
+
+
+def import_time(module: str, workdir: str, env: dict) -> float:
+    """
+    Seconds to import the module in a fresh interpreter.
+    """
+    code = f"import sys, time; sys.path.insert(0, {str(ROOT)!r}); t = time.perf_counter(); import {module}; " \
+           f"print(time.perf_counter() - t)"
+    output = subprocess.run([sys.executable, "-c", code], cwd=workdir, env=env, capture_output=True, text=True,
+                            check=True).stdout
+    return float(output.split()[-1])
+
+
+def run_bot(server: FakeTelegram, workdir: str, env: dict, timeout: float) -> dict:
+    """
+    Starts main.py and returns the seconds from process start to each startup milestone.
+    """
+    server.reset()
+    started = time.monotonic()
+    bot = subprocess.Popen([sys.executable, str(ROOT / "main.py")], cwd=workdir, env=env,
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+
+    def sent(text: str):
+        return lambda method, fields: method == "sendMessage" and text in fields.get("text", "")
+
+    milestones = {
+        "polling": lambda method, fields: method == "getUpdates",
+        "/start reply": sent("Hello!"),
+        "scanner ready": sent("Scanner ready"),
+        "scanner error": sent("Critical Error"),
+    }
+    deadline = started + timeout
+    try:
+        while time.monotonic() < deadline:
+            if server.first(milestones["scanner ready"]) or server.first(milestones["scanner error"]):
+                break
+            if bot.poll() is not None:
+                break
+            time.sleep(0.05)
+    finally:
+        # The whole session, so the parser pool's workers go too
+        os.killpg(bot.pid, signal.SIGKILL)
+        bot.wait()
+    results = {}
+    for name, predicate in milestones.items():
+        at = server.first(predicate)
+        results[name] = at - started if at is not None else None
+    return results
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--runs", type=int, default=3)
+    arg_parser.add_argument("--timeout", type=float, default=60, help="seconds to wait for the scanner per run")
+    args = arg_parser.parse_args()
+
+    server = FakeTelegram()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    env = {
+        **os.environ,
+        "TELEGRAM_BOT_TOKEN": TOKEN,
+        "OWNER_ID": str(OWNER_ID),
+        "TELEGRAM_API_SERVER": f"http://127.0.0.1:{server.server_address[1]}",
+    }
+
+    with tempfile.TemporaryDirectory(prefix="funda-startup-") as workdir:
+        with open(ROOT / "settings.json") as f:
+            settings = json.load(f)
+        settings["_admins_ids"] = [OWNER_ID]
+        settings["_known_chats"] = []
+        settings["_metrics_port"] = 0
+        with open(os.path.join(workdir, "settings.json"), "w") as f:
+            json.dump(settings, f)
+
+        imports = {module: statistics.median(import_time(module, workdir, env) for _ in range(args.runs))
+                   for module in ("main", "parser")}
+        print(f"Import main.py: {imports['main'] * 1000:.0f} ms; "
+              f"deferred parser stack: {imports['parser'] * 1000:.0f} ms (median of {args.runs})\n")
+
+        runs = [run_bot(server, workdir, env, args.timeout) for _ in range(args.runs)]
+
+    print(f"{'seconds after process start':<30}" + "".join(f"{f'run {i + 1}':>9}" for i in range(len(runs)))
+          + f"{'median':>9}")
+    for milestone in runs[0]:
+        values = [run[milestone] for run in runs]
+        known = [value for value in values if value is not None]
+        cells = "".join(f"{value:>9.2f}" if value is not None else f"{'-':>9}" for value in values)
+        median = f"{statistics.median(known):>9.2f}" if known else f"{'-':>9}"
+        print(f"{milestone:<30}{cells}{median}")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
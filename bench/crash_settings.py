@@ -0,0 +1,109 @@
+"""
+Crash test for settings persistence.
+
+A child process keeps appending to settings.known_chats (an in-place list
+mutation) and flushes every few changes, printing each flushed value. The parent
+SIGKILLs it at a random moment and checks settings.json: it must parse, hold a
+gap-free run of the appended values and include everything acknowledged as
+flushed. Runs in a temporary directory, the real settings.json is only read.
+
+    python bench/crash_settings.py [--runs 30] [--legacy]
+
+--legacy replays the old save(): open("w") plus json.dump on every change,
+which can leave a torn or empty file behind.
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+FLUSH_EVERY = 50
+
+CHILD = """
+import asyncio, json, sys
+sys.path.insert(0, {root!r})
+from loguru import logger
+logger.remove()
+from settings import settings
+if {legacy}:
+    settings._writer.mark_dirty = lambda: None
+
+async def main():
+    i = 0
+    while True:
+        i += 1
+        settings.known_chats.append(i)
+        if {legacy}:
+            with open("settings.json", "w") as f:
+                json.dump(settings._snapshot(), f)
+        elif i % {flush_every} == 0:
+            settings.flush()
+            print(i, flush=True)
+        await asyncio.sleep(0)
+
+asyncio.run(main())
+"""
+
+
+def run_once(workdir: str, legacy: bool) -> tuple[str, int, int]:
+    """
+    Returns (outcome, acknowledged, persisted) for one crash.
+    """
+    code = CHILD.format(root=str(ROOT), legacy=legacy, flush_every=FLUSH_EVERY)
+    child = subprocess.Popen(
+        [sys.executable, "-c", code], cwd=workdir, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True
+    )
+    time.sleep(random.uniform(0.5, 1.5))
+    child.send_signal(signal.SIGKILL)
+    output, _ = child.communicate()
+    acknowledged = int(output.split()[-1]) if output.split() else 0
+
+    try:
+        with open(os.path.join(workdir, "settings.json")) as f:
+            chats = json.load(f)["_known_chats"]
+    except (ValueError, KeyError):
+        return "torn", acknowledged, -1
+    appended = [chat for chat in chats if chat > 0]
+    if appended != list(range(1, len(appended) + 1)):
+        return "gap", acknowledged, len(appended)
+    if len(appended) < acknowledged:
+        return "lost", acknowledged, len(appended)
+    return "ok", acknowledged, len(appended)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--runs", type=int, default=30)
+    arg_parser.add_argument("--legacy", action="store_true", help="use the old non-atomic save")
+    args = arg_parser.parse_args()
+
+    outcomes = {}
+    for run in range(args.runs):
+        with tempfile.TemporaryDirectory() as workdir:
+            with open(ROOT / "settings.json") as f:
+                original = json.load(f)
+            # Negative ids, so the appended values are easy to tell apart
+            original["_known_chats"] = [-1]
+            with open(os.path.join(workdir, "settings.json"), "w") as f:
+                json.dump(original, f)
+            outcome, acknowledged, persisted = run_once(workdir, args.legacy)
+            leftovers = [name for name in os.listdir(workdir) if name.endswith(".tmp")]
+            shutil.rmtree(workdir, ignore_errors=True)
+        outcomes[outcome] = outcomes.get(outcome, 0) + 1
+        print(f"run {run + 1:>3}: {outcome:<5} acknowledged {acknowledged:>6} persisted {persisted:>6}"
+              f"{' tmp files left: ' + str(len(leftovers)) if leftovers else ''}")
+
+    print(", ".join(f"{outcome}: {count}" for outcome, count in sorted(outcomes.items())))
+    sys.exit(0 if set(outcomes) <= {"ok"} else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,556 @@
+"""
+End-to-end load test of scanning and delivery.
+
+Runs the bot (main.py, in a child process) against two local servers:
+
+- a fake Funda that serves result pages for every search, built from the corpus
+  card markup. New listings appear at --rate per minute, spread over the
+  searches, plus a --burst of listings at once after --burst-at seconds.
+- a fake Telegram Bot API that enforces Telegram's rate limits (30 messages per
+  second overall, about one per second per private chat, 20 per minute per
+  group) and answers 429 with retry_after beyond them.
+
+Pages are fetched by a stand-in for Chrome that loads them over HTTP and takes
+--load-time seconds per page. --chrome uses real browsers instead; detail page
+lookups are then off, as detail links point at funda.nl.
+
+Generation starts once every search has been polled. The report covers the time
+from a listing's appearance to its delivery, Telegram sends and rejections, and
+CPU, memory and browser count of the bot's process tree. Runs in a temporary
+directory with a copy of settings.json. Needs no network access.
+
+    python bench/loadtest.py [--searches 50] [--chats 500] [--rate 30] [--burst 100] [--duration 180]
+"""
+import argparse
+import json
+import math
+import os
+import random
+import re
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+from urllib.request import urlopen
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import make_corpus  # noqa: E402
+from bench_startup import OWNER_ID, TOKEN, FakeTelegram, FakeTelegramHandler  # noqa: E402
+from replay import ReplayDriver  # noqa: E402
+
+FUNDA = "https://www.funda.nl"
+SEARCH_PATH = "/zoeken/huur"
+PER_PAGE = 15
+# Listings kept per search feed, enough for every result page the scanner fetches
+FEED_LENGTH = 100
+LISTING_ID_RE = re.compile(r"/(43\d{6})/")
+# Telegram's limits as enforced by the fake API: (messages per second, burst)
+GLOBAL_LIMIT = (30, 30)
+PRIVATE_CHAT_LIMIT = (1, 3)
+GROUP_CHAT_LIMIT = (20 / 60, 20)
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+# Stand-in for the Nuxt state payload that makes up most of a real page, as in the corpus
+FILLER = "".join(f'{{"id":{i},"type":"ListingTile","props":{{"a":"{"x" * 40}"}}}},' for i in range(800))
+DETAIL_PAGE = """<!DOCTYPE html><html><body><main><dl>
+<dt>Available</dt><dd>Immediately</dd>
+<dt>Deposit</dt><dd>€ 3.000</dd>
+<dt>Interior</dt><dd>Upholstered</dd>
+<dt>Service costs</dt><dd>€ 75 per month</dd>
+</dl></main></body></html>"""
+
+CHILD = """
+import asyncio, sys
+sys.path.insert(0, {root!r})
+sys.path.insert(0, {bench!r})
+from loguru import logger
+logger.remove()
+logger.add(sys.stderr, level="WARNING")
+import main
+from parser import FundaParser
+from loadtest import LoadDriver
+if {chrome}:
+    main.parser = FundaParser()
+else:
+    main.parser = FundaParser(driver_factory=lambda: LoadDriver({funda_url!r}, {load_time}))
+asyncio.run(main.main())
+"""
+
+
+def make_card(n: int) -> str:
+    """
+    Markup of result card n, the same on every call.
+    """
+    state = random.getstate()
+    random.seed(n)
+    try:
+        return make_corpus.listing(n)[0]
+    finally:
+        random.setstate(state)
+
+
+class FakeFunda(ThreadingHTTPServer):
+    """
+    Result pages of numbered searches, newest listings first.
+    """
+    daemon_threads = True
+
+    def __init__(self, searches: int, seed: int = 1):
+        super().__init__(("127.0.0.1", 0), FakeFundaHandler)
+        self.lock = threading.Lock()
+        self.random = random.Random(seed)
+        self.feeds: list[list[str]] = [[] for _ in range(searches)]
+        self.polls = [0] * searches  # first result page requests per search
+        # listing id -> (time it appeared, search index), for listings added after the start
+        self.appeared: dict[int, tuple[float, int]] = {}
+        self.next_listing = 0
+        for search in range(searches):
+            self.add_listings(PER_PAGE, search, track=False)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def search_url(self, search: int) -> str:
+        return f"{self.url}{SEARCH_PATH}?search={search}&sort=%22date_down%22"
+
+    def add_listings(self, count: int, search: int = None, track: bool = True):
+        """
+        Puts count new listings on top of the search's feed, or of random searches.
+        """
+        with self.lock:
+            for _ in range(count):
+                index = search if search is not None else self.random.randrange(len(self.feeds))
+                n = self.next_listing
+                self.next_listing += 1
+                feed = self.feeds[index]
+                feed.insert(0, make_card(n))
+                del feed[FEED_LENGTH:]
+                if track:
+                    self.appeared[43000000 + n] = (time.monotonic(), index)
+
+    def page(self, search: int, number: int) -> str:
+        with self.lock:
+            self.polls[search] += number == 1
+            cards = self.feeds[search][(number - 1) * PER_PAGE:number * PER_PAGE]
+        return f'''<!DOCTYPE html>
+<html lang="en"><head><meta charset="utf-8"><title>Huurwoningen | Funda</title></head>
+<body><div id="__nuxt"><main class="container"><h1 class="text-2xl">Search {search}</h1>
+<div class="flex flex-col gap-3 pt-4">{"".join(cards)}
+</div></main></div>
+<script id="__NUXT_DATA__" type="application/json">[{FILLER}{{}}]</script>
+</body></html>'''
+
+
+class FakeFundaHandler(BaseHTTPRequestHandler):
+    server: FakeFunda
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        query = parse_qs(parts.query)
+        if parts.path == SEARCH_PATH and "search" in query:
+            body = self.server.page(int(query["search"][0]), int(query.get("search_result", ["1"])[0]))
+        elif parts.path.startswith("/detail/"):
+            body = DETAIL_PAGE
+        else:
+            body = "<html><body></body></html>"
+        payload = body.encode("utf-8")
+        try:
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+
+class LoadDriver(ReplayDriver):
+    """
+    Stands in for Chrome: loads pages from the fake Funda over HTTP, taking at least load_time seconds.
+    """
+
+    def __init__(self, funda_url: str, load_time: float = 1.0):
+        self.funda_url = funda_url
+        self.load_time = load_time
+        self.current_url = ""
+        self.page_source = ""
+        self.recorded = False
+
+    def get(self, url: str):
+        started = time.monotonic()
+        self.current_url = url
+        with urlopen(url.replace(FUNDA, self.funda_url), timeout=30) as response:
+            self.page_source = response.read().decode("utf-8")
+        # Checks for the content markers like a recorded page
+        self.recorded = True
+        time.sleep(max(0.0, self.load_time - (time.monotonic() - started)))
+
+
+class Bucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def wait_time(self, now: float) -> float:
+        """
+        Takes a token and returns 0, or returns the seconds until one is available.
+        """
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class RateLimitedTelegram(FakeTelegram):
+    """
+    The fake Bot API with Telegram's flood limits. Keeps every delivered message.
+    """
+
+    def __init__(self, api_latency: float = 0.0):
+        super().__init__(RateLimitedHandler)
+        self.api_latency = api_latency
+        self.global_bucket = Bucket(*GLOBAL_LIMIT)
+        self.chat_buckets: dict[int, Bucket] = {}
+        self.delivered: list[tuple[float, int, str]] = []  # (time, chat id, text)
+        self.rejected = 0
+
+    def admit(self, chat_id: int) -> int:
+        """
+        Returns 0 if the message may be sent now, otherwise the retry_after to answer.
+        """
+        with self.lock:
+            now = time.monotonic()
+            bucket = self.chat_buckets.get(chat_id)
+            if bucket is None:
+                bucket = self.chat_buckets[chat_id] = Bucket(*(GROUP_CHAT_LIMIT if chat_id < 0 else PRIVATE_CHAT_LIMIT))
+            wait = bucket.wait_time(now)
+            if not wait:
+                wait = self.global_bucket.wait_time(now)
+                if wait:
+                    bucket.tokens += 1  # The chat's token was not used
+            if wait:
+                self.rejected += 1
+            return math.ceil(wait)
+
+    def deliver(self, chat_id: int, text: str):
+        with self.lock:
+            self.delivered.append((time.monotonic(), chat_id, text))
+
+
+class RateLimitedHandler(FakeTelegramHandler):
+    server: RateLimitedTelegram
+
+    def reply(self, method: str, fields: dict) -> dict:
+        if method != "sendMessage":
+            return super().reply(method, fields)
+        time.sleep(self.server.api_latency)
+        chat_id = int(fields.get("chat_id", 0))
+        retry_after = self.server.admit(chat_id)
+        if retry_after:
+            return {"ok": False, "error_code": 429, "description": f"Too Many Requests: retry after {retry_after}",
+                    "parameters": {"retry_after": retry_after}}
+        self.server.deliver(chat_id, fields.get("text", ""))
+        return super().reply(method, fields)
+
+
+def process_tree_usage(root_pid: int) -> tuple[float, int]:
+    """
+    Returns the CPU seconds and resident bytes of a process and its descendants, from /proc.
+    """
+    parents, usage = {}, {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", "rb") as f:
+                stat = f.read()
+        except OSError:
+            continue
+        fields = stat[stat.rfind(b")") + 2:].split()
+        pid = int(entry)
+        parents[pid] = int(fields[1])
+        usage[pid] = ((int(fields[11]) + int(fields[12])) / CLOCK_TICKS, int(fields[21]) * PAGE_SIZE)
+    children: dict[int, list[int]] = {}
+    for pid, ppid in parents.items():
+        children.setdefault(ppid, []).append(pid)
+    cpu, rss, stack = 0.0, 0, [root_pid]
+    while stack:
+        pid = stack.pop()
+        pid_cpu, pid_rss = usage.get(pid, (0.0, 0))
+        cpu += pid_cpu
+        rss += pid_rss
+        stack.extend(children.get(pid, ()))
+    return cpu, rss
+
+
+def scrape(url: str) -> dict[str, float]:
+    """
+    Reads the bot's /metrics into {sample with labels: value}.
+    """
+    samples = {}
+    with urlopen(url, timeout=5) as response:
+        for line in response.read().decode().splitlines():
+            if line and not line.startswith("#"):
+                name, value = line.rsplit(" ", 1)
+                samples[name] = float(value)
+    return samples
+
+
+def metric_total(samples: dict[str, float], name: str) -> float:
+    return sum(value for sample, value in samples.items() if sample.split("{")[0] == name)
+
+
+class Sampler(threading.Thread):
+    """
+    Samples the bot's process tree and metrics once a second.
+    """
+
+    def __init__(self, pid: int, metrics_url: str):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.metrics_url = metrics_url
+        self.cpu = 0.0
+        self.peak_rss = 0
+        self.peak_browsers = 0
+        self.peak_queue = 0
+        self.samples: dict[str, float] = {}
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(1.0):
+            cpu, rss = process_tree_usage(self.pid)
+            self.cpu = max(self.cpu, cpu)
+            self.peak_rss = max(self.peak_rss, rss)
+            try:
+                self.samples = scrape(self.metrics_url)
+            except OSError:
+                continue  # Not serving yet
+            self.peak_browsers = max(self.peak_browsers, metric_total(self.samples, "browsers_running"))
+            self.peak_queue = max(self.peak_queue, metric_total(self.samples, "funda_message_queue_depth"))
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def percentiles(values: list[float]) -> str:
+    if not values:
+        return "-"
+    ordered = sorted(values)
+    pick = lambda fraction: ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+    return f"p50 {pick(0.5):.1f}, p95 {pick(0.95):.1f}, p99 {pick(0.99):.1f}, max {ordered[-1]:.1f}"
+
+
+def search_chats(search: int, chats: list[int], per_search: int) -> list[int]:
+    if not per_search:
+        return []  # every known chat
+    return [chats[(search * per_search + i) % len(chats)] for i in range(per_search)]
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("--searches", type=int, default=50)
+    arg_parser.add_argument("--chats", type=int, default=500, help="known chats, every other one a group")
+    arg_parser.add_argument("--chats-per-search", type=int, default=10, help="0 sends every search to every chat")
+    arg_parser.add_argument("--rate", type=float, default=30, help="new listings per minute over all searches")
+    arg_parser.add_argument("--burst", type=int, default=100, help="listings appearing at once")
+    arg_parser.add_argument("--burst-at", type=float, default=60, help="seconds into the run")
+    arg_parser.add_argument("--duration", type=float, default=180, help="seconds of listing generation")
+    arg_parser.add_argument("--drain", type=float, default=300, help="seconds to wait for deliveries afterwards")
+    arg_parser.add_argument("--warmup", type=float, default=300, help="seconds to wait for the first polls")
+    arg_parser.add_argument("--interval", type=int, default=10, help="poll interval of every search")
+    arg_parser.add_argument("--browsers", type=int, default=2)
+    arg_parser.add_argument("--load-time", type=float, default=1.0, help="seconds per page load, without --chrome")
+    arg_parser.add_argument("--api-latency", type=float, default=0.05, help="seconds per Bot API call")
+    arg_parser.add_argument("--chrome", action="store_true", help="fetch with real browsers")
+    arg_parser.add_argument("--seed", type=int, default=1)
+    args = arg_parser.parse_args()
+
+    funda = FakeFunda(args.searches, args.seed)
+    telegram = RateLimitedTelegram(args.api_latency)
+    for server in (funda, telegram):
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    chats = [-(1000000 + i) if i % 2 else 2000000 + i for i in range(args.chats)]
+    metrics_port = free_port()
+
+    with tempfile.TemporaryDirectory(prefix="funda-loadtest-") as workdir:
+        with open(ROOT / "settings.json") as f:
+            settings = json.load(f)
+        settings.update({
+            "_searches": [
+                {"id": i + 1, "url": funda.search_url(i), "interval": args.interval,
+                 "chats": search_chats(i, chats, args.chats_per_search)}
+                for i in range(args.searches)
+            ],
+            "_funda_url": funda.search_url(0),
+            "_known_chats": chats,
+            "_admins_ids": [OWNER_ID],
+            "_chat_filters": {},
+            "_fetch_backend": "browser",
+            "_browser_workers": args.browsers,
+            "_enrich_details": not args.chrome,
+            "_quiet_hours": [0, 0],
+            "_metrics_port": metrics_port,
+            "_record_dir": None,
+            "_queue_transport": "local",
+        })
+        with open(os.path.join(workdir, "settings.json"), "w") as f:
+            json.dump(settings, f)
+        env = {
+            **os.environ,
+            "TELEGRAM_BOT_TOKEN": TOKEN,
+            "OWNER_ID": str(OWNER_ID),
+            "TELEGRAM_API_SERVER": telegram_url(telegram),
+        }
+        code = CHILD.format(root=str(ROOT), bench=str(Path(__file__).resolve().parent), chrome=args.chrome,
+                            funda_url=funda.url, load_time=args.load_time)
+        with open(os.path.join(workdir, "bot.stderr"), "w") as log:
+            bot = subprocess.Popen([sys.executable, "-c", code], cwd=workdir, env=env, stdout=subprocess.DEVNULL,
+                                   stderr=log, start_new_session=True)
+        sampler = Sampler(bot.pid, f"http://127.0.0.1:{metrics_port}/metrics")
+        sampler.start()
+        try:
+            print(f"Waiting for the first polls of {args.searches} searches...")
+            deadline = time.monotonic() + args.warmup
+            while min(funda.polls) < 2 and time.monotonic() < deadline and bot.poll() is None:
+                time.sleep(0.5)
+            if bot.poll() is not None:
+                with open(os.path.join(workdir, "bot.stderr")) as f:
+                    sys.exit(f"The bot exited:\n{f.read()[-2000:]}")
+            print(f"Polled every search after {time.monotonic() - telegram_start(telegram):.0f} s, "
+                  f"generating listings for {args.duration:.0f} s...")
+
+            generate(funda, args)
+            print(f"Waiting up to {args.drain:.0f} s for deliveries...")
+            expected = expected_deliveries(funda, settings["_searches"], chats)
+            deadline = time.monotonic() + args.drain
+            while time.monotonic() < deadline and len(delivered_pairs(telegram, expected)) < len(expected):
+                time.sleep(1.0)
+        finally:
+            sampler.stopped.set()
+            try:
+                os.killpg(bot.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            bot.wait()
+
+    report(args, funda, telegram, sampler, settings["_searches"], chats)
+    for server in (funda, telegram):
+        server.shutdown()
+
+
+def telegram_url(telegram: RateLimitedTelegram) -> str:
+    return f"http://127.0.0.1:{telegram.server_address[1]}"
+
+
+def telegram_start(telegram: RateLimitedTelegram) -> float:
+    """
+    Time of the bot's first Bot API call, as the start of the run.
+    """
+    with telegram.lock:
+        return telegram.events[0][0] if telegram.events else time.monotonic()
+
+
+def generate(funda: FakeFunda, args):
+    """
+    Adds listings at random times at args.rate per minute, and the burst at args.burst_at.
+    """
+    started = time.monotonic()
+    burst_done = not args.burst
+    next_listing = started + (funda.random.expovariate(args.rate / 60) if args.rate else math.inf)
+    while True:
+        now = time.monotonic()
+        if now - started >= args.duration:
+            return
+        if not burst_done and now - started >= args.burst_at:
+            funda.add_listings(args.burst)
+            burst_done = True
+        if now >= next_listing:
+            funda.add_listings(1)
+            next_listing = now + funda.random.expovariate(args.rate / 60)
+        time.sleep(min(0.05, max(0.0, next_listing - now)))
+
+
+def expected_deliveries(funda: FakeFunda, searches: list[dict], chats: list[int]) -> set[tuple[int, int]]:
+    with funda.lock:
+        appeared = dict(funda.appeared)
+    return {
+        (listing_id, chat_id)
+        for listing_id, (_, search) in appeared.items()
+        for chat_id in (searches[search]["chats"] or chats)
+    }
+
+
+def delivered_pairs(telegram: RateLimitedTelegram, expected: set) -> dict[tuple[int, int], float]:
+    """
+    Maps every expected (listing id, chat) to the time of its first delivery.
+    """
+    with telegram.lock:
+        delivered = list(telegram.delivered)
+    first = {}
+    for at, chat_id, text in delivered:
+        for listing_id in LISTING_ID_RE.findall(text):
+            pair = (int(listing_id), chat_id)
+            if pair in expected and pair not in first:
+                first[pair] = at
+    return first
+
+
+def report(args, funda: FakeFunda, telegram: RateLimitedTelegram, sampler: Sampler, searches: list[dict],
+           chats: list[int]):
+    expected = expected_deliveries(funda, searches, chats)
+    first = delivered_pairs(telegram, expected)
+    per_listing: dict[int, list[float]] = {}
+    for (listing_id, _), at in first.items():
+        per_listing.setdefault(listing_id, []).append(at - funda.appeared[listing_id][0])
+    recipients = {listing_id: len(searches[search]["chats"] or chats)
+                  for listing_id, (_, search) in funda.appeared.items()}
+    complete = [max(latencies) for listing_id, latencies in per_listing.items()
+                if len(latencies) == recipients[listing_id]]
+    with telegram.lock:
+        delivered = list(telegram.delivered)
+    per_second: dict[int, int] = {}
+    for at, _, _ in delivered:
+        per_second[int(at)] = per_second.get(int(at), 0) + 1
+    wall = delivered[-1][0] - delivered[0][0] if len(delivered) > 1 else 0.0
+
+    print()
+    print(f"Load: {args.searches} searches every {args.interval} s, {len(chats)} chats "
+          f"({args.chats_per_search or 'all'} per search), {args.rate:g} new listings/min plus a burst of "
+          f"{args.burst} at {args.burst_at:g} s, for {args.duration:g} s")
+    print(f"Fetching: {args.browsers} {'Chrome' if args.chrome else f'fake browser(s), {args.load_time:g} s per page'}")
+    print(f"Listings: {len(funda.appeared)} appeared, {len(per_listing)} delivered to a chat, "
+          f"{len(complete)} to all their chats; deliveries {len(first)} of {len(expected)}")
+    print(f"Latency to the first chat (s): {percentiles([min(latencies) for latencies in per_listing.values()])}")
+    print(f"Latency to every chat (s):     {percentiles(complete)}")
+    print(f"Telegram: {len(delivered)} messages ({len(delivered) / wall if wall else 0:.1f}/s, "
+          f"peak {max(per_second.values(), default=0)}/s), {telegram.rejected} rejected with 429")
+    run_time = time.monotonic() - telegram_start(telegram)
+    print(f"Bot process tree: CPU {sampler.cpu:.1f} s ({sampler.cpu / run_time:.0%} of a core), "
+          f"peak RSS {sampler.peak_rss / 2 ** 20:.0f} MiB")
+    print(f"Browsers: peak {sampler.peak_browsers:.0f} running, "
+          f"{metric_total(sampler.samples, 'browser_restarts_total'):.0f} restarts; "
+          f"message queue: peak {sampler.peak_queue:.0f} waiting")
+
+
+if __name__ == "__main__":
+    main()
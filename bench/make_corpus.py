@@ -0,0 +1,167 @@
+"""
+Generates the anonymised result page corpus used by bench_parser.py.
+
+The pages copy the markup of live Funda result pages (containers, classes, SVG
+icons, GPT ad slots and the trailing Nuxt payload) with made-up addresses,
+prices and agencies. expected.json holds the field values a correct parser
+has to find on each page.
+
+    python bench/make_corpus.py
+"""
+import json
+import random
+from pathlib import Path
+
+CORPUS_DIR = Path(__file__).parent / "corpus"
+SEED = 7
+
+STREETS = ["Keizersgracht", "Prinsengracht", "Overtoom", "Van Baerlestraat", "Ferdinand Bolstraat",
+           "Javastraat", "Czaar Peterstraat", "Amstelveenseweg", "Bilderdijkstraat", "Kinkerstraat",
+           "Admiraal de Ruijterweg", "Jan Pieter Heijestraat", "Rijnstraat", "Scheldestraat", "Maasstraat"]
+CITIES = [("Amsterdam", 1011, 1109), ("Amstelveen", 1180, 1189), ("Diemen", 1110, 1113)]
+AGENCIES = ["Makelaardij Noord", "Huurwoningen Centrum", "Stadswonen B.V.", "Rental Partners & Co",
+            "De Grachtenmakelaar", "Zuid Vastgoed"]
+LABELS = ["A+++", "A++", "A+", "A", "B", "C", "D", "E", "F", "G"]
+# Only the bedroom and energy icons start like the ones on live pages ("M11 20", "M23.675"),
+# the parser's icon table knows no others. The size icon and the redrawn bedroom icon are
+# made up, so those facts have to be recognised by their text.
+SIZE_PATH = "M3 3h18v18H3z M7 7h10v10H7z"
+BED_PATH_OLD = "M11 20v-3H3v3H1V6h2v8h8V8h10a2 2 0 0 1 2 2v10h-2v-3H13v3z"
+BED_PATH_NEW = "M2 17h20v3h-2v-1H4v1H2zm1-6h18v5H3zm2-5h14v4H5z"
+ENERGY_PATH = "M23.675 4.3L12.2 15.8l-3.3-3.3-1.4 1.4 4.7 4.7L25.1 5.7z"
+FURNISHING_PATH = "M4 10V7a3 3 0 0 1 3-3h10a3 3 0 0 1 3 3v3"
+FURNISHINGS = ["Furnished", "Upholstered", "Gestoffeerd", "Kaal"]
+
+
+def listing(n, ad=False):
+    """
+    Returns the markup of one result card and the values a parser should extract from it.
+    """
+    street = random.choice(STREETS)
+    number = f"{random.randint(1, 400)}{random.choice(['', '', '-H', '-1', ' A', '-III'])}"
+    city, lo, hi = random.choice(CITIES)
+    postcode = f"{random.randint(lo, hi)} {random.choice('ABCDEFGHJKLMNPRSTVWXZ')}{random.choice('ABCDEFGHJKLMNPRSTVWXZ')}"
+    lid = 43000000 + n
+    kind = random.choice(["appartement", "huis"])
+    slug = street.lower().replace(" ", "-")
+    href = f"/detail/huur/{city.lower()}/{kind}-{slug}-{number.lower().replace(' ', '-')}/{lid}/"
+    if random.random() < 0.1:
+        href = "https://www.funda.nl" + href
+    price = random.randrange(1250, 3500, 25)
+    price_text = f"€ {price:,}".replace(",", ".") + random.choice([" /maand", " /month"])
+    size = random.randint(35, 160)
+    bedrooms = random.randint(1, 5)
+    has_energy = random.random() > 0.3
+    label = random.choice(LABELS)
+    bed_path = random.choice([BED_PATH_OLD, BED_PATH_NEW])
+    bed_word = random.choice(["", "", " bedrooms"])
+    items = [
+        f'<li class="flex items-center"><svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 24 24" class="mr-1 h-4 w-4"><path fill="currentColor" d="{SIZE_PATH}"></path></svg><span>{size} m²</span></li>',
+        f'<li class="flex items-center"><svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 24 24" class="mr-1 h-4 w-4"><path fill="currentColor" d="{bed_path}"></path></svg><span>{bedrooms}{bed_word}</span></li>',
+    ]
+    if has_energy:
+        items.append(
+            f'<li class="flex items-center"><svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 32 32" class="mr-1 h-4 w-4"><path fill="currentColor" d="{ENERGY_PATH}"></path></svg><span>{label}</span></li>'
+        )
+    if random.random() < 0.25:
+        # Extra card facts use their own icons and must not be taken for the energy label
+        items.append(
+            f'<li class="flex items-center"><svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 24 24" class="mr-1 h-4 w-4"><path fill="currentColor" d="{FURNISHING_PATH}"></path></svg><span>{random.choice(FURNISHINGS)}</span></li>'
+        )
+    agency = random.choice(AGENCIES)
+    has_agency = random.random() > 0.05
+    badge = '<div class="mb-1 flex"><span class="rounded-sm bg-primary-10 px-1 text-xs font-semibold">New</span></div>' if random.random() < 0.3 else ""
+    ad_html = ""
+    if ad:
+        ad_html = f'<div class="my-4 flex justify-center"><div id="div-gpt-ad-{random.randint(10**9, 10**10)}-{n}" data-google-query-id="CJ{n}"></div></div>'
+    agency_html = (
+        f'<a class="truncate text-secondary-70 hover:text-secondary-70-darken-1" href="/makelaar/{n % 97 + 1000}-{agency.lower().replace(" ", "-").replace("&", "en").replace(".", "")}/">{agency.replace("&", "&amp;")}</a>'
+        if has_agency else ""
+    )
+    expected = {
+        "url": href if href.startswith("http") else "https://www.funda.nl" + href,
+        "street_house": f"{street} {number}",
+        "postal_code_city": f"{postcode} {city}",
+        "price": price_text,
+        "size": f"{size} m²",
+        # A bare count under an unknown icon could be anything, so a parser must not guess
+        "bedrooms": f"{bedrooms}{bed_word}" if bed_path == BED_PATH_OLD or bed_word else None,
+        "energy_rating": label if has_energy else None,
+        "makelaar_text": agency if has_agency else None,
+    }
+    body = f'''
+<div class="border-b pb-3">{ad_html}
+  <div class="flex flex-col sm:flex-row">
+    <div class="relative h-[178px] shrink-0 sm:w-[262px]">
+      <a href="{href}" tabindex="-1"><img src="https://cloud.funda.nl/valentina_media/{lid % 1000}/{lid}_720x480.jpg" alt="" class="h-full w-full rounded object-cover" loading="lazy" srcset="https://cloud.funda.nl/valentina_media/{lid % 1000}/{lid}_360x240.jpg 360w"></a>
+      <button type="button" class="absolute right-2 top-2" aria-label="Save"><svg viewBox="0 0 24 24" class="h-6 w-6"><path d="M12 21l-1.4-1.3C5.4 15 2 12 2 8.5"></path></svg></button>
+    </div>
+    <div class="relative flex w-full min-w-0 flex-col pl-0 pt-4 sm:pl-4 sm:pt-0">
+      {badge}
+      <h2 class="mt-0"><a data-testid="listingDetailsAddress" class="text-secondary-70 visited:text-purple-80 hover:text-secondary-70-darken-1" href="{href}">
+        <div class="flex font-semibold"><span class="truncate">{street} {number}</span></div>
+        <div class="truncate text-neutral-80">{postcode} {city}</div>
+      </a></h2>
+      <div class="font-semibold mt-2 mb-0">
+        <div class="truncate">{price_text}</div>
+      </div>
+      <div class="mt-1 flex h-6 min-w-0 flex-wrap overflow-hidden">
+        <ul class="flex h-8 flex-wrap gap-4 overflow-hidden truncate py-1">
+          {"".join(items)}
+        </ul>
+      </div>
+      <div class="mt-2 flex">{agency_html}</div>
+    </div>
+  </div>
+</div>'''
+    return body, expected
+
+def page(idx, start, count, ads):
+    """
+    Writes one result page with count listings and ads interleaved ad slots.
+    """
+    listings, expected = [], []
+    ad_positions = set(random.sample(range(count), ads)) if ads else set()
+    for i in range(count):
+        body, exp = listing(start + i, ad=False)
+        listings.append(body); expected.append(exp)
+        if i in ad_positions:
+            ad_body, _ = listing(10**6 + start + i, ad=True)
+            listings.append(ad_body)
+    # Stand-in for the Nuxt state payload that makes up most of a real page
+    filler = "".join(f'{{"id":{i},"type":"ListingTile","props":{{"a":"{"x" * 40}"}}}},' for i in range(800))
+    html = f'''<!DOCTYPE html>
+<html lang="en"><head><meta charset="utf-8"><title>Huurwoningen in Amsterdam | Funda</title>
+<link rel="preload" href="/_nuxt/fonts/ProximaNova-Regular.woff2" as="font" type="font/woff2" crossorigin>
+<link rel="stylesheet" href="/_nuxt/entry.css">
+<script async src="https://securepubads.g.doubleclick.net/tag/js/gpt.js"></script>
+<script>window.dataLayer=window.dataLayer||[];</script>
+</head><body><div id="__nuxt"><header class="border-b"><nav class="flex"><a href="/">funda</a><a href="/huur/">Huur</a></nav></header>
+<main class="container"><h1 class="text-2xl">{count * 7} huurwoningen in Amsterdam</h1>
+<div class="flex flex-col gap-3 pt-4">{"".join(listings)}
+</div>
+<nav class="pagination"><a href="?search_result=2">2</a></nav></main>
+<footer class="bg-neutral-10"><p>&copy; funda</p></footer></div>
+<script id="__NUXT_DATA__" type="application/json">[{filler}{{}}]</script>
+</body></html>'''
+    (CORPUS_DIR / f"results_{idx:02d}.html").write_text(html, encoding="utf-8")
+    return expected
+
+
+def main():
+    random.seed(SEED)
+    CORPUS_DIR.mkdir(exist_ok=True)
+    # (listings, ad slots) per page; the last page is an empty search
+    plan = [(15, 0), (15, 2), (15, 3), (12, 1), (15, 0), (8, 2), (15, 1), (15, 4), (0, 0)]
+    expected = {}
+    start = 0
+    for idx, (count, ads) in enumerate(plan, 1):
+        expected[f"results_{idx:02d}.html"] = page(idx, start, count, ads)
+        start += count
+    with open(CORPUS_DIR / "expected.json", "w", encoding="utf-8") as f:
+        json.dump(expected, f, indent=1, ensure_ascii=False)
+    print(f"Wrote {len(plan)} pages to {CORPUS_DIR}")
+
+
+if __name__ == "__main__":
+    main()
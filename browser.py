@@ -0,0 +1,327 @@
+import asyncio
+import os
+import platform
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from seleniumbase import Driver
+from loguru import logger
+
+import metrics
+
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+HEALTH_CHECK_INTERVAL = 60
+HEALTH_CHECK_TIMEOUT = 60
+MAX_CONSECUTIVE_FAILURES = 3
+
+browser_rss = metrics.registry.gauge(
+    "browser_rss_bytes", "Resident memory of a browser's chromedriver and Chrome processes", ("browser",)
+)
+browser_pages = metrics.registry.gauge(
+    "browser_pages_loaded", "Pages loaded by a browser since it was started", ("browser",)
+)
+browser_restarts = metrics.registry.counter(
+    "browser_restarts_total", "Browsers replaced by the pool", ("reason",)
+)
+browsers_running = metrics.registry.gauge(
+    "browsers_running", "Browsers currently started, including retiring ones"
+)
+
+
+def create_driver() -> Driver:
+    """
+    Starts a headless undetected Chrome, locating the binary on Linux hosts.
+    """
+    # Check if the platform is Linux (for Ubuntu or similar systems)
+    if platform.system() == "Linux":
+        # Check if Chrome exists at the expected path
+        chrome_path = "/usr/bin/google-chrome-stable"
+        if not os.path.exists(chrome_path):
+            chrome_path = "/usr/bin/google-chrome"  # Default location
+            if not os.path.exists(chrome_path):
+                raise Exception("Chrome not found at the expected locations.")
+    else:
+        chrome_path = None  # On other systems, rely on the default binary location
+
+    # Initialize the Driver with the correct Chrome binary location
+    return Driver(
+        uc=True,
+        headless=True,
+        binary_location=chrome_path  # Pass the Chrome path if found
+    )
+
+
+def block_resources(driver, patterns: list[str]):
+    """
+    Tells Chrome, over CDP, to drop requests matching the URL patterns before they are sent.
+    """
+    driver.execute_cdp_cmd("Network.enable", {})
+    driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": list(patterns)})
+    logger.debug(f"Blocking {len(patterns)} URL patterns")
+
+
+def driver_pid(driver) -> int | None:
+    """
+    Returns the pid of the chromedriver process behind the driver, if it can be found.
+    """
+    process = getattr(getattr(driver, "service", None), "process", None)
+    return getattr(process, "pid", None)
+
+
+def process_tree_rss(root_pid: int) -> int | None:
+    """
+    Sums the resident memory of a process and all its descendants, read from /proc.
+    Returns None where /proc is not available.
+    """
+    parents: dict[int, int] = {}
+    rss: dict[int, int] = {}
+    try:
+        entries = os.listdir("/proc")
+    except OSError:
+        return None
+    for entry in entries:
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", "rb") as f:
+                stat = f.read()
+        except OSError:
+            continue  # The process exited meanwhile
+        # The command name may contain spaces, so split after its closing parenthesis
+        fields = stat[stat.rfind(b")") + 2:].split()
+        pid = int(entry)
+        parents[pid] = int(fields[1])
+        rss[pid] = int(fields[21]) * PAGE_SIZE
+    if root_pid not in rss:
+        return None
+
+    children: dict[int, list[int]] = {}
+    for pid, ppid in parents.items():
+        children.setdefault(ppid, []).append(pid)
+    total, stack = 0, [root_pid]
+    while stack:
+        pid = stack.pop()
+        total += rss.get(pid, 0)
+        stack.extend(children.get(pid, ()))
+    return total
+
+
+class BrowserWorker:
+    """
+    Owns a driver and the single thread that is allowed to touch it.
+
+    Selenium calls block for seconds at a time, so every call is shipped to the
+    dedicated thread and awaited from the event loop instead of running on it.
+    """
+
+    def __init__(self, name: str = "browser", driver_factory=create_driver, on_start=None):
+        self.name = name
+        self.driver_factory = driver_factory
+        # Called with every fresh driver on the browser thread, e.g. to set up resource blocking
+        self.on_start = on_start
+        self.driver = None
+        # Set once the consent popups of a fresh session have been handled
+        self.session_ready = False
+        self.pid: int | None = None
+        self.started_at: float | None = None
+        self.pages_loaded = 0
+        self.failures = 0  # consecutive failed page loads
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=name)
+
+    def start(self):
+        """
+        Launches the driver on the browser thread and waits for it to come up.
+        """
+        self._started(self._executor.submit(self._launch).result())
+
+    async def start_async(self):
+        """
+        Launches the driver on the browser thread without blocking the loop.
+        """
+        loop = asyncio.get_running_loop()
+        self._started(await loop.run_in_executor(self._executor, self._launch))
+
+    def _started(self, driver):
+        self.driver = driver
+        self.pid = driver_pid(driver)
+        self.started_at = time.monotonic()
+        browsers_running.inc()
+        logger.debug(f"{self.name}: driver started (pid {self.pid})")
+
+    def _launch(self):
+        driver = self.driver_factory()
+        if self.on_start is not None:
+            self.on_start(driver)
+        return driver
+
+    async def run(self, func, *args):
+        """
+        Runs func(driver, *args) on the browser thread without blocking the loop.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, self.driver, *args)
+
+    def rss(self) -> int | None:
+        """
+        Resident memory of the driver's process tree in bytes, or None if unknown.
+        """
+        return process_tree_rss(self.pid) if self.pid is not None else None
+
+    def age(self) -> float:
+        return time.monotonic() - self.started_at if self.started_at is not None else 0.0
+
+    async def stop(self):
+        """
+        Quits the driver on its own thread and releases the thread.
+        """
+        if self.driver is not None:
+            try:
+                await self.run(lambda driver: driver.quit())
+            except Exception as e:
+                logger.error(f"{self.name}: failed to quit driver: {e}")
+            self.driver = None
+            browsers_running.dec()
+            browser_rss.set(0, browser=self.name)
+        self.session_ready = False
+        self._executor.shutdown(wait=False)
+
+
+class BrowserPool:
+    """
+    Hands out idle browsers and replaces them before they grow stale.
+
+    A browser is recycled once it has loaded max_pages pages, grown past max_rss
+    bytes, lived for max_age seconds, failed several loads in a row or stopped
+    answering health checks. The replacement is started next to the old browser,
+    which keeps serving polls until the new one is up, so polling never pauses.
+    """
+
+    def __init__(self, size: int, driver_factory=create_driver, on_start=None,
+                 max_pages: int = 0, max_rss: int = 0, max_age: float = 0):
+        self.size = size
+        self.driver_factory = driver_factory
+        self.on_start = on_start
+        self.max_pages = max_pages
+        self.max_rss = max_rss
+        self.max_age = max_age
+        self.workers: list[BrowserWorker] = []
+        self._idle: asyncio.Queue[BrowserWorker] = asyncio.Queue()
+        self._replacing: set[BrowserWorker] = set()
+        self._retired: set[BrowserWorker] = set()
+        self._generation = 0
+
+    def _new_worker(self) -> BrowserWorker:
+        self._generation += 1
+        return BrowserWorker(f"browser-{self._generation}", self.driver_factory, on_start=self.on_start)
+
+    async def start(self):
+        """
+        Launches every browser at once without blocking the loop. If one fails to
+        come up, the others are stopped again and the error is raised.
+        """
+        workers = [self._new_worker() for _ in range(self.size)]
+        results = await asyncio.gather(*(worker.start_async() for worker in workers), return_exceptions=True)
+        errors = [result for result in results if isinstance(result, BaseException)]
+        if errors:
+            for worker in workers:
+                await worker.stop()
+            raise errors[0]
+        for worker in workers:
+            self.workers.append(worker)
+            self._idle.put_nowait(worker)
+
+    async def acquire(self) -> BrowserWorker:
+        """
+        Waits for an idle browser. Browsers retired meanwhile are stopped instead of handed out.
+        """
+        while True:
+            worker = await self._idle.get()
+            if worker in self._retired:
+                self._retired.discard(worker)
+                asyncio.create_task(worker.stop())
+                continue
+            return worker
+
+    def release(self, worker: BrowserWorker, ok: bool):
+        """
+        Returns a browser after a page load, replacing it if it is due for recycling.
+        """
+        worker.pages_loaded += 1
+        worker.failures = 0 if ok else worker.failures + 1
+        browser_pages.set(worker.pages_loaded, browser=worker.name)
+        reason = self.recycle_reason(worker)
+        if reason:
+            self.replace(worker, reason)
+        self._idle.put_nowait(worker)
+
+    def recycle_reason(self, worker: BrowserWorker, rss: int = None) -> str | None:
+        if worker.failures >= MAX_CONSECUTIVE_FAILURES:
+            return "failures"
+        if self.max_pages and worker.pages_loaded >= self.max_pages:
+            return "pages"
+        if self.max_rss and rss is not None and rss >= self.max_rss:
+            return "memory"
+        if self.max_age and worker.age() >= self.max_age:
+            return "age"
+        return None
+
+    def replace(self, worker: BrowserWorker, reason: str):
+        """
+        Starts a replacement for the browser in the background, at most once per browser.
+        """
+        if worker in self._replacing or worker in self._retired or worker not in self.workers:
+            return
+        self._replacing.add(worker)
+        logger.info(f"{worker.name}: recycling ({reason}) after {worker.pages_loaded} pages")
+        asyncio.create_task(self._replace(worker, reason), name=f"replace-{worker.name}")
+
+    async def _replace(self, worker: BrowserWorker, reason: str):
+        replacement = self._new_worker()
+        try:
+            await replacement.start_async()
+        except Exception as e:
+            # The old browser keeps serving; the next release or health check tries again
+            logger.error(f"{worker.name}: failed to start a replacement: {e}")
+            await replacement.stop()
+            return
+        finally:
+            self._replacing.discard(worker)
+        browser_restarts.inc(reason=reason)
+        self.workers[self.workers.index(worker)] = replacement
+        self._retired.add(worker)
+        self._idle.put_nowait(replacement)
+        logger.info(f"{replacement.name} replaced {worker.name}")
+
+    async def check_health(self):
+        """
+        Updates memory metrics and replaces browsers that are too big, too old or unresponsive.
+        """
+        for worker in list(self.workers):
+            rss = await asyncio.to_thread(worker.rss)
+            if rss is not None:
+                browser_rss.set(rss, browser=worker.name)
+            try:
+                # Queues behind a page load in progress, hence the generous timeout
+                await asyncio.wait_for(worker.run(lambda driver: driver.current_url), HEALTH_CHECK_TIMEOUT)
+            except Exception as e:
+                logger.warning(f"{worker.name}: health check failed: {type(e).__name__}: {e}")
+                self.replace(worker, "unresponsive")
+                continue
+            reason = self.recycle_reason(worker, rss)
+            if reason:
+                self.replace(worker, reason)
+
+    async def monitor(self, interval: float = HEALTH_CHECK_INTERVAL):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.check_health()
+            except Exception as e:
+                logger.exception(f"Browser health check failed: {e}")
+
+    async def stop(self):
+        workers = [*self.workers, *self._retired]
+        self.workers.clear()
+        self._retired.clear()
+        for worker in workers:
+            await worker.stop()
@@ -0,0 +1,184 @@
+import asyncio
+import time
+
+from aiogram import Bot
+from aiogram.enums import ParseMode
+from aiogram.exceptions import TelegramNetworkError, TelegramRetryAfter
+from loguru import logger
+
+import metrics
+
+# Telegram Bot API limits: ~30 messages per second overall, one per second to a
+# private chat and 20 per minute to a group.
+GLOBAL_RATE = 30
+PRIVATE_CHAT_RATE = 1
+GROUP_CHAT_RATE = 20 / 60
+GROUP_CHAT_BURST = 20
+MAX_ATTEMPTS = 5
+# Longest a message waits out flood control in total before it is dropped, so a chat
+# that keeps answering RetryAfter cannot hold its queue forever
+MAX_RETRY_AFTER_WAIT = 600
+
+delivery_latency = metrics.registry.histogram(
+    "telegram_delivery_latency_seconds", "Time from queueing a message to its delivery to one chat",
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+)
+send_results = metrics.registry.counter(
+    "telegram_sends_total", "Telegram send attempts by result", ("result",)
+)
+send_latency = metrics.registry.histogram(
+    "telegram_send_seconds", "Duration of one sendMessage request"
+)
+
+
+class TokenBucket:
+    """
+    Classic token bucket: refills at rate tokens per second up to capacity.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.blocked_until:
+                    await asyncio.sleep(self.blocked_until - now)
+                    continue
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def block(self, seconds: float):
+        """
+        Holds the bucket empty for the given time, e.g. after a RetryAfter.
+        """
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+
+class DeliveryEngine:
+    """
+    Fans messages out to many chats concurrently while staying within Telegram's limits.
+
+    Every chat has its own worker and queue, so messages reach a chat in order and a
+    slow or rate-limited chat never holds back the others. All workers share the
+    global bucket.
+    """
+
+    def __init__(self, bot: Bot, global_rate: float = GLOBAL_RATE):
+        self.bot = bot
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self._chat_buckets: dict[int, TokenBucket] = {}
+        self._chat_queues: dict[int, asyncio.Queue] = {}
+        self._workers: dict[int, asyncio.Task] = {}
+        # Set whenever a chat worker finishes a message
+        self._progress = asyncio.Event()
+
+    def submit(self, text: str, chat_ids, parse_mode=ParseMode.HTML, submitted_at: float = None):
+        """
+        Queues the message for every chat and returns immediately.
+        Latency is measured from submitted_at (a time.monotonic() value), defaulting to now.
+        """
+        submitted_at = submitted_at or time.monotonic()
+        for chat_id in chat_ids:
+            self._chat_queue(chat_id).put_nowait((text, parse_mode, submitted_at))
+
+    def backlog(self) -> int:
+        """
+        Messages waiting for the chat that is furthest behind.
+        """
+        return max((queue.qsize() for queue in self._chat_queues.values()), default=0)
+
+    async def wait_for_capacity(self, limit: int):
+        """
+        Waits until no chat has limit or more messages waiting, so a slow Telegram
+        pushes back on the notification queue instead of piling up messages here.
+        """
+        while self.backlog() >= limit:
+            self._progress.clear()
+            await self._progress.wait()
+
+    async def join(self):
+        """
+        Waits until every submitted message has been delivered or given up on.
+        """
+        await asyncio.gather(*(queue.join() for queue in self._chat_queues.values()))
+
+    async def close(self):
+        for worker in self._workers.values():
+            worker.cancel()
+        await asyncio.gather(*self._workers.values(), return_exceptions=True)
+        self._workers.clear()
+        self._chat_queues.clear()
+
+    def _chat_queue(self, chat_id: int) -> asyncio.Queue:
+        queue = self._chat_queues.get(chat_id)
+        if queue is None:
+            queue = self._chat_queues[chat_id] = asyncio.Queue()
+            if chat_id < 0:
+                self._chat_buckets[chat_id] = TokenBucket(GROUP_CHAT_RATE, GROUP_CHAT_BURST)
+            else:
+                self._chat_buckets[chat_id] = TokenBucket(PRIVATE_CHAT_RATE, 1)
+            self._workers[chat_id] = asyncio.create_task(self._chat_worker(chat_id), name=f"delivery-{chat_id}")
+        return queue
+
+    async def _chat_worker(self, chat_id: int):
+        queue = self._chat_queues[chat_id]
+        while True:
+            text, parse_mode, submitted_at = await queue.get()
+            try:
+                if await self._send(chat_id, text, parse_mode):
+                    latency = time.monotonic() - submitted_at
+                    delivery_latency.observe(latency)
+                    logger.debug(f"Delivered message to {chat_id} in {latency * 1000:.0f} ms")
+            finally:
+                queue.task_done()
+                self._progress.set()
+
+    async def _send(self, chat_id: int, text: str, parse_mode) -> bool:
+        chat_bucket = self._chat_buckets[chat_id]
+        # Only failures count as attempts; a RetryAfter just waits for the chat's turn, up to a limit
+        attempt = 0
+        retry_after_wait = 0
+        while attempt < MAX_ATTEMPTS:
+            await chat_bucket.acquire()
+            await self.global_bucket.acquire()
+            try:
+                with send_latency.time():
+                    await self.bot.send_message(chat_id=chat_id, text=text, parse_mode=parse_mode)
+                send_results.inc(result="ok")
+                return True
+            except TelegramRetryAfter as e:
+                send_results.inc(result="retry_after")
+                retry_after_wait += e.retry_after
+                if retry_after_wait > MAX_RETRY_AFTER_WAIT:
+                    logger.error(f"Dropping message to {chat_id}: flood control would hold it "
+                                 f"for more than {MAX_RETRY_AFTER_WAIT} sec")
+                    chat_bucket.block(e.retry_after)
+                    return False
+                logger.warning(f"Flood control for {chat_id}, retrying in {e.retry_after} sec")
+                chat_bucket.block(e.retry_after)
+            except TelegramNetworkError as e:
+                attempt += 1
+                send_results.inc(result="network_error")
+                logger.warning(f"Network error sending to {chat_id} (attempt {attempt}): {e}")
+                await asyncio.sleep(min(2 ** attempt, 30))
+            except Exception as e:
+                send_results.inc(result="error")
+                logger.error(f"Failed to send message to {chat_id}: {e}")
+                return False
+        logger.error(f"Giving up on message to {chat_id} after {MAX_ATTEMPTS} attempts")
+        return False
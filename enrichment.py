@@ -0,0 +1,124 @@
+import asyncio
+import time
+from collections import OrderedDict
+
+from loguru import logger
+
+import metrics
+from models import Home
+
+CACHE_SIZE = 1024
+CACHE_TTL = 6 * 3600  # Detail pages rarely change within a few hours
+
+enrich_latency = metrics.registry.histogram(
+    "funda_enrich_latency_seconds", "Time to fetch and parse a listing detail page"
+)
+enrich_cache = metrics.registry.counter(
+    "funda_enrich_cache_total", "Detail lookups by cache result", ("result",)
+)
+
+
+class TTLCache:
+    """
+    Size-limited LRU mapping whose entries expire ttl seconds after they were stored.
+    """
+
+    def __init__(self, maxsize: int = CACHE_SIZE, ttl: float = CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: OrderedDict[str, tuple[float, object]] = OrderedDict()
+
+    def get(self, key: str, default=None):
+        item = self._data.get(key)
+        if item is None:
+            return default
+        stored_at, value = item
+        if time.monotonic() - stored_at > self.ttl:
+            del self._data[key]
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: str, value):
+        self._data[key] = (time.monotonic(), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def __len__(self):
+        return len(self._data)
+
+
+class Enricher:
+    """
+    Looks up the detail pages of new homes in the background.
+
+    At most `workers` detail pages are fetched at once, concurrent lookups of the
+    same listing share one fetch, and results are cached so a listing announced to
+    several searches costs a single fetch.
+    """
+
+    def __init__(self, fetch, parse, workers: int = 2, cache: TTLCache = None):
+        # async fetch(url) -> page source or None, async parse(page source) -> dict
+        self.fetch = fetch
+        self.parse = parse
+        self.slots = asyncio.Semaphore(workers)
+        self.cache = cache or TTLCache()
+        self._pending: dict[str, asyncio.Future] = {}
+        self._tasks: set[asyncio.Task] = set()
+
+    async def details(self, url: str) -> dict | None:
+        """
+        Returns the parsed details of the listing, or None if its page could not be fetched.
+        """
+        cached = self.cache.get(url)
+        if cached is not None:
+            enrich_cache.inc(result="hit")
+            return cached
+        pending = self._pending.get(url)
+        if pending is None:
+            enrich_cache.inc(result="miss")
+            pending = self._pending[url] = asyncio.ensure_future(self._lookup(url))
+            pending.add_done_callback(lambda _: self._pending.pop(url, None))
+        else:
+            enrich_cache.inc(result="in_flight")
+        # Shielded, so a cancelled caller does not cancel the lookup for the others
+        return await asyncio.shield(pending)
+
+    async def _lookup(self, url: str) -> dict | None:
+        async with self.slots:
+            with enrich_latency.time():
+                page_source = await self.fetch(url)
+                if not page_source:
+                    return None
+                details = await self.parse(page_source)
+        if details:
+            self.cache.set(url, details)
+        return details
+
+    def enrich(self, home: Home, on_details):
+        """
+        Starts looking up the home's details and returns right away.
+        Once they are in, they are stored on the home and on_details(home) is awaited.
+        """
+        task = asyncio.create_task(self._enrich(home, on_details), name=f"enrich-{home.url}")
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _enrich(self, home: Home, on_details):
+        try:
+            details = await self.details(home.url)
+        except Exception as e:
+            logger.warning(f"Failed to enrich {home.url}: {e!r}")
+            return
+        if not details:
+            logger.debug(f"No details found for {home.url}")
+            return
+        home.details = details
+        await on_details(home)
+
+    async def close(self):
+        tasks = [*self._tasks, *self._pending.values()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
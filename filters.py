@@ -0,0 +1,202 @@
+"""
+Per-chat listing filters.
+
+A chat can limit the homes it receives by price, size, bedrooms, energy label and
+postcode. The rules of all chats are compiled into a FilterIndex: every numeric
+field gets an interval index that maps a value straight to the bitmask of chats
+accepting it, so matching a home costs a few bisects and integer ANDs no matter
+how many chats have filters.
+
+Rules are stored as plain dicts in settings.json, e.g.
+{"price": [1000, 2500], "size": [50, null], "energy": ["A", "B"], "postcode": [[1011, 1019], [1181, 1181]]}
+Ranges are inclusive and null leaves a side open. A home whose field could not be
+parsed passes that field's filter, so a layout change never silently drops listings.
+"""
+import bisect
+
+from models import Home, parse_energy_label
+
+# Rule field -> typed Home attribute
+RANGE_FIELDS = {
+    "price": "price_value",
+    "size": "size_value",
+    "bedrooms": "bedrooms_value",
+    "postcode": "postcode",
+}
+RULE_FIELDS = (*RANGE_FIELDS, "energy")
+INF = float("inf")
+
+
+class IntervalIndex:
+    """
+    Maps an integer to the bitmask of the rules whose ranges contain it.
+
+    The range bounds split the number line into elementary segments, each with a
+    precomputed mask of the rules covering it. Rules without ranges for this field
+    accept every value.
+    """
+
+    def __init__(self, ranges: dict[int, list], unconstrained: int = 0):
+        self.unconstrained = unconstrained
+        starts: dict[int, int] = {}
+        ends: dict[int, int] = {}
+        open_start = 0
+        for bit, intervals in ranges.items():
+            for low, high in merge_intervals(intervals):
+                if low is None:
+                    open_start |= 1 << bit
+                else:
+                    starts[low] = starts.get(low, 0) | 1 << bit
+                if high is not None:
+                    # Half-open segments: the rule stops covering values from high + 1
+                    ends[high + 1] = ends.get(high + 1, 0) | 1 << bit
+
+        self.bounds = sorted(starts.keys() | ends.keys())
+        self.masks = [open_start]
+        mask = open_start
+        for bound in self.bounds:
+            mask = (mask & ~ends.get(bound, 0)) | starts.get(bound, 0)
+            self.masks.append(mask)
+
+    def lookup(self, value: int) -> int:
+        return self.masks[bisect.bisect_right(self.bounds, value)] | self.unconstrained
+
+
+def merge_intervals(intervals: list) -> list[tuple]:
+    """
+    Sorts inclusive (low, high) intervals and merges the overlapping and adjacent ones.
+    An open (None) low or high bound is minus or plus infinity.
+    """
+    merged = []
+    for low, high in sorted((-INF if low is None else low, INF if high is None else high) for low, high in intervals):
+        if merged and low <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], high))
+        else:
+            merged.append((low, high))
+    return [(None if low == -INF else low, None if high == INF else high) for low, high in merged]
+
+
+class FilterIndex:
+    """
+    Compiled filters of all chats. Chats without a rule are not part of the index
+    and receive every home.
+    """
+
+    def __init__(self, rules: dict[int, dict]):
+        self.chat_ids = list(rules)
+        self.chats = set(rules)
+        self.all_chats = (1 << len(self.chat_ids)) - 1
+
+        self.ranges: dict[str, IntervalIndex] = {}
+        for field in RANGE_FIELDS:
+            ranges, unconstrained = {}, 0
+            for bit, chat_id in enumerate(self.chat_ids):
+                value = rules[chat_id].get(field)
+                if not value:
+                    unconstrained |= 1 << bit
+                elif field == "postcode":
+                    ranges[bit] = [tuple(interval) for interval in value]
+                else:
+                    ranges[bit] = [tuple(value)]
+            self.ranges[field] = IntervalIndex(ranges, unconstrained)
+
+        self.energy_masks: dict[str, int] = {}
+        self.energy_unconstrained = 0
+        for bit, chat_id in enumerate(self.chat_ids):
+            labels = rules[chat_id].get("energy")
+            if not labels:
+                self.energy_unconstrained |= 1 << bit
+            for label in labels or ():
+                self.energy_masks[label] = self.energy_masks.get(label, 0) | 1 << bit
+
+    def match(self, home: Home) -> set[int]:
+        """
+        Returns the filtered chats that accept the home.
+        """
+        mask = self.all_chats
+        for field, attribute in RANGE_FIELDS.items():
+            value = getattr(home, attribute, None)
+            if value is not None:
+                mask &= self.ranges[field].lookup(value)
+                if not mask:
+                    return set()
+        label = getattr(home, "energy_label", None)
+        if label is not None:
+            mask &= self.energy_unconstrained | self.energy_masks.get(label, 0)
+
+        matched = set()
+        while mask:
+            lowest = mask & -mask
+            matched.add(self.chat_ids[lowest.bit_length() - 1])
+            mask ^= lowest
+        return matched
+
+    def recipients(self, home: Home | None, chat_ids) -> list[int]:
+        """
+        Narrows chat_ids down to the chats whose filters accept the home.
+        Messages without a home go to every chat.
+        """
+        if home is None or not self.chats:
+            return list(chat_ids)
+        matched = self.match(home)
+        return [chat_id for chat_id in chat_ids if chat_id not in self.chats or chat_id in matched]
+
+
+def parse_range(text: str) -> list:
+    """
+    Parses '1000-2500', '50-', '-2500' or '3' into an inclusive [low, high] pair.
+    """
+    low, separator, high = text.partition("-")
+    if not separator:
+        high = low
+    bounds = [int(low) if low.strip() else None, int(high) if high.strip() else None]
+    if bounds == [None, None]:
+        raise ValueError(f"Empty range: {text}")
+    if None not in bounds and bounds[0] > bounds[1]:
+        raise ValueError(f"Range starts after it ends: {text}")
+    return bounds
+
+
+def parse_rule(args: list[str]) -> dict:
+    """
+    Parses filter arguments like ['price=1000-2500', 'energy=A,B', 'postcode=1011-1019,1181'] into a rule.
+    """
+    rule = {}
+    for arg in args:
+        field, _, value = arg.partition("=")
+        field = field.strip().lower()
+        if field not in RULE_FIELDS or not value:
+            raise ValueError(f"Expected one of {', '.join(RULE_FIELDS)} as field=value, got: {arg}")
+        if field == "energy":
+            labels = [parse_energy_label(label) for label in value.split(",")]
+            if None in labels:
+                raise ValueError(f"Unknown energy label in: {value}")
+            rule[field] = labels
+        elif field == "postcode":
+            rule[field] = [parse_range(part) for part in value.split(",")]
+        else:
+            rule[field] = parse_range(value)
+    if not rule:
+        raise ValueError("No filter given")
+    return rule
+
+
+def format_rule(rule: dict) -> str:
+    def format_range(bounds):
+        low, high = bounds
+        if low == high:
+            return str(low)
+        return f"{'' if low is None else low}-{'' if high is None else high}"
+
+    parts = []
+    for field in RULE_FIELDS:
+        value = rule.get(field)
+        if not value:
+            continue
+        if field == "energy":
+            parts.append(f"energy={','.join(value)}")
+        elif field == "postcode":
+            parts.append(f"postcode={','.join(map(format_range, value))}")
+        else:
+            parts.append(f"{field}={format_range(value)}")
+    return " ".join(parts)
@@ -0,0 +1,227 @@
+import asyncio
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from loguru import logger
+
+import metrics
+from models import Home
+
+FLUSH_INTERVAL = 1.0
+RELIST_AFTER = 24 * 3600  # Gone from the results this long and back again counts as relisted
+RETENTION = 90 * 24 * 3600  # Listings and sightings older than this are dropped
+PRUNE_INTERVAL = 24 * 3600
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS listings (
+    listing_key TEXT PRIMARY KEY,
+    listing_id INTEGER,
+    url TEXT,
+    street_house TEXT,
+    postcode INTEGER,
+    price INTEGER,
+    first_seen REAL NOT NULL,
+    last_seen REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS listings_postcode ON listings (postcode, last_seen);
+CREATE INDEX IF NOT EXISTS listings_last_seen ON listings (last_seen);
+CREATE TABLE IF NOT EXISTS sightings (
+    listing_key TEXT NOT NULL,
+    seen_at REAL NOT NULL,
+    price INTEGER,
+    search_id INTEGER
+);
+CREATE INDEX IF NOT EXISTS sightings_listing ON sightings (listing_key, seen_at);
+CREATE INDEX IF NOT EXISTS sightings_seen_at ON sightings (seen_at);
+CREATE TABLE IF NOT EXISTS search_listings (
+    search_id INTEGER NOT NULL,
+    listing_key TEXT NOT NULL,
+    price INTEGER,
+    last_seen REAL NOT NULL,
+    PRIMARY KEY (search_id, listing_key)
+);
+CREATE INDEX IF NOT EXISTS search_listings_last_seen ON search_listings (last_seen);
+"""
+
+UPSERT_LISTING = """
+INSERT INTO listings (listing_key, listing_id, url, street_house, postcode, price, first_seen, last_seen)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (listing_key) DO UPDATE SET
+    url = excluded.url,
+    street_house = excluded.street_house,
+    postcode = excluded.postcode,
+    price = COALESCE(excluded.price, listings.price),
+    last_seen = excluded.last_seen
+"""
+INSERT_SIGHTING = "INSERT INTO sightings (listing_key, seen_at, price, search_id) VALUES (?, ?, ?, ?)"
+UPSERT_SEARCH_LISTING = """
+INSERT INTO search_listings (listing_key, last_seen, price, search_id) VALUES (?, ?, ?, ?)
+ON CONFLICT (search_id, listing_key) DO UPDATE SET
+    price = COALESCE(excluded.price, search_listings.price),
+    last_seen = excluded.last_seen
+"""
+# Fills search_listings from the sightings of a database written before it existed
+BACKFILL_SEARCH_LISTINGS = """
+INSERT INTO search_listings (search_id, listing_key, price, last_seen)
+SELECT search_id, listing_key, price, MAX(seen_at) FROM sightings
+WHERE search_id IS NOT NULL GROUP BY search_id, listing_key
+"""
+
+history_events = metrics.registry.counter(
+    "funda_history_events_total", "Listing changes found in the history", ("kind",)
+)
+history_flush = metrics.registry.histogram(
+    "funda_history_flush_seconds", "Time to write one batch of sightings to SQLite"
+)
+
+
+class HistoryStore:
+    """
+    Every sighting of every listing, in SQLite, to spot price changes and relistings.
+
+    The database is only touched from its own thread. Sightings are buffered and
+    written in batches once a second, in one transaction, with WAL journaling, so
+    the poll path never waits for the disk. The last known price and sighting
+    time of each listing are also held in memory, per search, so changes are found
+    without reading the database, and every search whose results show a listing
+    reports its changes to its own chats.
+    """
+
+    def __init__(self, path: str = "history.sqlite3", relist_after: float = RELIST_AFTER):
+        self.path = path
+        self.relist_after = relist_after
+        # (search id, listing key) -> (price, last seen)
+        self._latest: dict[tuple[int, str], tuple[int | None, float]] = {}
+        # search id -> time of its previous observed poll
+        self._last_observed: dict[int, float] = {}
+        self._pending_listings: list[tuple] = []
+        self._pending_sightings: list[tuple] = []
+        self._flusher: asyncio.Task | None = None
+        self._pruned_at = time.monotonic()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="history")
+        self._db: sqlite3.Connection | None = None
+        self._executor.submit(self._open).result()
+
+    def _open(self):
+        start = time.perf_counter()
+        self._db = sqlite3.connect(self.path)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+        self._prune(time.time() - RETENTION)
+        if self._db.execute("SELECT 1 FROM search_listings LIMIT 1").fetchone() is None:
+            with self._db:
+                self._db.execute(BACKFILL_SEARCH_LISTINGS)
+        for search_id, key, price, last_seen in self._db.execute(
+            "SELECT search_id, listing_key, price, last_seen FROM search_listings"
+        ):
+            self._latest[search_id, key] = (price, last_seen)
+        logger.info(
+            f"Loaded history of {len(self._latest)} listings of searches from {self.path} "
+            f"in {(time.perf_counter() - start) * 1000:.0f} ms"
+        )
+
+    def observe(self, search_id: int, homes: list[Home]) -> tuple[list[tuple[Home, int]], list[Home]]:
+        """
+        Records a poll's homes and returns (price changes as (home, old price), relisted homes).
+        Runs on the loop without I/O; the sightings are written by the next flush.
+        """
+        now = time.time()
+        previous_poll = self._last_observed.get(search_id)
+        self._last_observed[search_id] = now
+        price_changes, relisted = [], []
+        for home in homes:
+            key = str(home.key)
+            latest = self._latest.get((search_id, key))
+            price = home.price_value
+            if latest is not None:
+                old_price, last_seen = latest
+                if price is not None and old_price is not None and price != old_price:
+                    price_changes.append((home, old_price))
+                    history_events.inc(kind="price_change")
+                # Only when this search kept being polled while the listing was gone,
+                # so downtime of the bot is not mistaken for a relisting
+                elif previous_poll is not None and previous_poll - last_seen >= self.relist_after:
+                    relisted.append(home)
+                    history_events.inc(kind="relisted")
+            # A card without a readable price keeps the last known one
+            known_price = price if price is not None or latest is None else latest[0]
+            self._latest[search_id, key] = (known_price, now)
+            self._pending_listings.append(
+                (key, home.listing_id, home.url, home.street_house, home.postcode, price, now, now)
+            )
+            self._pending_sightings.append((key, now, price, search_id))
+
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush_loop(), name="history-flush")
+        return price_changes, relisted
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(FLUSH_INTERVAL)
+            await self.flush()
+            if time.monotonic() - self._pruned_at >= PRUNE_INTERVAL:
+                await self.prune()
+
+    async def prune(self):
+        """
+        Forgets the listings and sightings older than RETENTION, in memory and in the database.
+        """
+        self._pruned_at = time.monotonic()
+        cutoff = time.time() - RETENTION
+        self._latest = {key: latest for key, latest in self._latest.items() if latest[1] >= cutoff}
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(self._executor, self._prune, cutoff)
+        except Exception as e:
+            logger.error(f"Failed to prune the history: {e}")
+
+    def _prune(self, cutoff: float):
+        with self._db:
+            self._db.execute("DELETE FROM sightings WHERE seen_at < ?", (cutoff,))
+            self._db.execute("DELETE FROM listings WHERE last_seen < ?", (cutoff,))
+            self._db.execute("DELETE FROM search_listings WHERE last_seen < ?", (cutoff,))
+
+    async def flush(self):
+        if not self._pending_sightings:
+            return
+        listings, self._pending_listings = self._pending_listings, []
+        sightings, self._pending_sightings = self._pending_sightings, []
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(self._executor, self._write, listings, sightings)
+        except Exception as e:
+            logger.error(f"Failed to write {len(sightings)} sightings to the history: {e}")
+
+    def _write(self, listings: list[tuple], sightings: list[tuple]):
+        with history_flush.time(), self._db:
+            self._db.executemany(UPSERT_LISTING, listings)
+            self._db.executemany(INSERT_SIGHTING, sightings)
+            self._db.executemany(UPSERT_SEARCH_LISTING, sightings)
+
+    async def recent_listings(self, postcode_from: int, postcode_to: int, days: float = 7) -> list[tuple]:
+        """
+        Returns (url, street_house, postcode, price, first_seen, last_seen) of the listings
+        in the postcode range seen within the last days, most recently seen first.
+        """
+        since = time.time() - days * 24 * 3600
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor,
+            self._query,
+            "SELECT url, street_house, postcode, price, first_seen, last_seen FROM listings "
+            "WHERE postcode BETWEEN ? AND ? AND last_seen >= ? ORDER BY last_seen DESC",
+            (postcode_from, postcode_to, since),
+        )
+
+    def _query(self, sql: str, params: tuple) -> list[tuple]:
+        return self._db.execute(sql, params).fetchall()
+
+    async def close(self):
+        if self._flusher is not None:
+            self._flusher.cancel()
+            await asyncio.gather(self._flusher, return_exceptions=True)
+        await self.flush()
+        self._executor.submit(self._db.close).result()
+        self._executor.shutdown()
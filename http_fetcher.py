@@ -0,0 +1,77 @@
+import httpx
+from loguru import logger
+
+HTTP_TIMEOUT = 10
+CHALLENGE_STATUS_CODES = {403, 429, 503}
+# Markers of bot-protection interstitials served instead of the result page
+CHALLENGE_MARKERS = (
+    "captcha-delivery.com",
+    "px-captcha",
+    "challenge-platform",
+    "Je bent bijna op de pagina die je zoekt",
+)
+
+
+class HttpFetcher:
+    """
+    Browser-free result page fetcher on a pooled keep-alive HTTP/2 client.
+
+    It borrows cookies and the user agent from a browser session that already got
+    past the consent screen; whenever Funda answers with a challenge, the caller
+    is expected to fall back to the browser and hand over fresh cookies.
+    """
+
+    def __init__(self):
+        self.client = httpx.AsyncClient(
+            http2=True,
+            follow_redirects=True,
+            timeout=HTTP_TIMEOUT,
+            limits=httpx.Limits(max_connections=10, max_keepalive_connections=10, keepalive_expiry=60),
+            headers={
+                "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+                "Accept-Encoding": "gzip, deflate, br",
+                "Accept-Language": "en-US,en;q=0.9,nl;q=0.8",
+            },
+        )
+
+    def load_browser_session(self, cookies: list[dict], user_agent: str):
+        """
+        Copies Selenium cookies and the browser user agent into the HTTP client.
+        """
+        self.client.cookies.clear()
+        for cookie in cookies:
+            self.client.cookies.set(
+                cookie["name"],
+                cookie["value"],
+                domain=cookie.get("domain", ""),
+                path=cookie.get("path", "/"),
+            )
+        if user_agent:
+            self.client.headers["User-Agent"] = user_agent
+        logger.debug(f"Borrowed {len(cookies)} cookies from the browser session")
+
+    async def fetch(self, url: str):
+        """
+        Fetches the page and returns its source, or None on errors and challenges.
+        """
+        try:
+            response = await self.client.get(url)
+        except httpx.HTTPError as e:
+            logger.warning(f"HTTP fetch failed: {e!r}")
+            return None
+
+        if response.status_code in CHALLENGE_STATUS_CODES:
+            logger.warning(f"HTTP fetch was challenged with status {response.status_code}")
+            return None
+        if response.status_code != 200:
+            logger.warning(f"HTTP fetch returned status {response.status_code}")
+            return None
+
+        page_source = response.text
+        if any(marker in page_source for marker in CHALLENGE_MARKERS):
+            logger.warning("HTTP fetch returned a challenge page")
+            return None
+        return page_source
+
+    async def close(self):
+        await self.client.aclose()
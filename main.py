@@ -1,32 +1,80 @@
+import argparse
 import asyncio
+import importlib
 import os
+import re
+import signal
+import time
 
 from aiogram import Bot, Dispatcher, types, F
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.enums import ParseMode, ChatType
 from aiogram.filters import Command
-from aiogram.types import BotCommand
+from aiogram.types import BotCommand, BufferedInputFile
 from dotenv import load_dotenv
 from loguru import logger
-from selenium.common.exceptions import InvalidArgumentException
 
-from parser import FundaParser
-from settings import settings, message_queue
+import metrics
+import profiling
+from delivery import DeliveryEngine
+from filters import FilterIndex, format_rule, parse_range, parse_rule
+from history import HistoryStore
+from models import format_euros
+from notifications import DELIVERY_BACKLOG, MAX_MESSAGE_LENGTH, plan_messages
+from settings import DEFAULT_POLL_INTERVAL, settings, message_queue
 
 # Load environment variables
 load_dotenv()
 
 OWNER_ID = int(os.getenv("OWNER_ID"))
-MAX_MESSAGE_LENGTH = 4092
+MAX_RESTART_DELAY = 300
+# "all" runs everything in one process; "scanner" and "notifier" run apart, over a shared queue
+ROLES = ("all", "scanner", "notifier")
+# Seconds between checks for settings changed by another process
+SETTINGS_WATCH_INTERVAL = 2
+# Shortest poll interval a user can set for a search
+MIN_SEARCH_INTERVAL = 1
 
 # Set up logging
 logger.add(f"{__name__}.log", rotation="10 MB")  # Automatically rotate large log files
 
+
+def create_bot() -> Bot:
+    session = None
+    if os.getenv("TELEGRAM_API_SERVER"):
+        # A local Bot API server, or the fake one of bench/bench_startup.py
+        session = AiohttpSession(api=TelegramAPIServer.from_base(os.getenv("TELEGRAM_API_SERVER")))
+    return Bot(token=os.getenv("TELEGRAM_BOT_TOKEN"), session=session)
+
+
 # Bot initialization
-bot = Bot(token=os.getenv("TELEGRAM_BOT_TOKEN"))
+bot = create_bot()
 dp = Dispatcher(storage=None)  # No persistence for storage
-
-# Initialize the parser instance
-parser = FundaParser()
+delivery = DeliveryEngine(bot)
+
+# The parser, with selenium, seleniumbase, lxml and bs4 behind it, is imported
+# and its browsers launched by start_scanner(), once the bot answers commands
+parser = None
+# The parser's process pool, forked by main() before any thread runs
+parse_pool = None
+# What this process runs, and the (index, count) share of the searches it scans; set by main()
+process_role = "all"
+scanner_shard = None
+scanner_replica = None
+# The listing history for /recent when the scanner runs in another process
+notifier_history = None
+
+# Compiled per-chat filters, rebuilt whenever a filter changes
+chat_filters = FilterIndex(settings.chat_filters)
+
+scan_restarts = metrics.registry.counter(
+    "funda_scan_restarts_total", "Times the scan loop was restarted after a fatal error"
+)
+startup_time = metrics.registry.gauge(
+    "funda_startup_seconds", "Seconds from main() until each startup stage was done", ("stage",)
+)
+metrics.queue_depth.set_function(message_queue.qsize)
 
 
 async def send_critical_error_message(error_msg):
@@ -208,6 +256,257 @@ async def get_chat_id(message: types.Message):
     await message.answer(text)
 
 
+@dp.message(Command("stats"), F.from_user.id == OWNER_ID)
+async def get_stats(message: types.Message):
+    logger.debug("Getting stats")
+    try:
+        text = metrics.registry.summary() or "No metrics recorded yet."
+        if len(text) > MAX_MESSAGE_LENGTH:
+            text = text[:MAX_MESSAGE_LENGTH] + '...'
+    except Exception as e:
+        logger.error(e)
+        text = f"Error getting stats: {e}"
+
+    await message.answer(text)
+
+
+@dp.message(Command("set_backend"), F.from_user.id == OWNER_ID)
+async def set_backend(message: types.Message):
+    logger.debug(f"Setting fetch backend: {message.text}")
+    try:
+        settings.fetch_backend = message.text.split(' ', 1)[1].strip()
+        text = f"Fetch backend set: {settings.fetch_backend}"
+    except Exception as e:
+        logger.error(e)
+        text = f"Error setting fetch backend: {e}"
+
+    await message.answer(text)
+
+
+def format_search(search: dict) -> str:
+    chats = ", ".join(map(str, search["chats"])) or "all chats"
+    return f"#{search['id']} every {search['interval']} sec to {chats}\n{search['url']}"
+
+
+@dp.message(Command("searches"), F.from_user.id == OWNER_ID)
+async def get_searches(message: types.Message):
+    logger.debug(f"Getting searches: {settings.searches}")
+    try:
+        text = "\n\n".join(format_search(search) for search in settings.searches) or "No searches saved."
+    except Exception as e:
+        logger.error(e)
+        text = f"Error getting searches: {e}"
+
+    await message.answer(text, disable_web_page_preview=True)
+
+
+@dp.message(Command("add_search"), F.from_user.id == OWNER_ID)
+async def add_search(message: types.Message):
+    logger.debug(f"Adding search: {message.text}")
+    try:
+        args = message.text.split()[1:]
+        url = args[0]
+        interval = int(args[1]) if len(args) > 1 else DEFAULT_POLL_INTERVAL
+        if interval < MIN_SEARCH_INTERVAL:
+            raise ValueError(f"Interval must be at least {MIN_SEARCH_INTERVAL} second")
+        search = settings.add_search(url, interval)
+        text = f"New search added:\n{format_search(search)}"
+    except Exception as e:
+        logger.error(e)
+        text = f"Error adding new search: {e}"
+
+    await message.answer(text, disable_web_page_preview=True)
+
+
+@dp.message(Command("remove_search"), F.from_user.id == OWNER_ID)
+async def remove_search(message: types.Message):
+    logger.debug(f"Removing search: {message.text}")
+    try:
+        search_id = int(message.text.split(' ', 1)[1])
+        if settings.remove_search(search_id):
+            text = f"Search removed: #{search_id}"
+        else:
+            text = f"Search doesn't exist: #{search_id}"
+    except Exception as e:
+        logger.error(e)
+        text = f"Error removing search: {e}"
+
+    await message.answer(text)
+
+
+@dp.message(Command("search_interval"), F.from_user.id == OWNER_ID)
+async def set_search_interval(message: types.Message):
+    logger.debug(f"Setting search interval: {message.text}")
+    try:
+        search_id, interval = map(int, message.text.split()[1:3])
+        if interval < MIN_SEARCH_INTERVAL:
+            raise ValueError(f"Interval must be at least {MIN_SEARCH_INTERVAL} second")
+        search = settings.update_search(search_id, interval=interval)
+        text = f"Search updated:\n{format_search(search)}" if search else f"Search doesn't exist: #{search_id}"
+    except Exception as e:
+        logger.error(e)
+        text = f"Error setting search interval: {e}"
+
+    await message.answer(text, disable_web_page_preview=True)
+
+
+@dp.message(Command("search_chats"), F.from_user.id == OWNER_ID)
+async def set_search_chats(message: types.Message):
+    logger.debug(f"Setting search chats: {message.text}")
+    try:
+        search_id, *chats = map(int, message.text.split()[1:])
+        search = settings.update_search(search_id, chats=chats)
+        text = f"Search updated:\n{format_search(search)}" if search else f"Search doesn't exist: #{search_id}"
+    except Exception as e:
+        logger.error(e)
+        text = f"Error setting search chats: {e}"
+
+    await message.answer(text, disable_web_page_preview=True)
+
+
+def reload_chat_filters():
+    global chat_filters
+    chat_filters = FilterIndex(settings.chat_filters)
+
+
+@dp.message(Command("filters"), F.from_user.id == OWNER_ID)
+async def get_filters(message: types.Message):
+    logger.debug(f"Getting filters: {settings.chat_filters}")
+    try:
+        text = "\n".join(
+            f"{chat_id}: {format_rule(rule)}" for chat_id, rule in settings.chat_filters.items()
+        ) or "No filters set, every chat receives every home."
+    except Exception as e:
+        logger.error(e)
+        text = f"Error getting filters: {e}"
+
+    await message.answer(text)
+
+
+@dp.message(Command("set_filter"), F.from_user.id == OWNER_ID)
+async def set_filter(message: types.Message):
+    logger.debug(f"Setting filter: {message.text}")
+    try:
+        args = message.text.split()[1:]
+        if not args:
+            raise ValueError(
+                "Usage: /set_filter <chat id> price=1000-2500 size=50- bedrooms=2- energy=A,B postcode=1011-1019,1181"
+            )
+        chat_id = int(args[0])
+        rule = parse_rule(args[1:])
+        settings.set_chat_filter(chat_id, rule)
+        reload_chat_filters()
+        text = f"Filter of {chat_id} set: {format_rule(rule)}"
+    except Exception as e:
+        logger.error(e)
+        text = f"Error setting filter: {e}"
+
+    await message.answer(text)
+
+
+@dp.message(Command("clear_filter"), F.from_user.id == OWNER_ID)
+async def clear_filter(message: types.Message):
+    logger.debug(f"Clearing filter: {message.text}")
+    try:
+        chat_id = int(message.text.split(' ', 1)[1])
+        if settings.remove_chat_filter(chat_id):
+            reload_chat_filters()
+            text = f"Filter of {chat_id} removed"
+        else:
+            text = f"Chat has no filter: {chat_id}"
+    except Exception as e:
+        logger.error(e)
+        text = f"Error clearing filter: {e}"
+
+    await message.answer(text)
+
+
+async def listing_history() -> HistoryStore | None:
+    """
+    The scanner's listing history. A notifier opens the scanners' history.sqlite3 itself.
+    """
+    global notifier_history
+    if parser is not None:
+        return parser.history
+    if process_role == "notifier" and notifier_history is None:
+        notifier_history = await asyncio.to_thread(HistoryStore)
+    return notifier_history
+
+
+@dp.message(Command("recent"), F.from_user.id == OWNER_ID)
+async def recent_listings(message: types.Message):
+    logger.debug(f"Getting recent listings: {message.text}")
+    try:
+        args = message.text.split()[1:]
+        if not args:
+            raise ValueError("Usage: /recent <postcode or range, e.g. 1011-1019> [days]")
+        low, high = parse_range(args[0])
+        days = float(args[1]) if len(args) > 1 else 7
+        history = await listing_history()
+        if history is None:
+            raise RuntimeError("The scanner is still starting, try again in a moment")
+        rows = await history.recent_listings(low or 0, high or 9999, days)
+        lines = [
+            f"{postcode} {street_house}, {format_euros(price) if price is not None else 'N/A'}\n{url}"
+            for url, street_house, postcode, price, first_seen, last_seen in rows
+        ]
+        text = f"{len(rows)} listings in {args[0]} seen in the last {days:g} days\n\n" + "\n\n".join(lines)
+        if len(text) > MAX_MESSAGE_LENGTH:
+            text = text[:MAX_MESSAGE_LENGTH] + '...'
+    except Exception as e:
+        logger.error(e)
+        text = f"Error getting recent listings: {e}"
+
+    await message.answer(text, disable_web_page_preview=True)
+
+
+async def send_profile(chat_id: int, seconds: float):
+    """
+    Samples the bot for the given time in a thread and sends the summary and the folded stacks to the chat.
+    """
+    try:
+        summary, folded = await asyncio.to_thread(profiling.profile, seconds)
+        if len(summary) > MAX_MESSAGE_LENGTH:
+            summary = summary[:MAX_MESSAGE_LENGTH] + '...'
+        await bot.send_message(chat_id, summary, disable_web_page_preview=True)
+        await bot.send_document(chat_id, BufferedInputFile(folded, filename=f"profile-{int(time.time())}.folded"))
+    except Exception as e:
+        logger.error(f"Error profiling: {e}")
+        await bot.send_message(chat_id, f"Error profiling: {e}")
+
+
+@dp.message(Command("profile"), F.from_user.id == OWNER_ID)
+async def profile_bot(message: types.Message):
+    logger.debug(f"Profiling: {message.text}")
+    try:
+        args = message.text.split()[1:]
+        seconds = profiling.parse_duration(args[0]) if args else profiling.DEFAULT_PROFILE_SECONDS
+    except Exception as e:
+        logger.error(e)
+        await message.answer(f"Error profiling: {e}")
+        return
+
+    await message.answer(f"Profiling for {seconds:g} sec...")
+    await send_profile(message.chat.id, seconds)
+
+
+@dp.message(Command("memsnap"), F.from_user.id == OWNER_ID)
+async def memory_snapshot(message: types.Message):
+    logger.debug(f"Memory snapshot: {message.text}")
+    try:
+        if message.text.split()[1:] == ["stop"]:
+            text = profiling.stop_memory_tracing()
+        else:
+            text = await asyncio.to_thread(profiling.memory_snapshot)
+        if len(text) > MAX_MESSAGE_LENGTH:
+            text = text[:MAX_MESSAGE_LENGTH] + '...'
+    except Exception as e:
+        logger.error(e)
+        text = f"Error taking a memory snapshot: {e}"
+
+    await message.answer(text, disable_web_page_preview=True)
+
+
 @dp.message(F.text, F.chat.type == ChatType.PRIVATE, F.from_user.id.in_([OWNER_ID, *settings.admins_ids]))
 async def new_url_set(message: types.Message):
     try:
@@ -219,50 +518,215 @@ async def new_url_set(message: types.Message):
 
     await message.answer(text)
 
-    for chat in settings.known_chats:
-        await bot.send_message(chat_id=chat, text=text)
+    delivery.submit(text, settings.known_chats, parse_mode=None)
 
 
-async def check_new_offers():
+async def start_scanner(started: float):
     """
-    Checks for new offers and sends them to the group or chat where the bot is added.
+    Imports the parser and launches its browsers, then tells the owner the scanner is ready.
+    started is the time.monotonic() of main(), to report how long startup took.
     """
-    logger.info("Checking for new offers...")
+    global parser
+    if parser is None:
+        # Importing the scraping stack takes a while, and building the parser loads the
+        # seen index and opens the history, so both run off the loop
+        parser_module = await asyncio.to_thread(importlib.import_module, "parser")
+        parser = await asyncio.to_thread(
+            parser_module.FundaParser, shard=scanner_shard, parse_pool=parse_pool, replica=scanner_replica
+        )
+        startup_time.set(time.monotonic() - started, stage="imports")
+    if parser.ready:
+        return
+    await parser.start()
+    elapsed = time.monotonic() - started
+    startup_time.set(elapsed, stage="browsers")
+    logger.info(f"Scanner ready {elapsed:.1f} sec after start")
     try:
-        await parser.scan_funda()
-    except InvalidArgumentException:
-        logger.error(f"Invalid URL! Default URL will be used.\n{settings.funda_url_default}")
-        settings.funda_url = settings.funda_url_default
+        await bot.send_message(
+            OWNER_ID, f"Scanner ready ✅ {elapsed:.1f} sec after start, {settings.browser_workers} browser(s) up."
+        )
+    except Exception as e:
+        logger.error(f"Failed to send readiness message: {e}")
+
+
+async def check_new_offers(started: float):
+    """
+    Checks for new offers and sends them to the group or chat where the bot is added.
+    Restarts the scan loop after fatal errors, backing off while it keeps failing.
+    """
+    # Loaded here, not with main.py, so that a notifier never imports selenium
+    selenium_exceptions = await asyncio.to_thread(importlib.import_module, "selenium.common.exceptions")
+    restarts = 0
+    while True:
+        logger.info("Checking for new offers...")
+        started_at = time.monotonic()
+        try:
+            await start_scanner(started)
+            await parser.scan_funda()
+            return
+        except selenium_exceptions.InvalidArgumentException:
+            logger.error(f"Invalid URL! Default URL will be used.\n{settings.funda_url_default}")
+            settings.funda_url = settings.funda_url_default
+        except Exception as e:
+            logger.exception(f"Scan loop crashed: {e}")
+            await send_critical_error_message(e)
+            # A loop that ran for a while before crashing starts the backoff over
+            restarts = 1 if time.monotonic() - started_at > MAX_RESTART_DELAY else restarts + 1
+        scan_restarts.inc()
+        await asyncio.sleep(min(MAX_RESTART_DELAY, 2 ** restarts))
+
+
+def notification_recipients(notification) -> list[int]:
+    return chat_filters.recipients(notification.home, notification.chat_ids or settings.known_chats)
 
 
 async def check_and_send_new_messages():
     """
-    Continuously checks for new messages in the message queue and sends them to known chats.
+    Continuously takes notifications from the message queue and hands them to the delivery engine.
+    When Telegram falls behind, notifications pile up in the queue and are sent as digests.
     """
     while True:
-        message = await message_queue.get()
-        if message:
+        await delivery.wait_for_capacity(DELIVERY_BACKLOG)
+        notifications = await message_queue.get_batch()
+        # With scanner replicas the same listing can arrive more than once
+        recipients = await message_queue.unsent_recipients(notifications, notification_recipients)
+        messages = plan_messages(notifications, recipients)
+        if not messages:
+            logger.debug(f"No chat's filter accepts {notifications[0].home}, or every chat already got it")
+            continue
+        if len(notifications) > 1:
+            logger.info(f"Sending {len(notifications)} notifications as {len(messages)} digests...")
+        else:
             logger.info("Sending message...")
-            for chat_id in settings.known_chats:
-                try:
-                    await bot.send_message(chat_id=chat_id, text=message, parse_mode=ParseMode.HTML)
-                    await asyncio.sleep(1)
-                except Exception as e:
-                    logger.error(e)
+        for text, chat_ids, submitted_at in messages:
+            delivery.submit(text, chat_ids, parse_mode=ParseMode.HTML, submitted_at=submitted_at)
 
 
-async def main():
+async def watch_settings():
+    """
+    Picks up settings changed by the other processes when the scanner and notifier run apart.
+    """
+    while True:
+        await asyncio.sleep(SETTINGS_WATCH_INTERVAL)
+        try:
+            if settings.reload_if_changed():
+                logger.info("Reloaded settings changed by another process")
+                reload_chat_filters()
+        except Exception as e:
+            logger.error(f"Failed to reload settings: {e}")
+
+
+async def main(role: str = "all", shard: tuple[int, int] | None = None, metrics_port: int | None = None,
+               replica: str | None = None):
+    """
+    Runs the bot. role is one of ROLES; shard limits a scanner to a share of the
+    searches; metrics_port overrides the one in the settings; replica names a
+    scanner that polls the same searches as another one.
+    """
+    global process_role, scanner_shard, scanner_replica, parse_pool
+    process_role, scanner_shard, scanner_replica = role, shard, replica
+    if role != "notifier" and parser is None:
+        # First thing, while this is the only thread, see parsing.start_parse_pool().
+        # Imported here, so that a notifier never loads bs4 and lxml.
+        from parsing import start_parse_pool
+        parse_pool = start_parse_pool()
+    metrics_server = None
+    started = time.monotonic()
+
+    async def dispatcher_ready():
+        startup_time.set(time.monotonic() - started, stage="dispatcher")
+        logger.info(f"Answering commands {time.monotonic() - started:.1f} sec after start")
+
+    dp.startup.register(dispatcher_ready)
+    profiles = set()
+
+    def on_profile_signal():
+        # For processes without polling too, e.g. a scanner: `kill -USR1 <pid>`
+        logger.info(f"Profiling for {profiling.DEFAULT_PROFILE_SECONDS} sec on SIGUSR1")
+        task = asyncio.create_task(send_profile(OWNER_ID, profiling.DEFAULT_PROFILE_SECONDS), name="profile")
+        profiles.add(task)
+        task.add_done_callback(profiles.discard)
+
+    if hasattr(signal, "SIGUSR1"):
+        asyncio.get_running_loop().add_signal_handler(signal.SIGUSR1, on_profile_signal)
+    if metrics_port is None:
+        metrics_port = settings.metrics_port
     try:
-        logger.info("Starting bot...")
-        await on_startup()
-        await asyncio.gather(dp.start_polling(bot), check_new_offers(), check_and_send_new_messages())
+        logger.info(f"Starting bot ({role})...")
+        if metrics_port:
+            metrics_server = await metrics.start_http_server(metrics_port)
+            logger.info(f"Serving metrics on http://127.0.0.1:{metrics_port}/metrics")
+        tasks = []
+        if role != "scanner":
+            await on_startup()
+            tasks += [dp.start_polling(bot), check_and_send_new_messages()]
+        if role != "notifier":
+            tasks.append(check_new_offers(started))
+        if role != "all":
+            tasks.append(watch_settings())
+        # Commands are answered right away, the scanner comes up in the background
+        await asyncio.gather(*tasks)
     except Exception as e:
         error_msg = f"{type(e).__name__}: {e}"
         logger.critical(f"Bot crashed: {error_msg}")
         await send_critical_error_message(error_msg)
     finally:
+        if metrics_server is not None:
+            await metrics_server.cleanup()
+        if parser is not None:
+            await parser.close()
+        elif parse_pool is not None:
+            parse_pool.shutdown(wait=False, cancel_futures=True)
+        if notifier_history is not None:
+            await notifier_history.close()
+        await delivery.close()
         await bot.session.close()
+        settings.flush()
+        await message_queue.close()
+
+
+def parse_shard(value: str) -> tuple[int, int]:
+    try:
+        index, count = map(int, value.split("/"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Expected INDEX/COUNT, e.g. 0/2: {value}")
+    if not 0 <= index < count:
+        raise argparse.ArgumentTypeError(f"Shard index must be from 0 to {count - 1}: {value}")
+    return index, count
+
+
+def parse_replica(value: str) -> str:
+    if not re.fullmatch(r"[A-Za-z0-9_-]+", value):
+        raise argparse.ArgumentTypeError(f"Expected letters, digits, - or _: {value}")
+    return value
+
+
+def parse_args() -> argparse.Namespace:
+    arg_parser = argparse.ArgumentParser(description="Scans Funda.nl for rental offers and sends them to Telegram.")
+    arg_parser.add_argument(
+        "role", nargs="?", default="all", choices=ROLES,
+        help="run everything (default), only the scanner, or only the Telegram bot and delivery",
+    )
+    arg_parser.add_argument(
+        "--shard", type=parse_shard, metavar="INDEX/COUNT",
+        help="scanner only: poll the searches whose id %% COUNT == INDEX",
+    )
+    arg_parser.add_argument(
+        "--replica", type=parse_replica, metavar="NAME",
+        help="scanner only: name of a replica, which keeps its own seen listings log",
+    )
+    arg_parser.add_argument("--metrics-port", type=int, help="overrides _metrics_port, 0 turns the endpoint off")
+    args = arg_parser.parse_args()
+    if args.role != "all" and not message_queue.shared:
+        arg_parser.error("Scanner and notifier can only run apart over a shared queue: "
+                         "set _queue_transport in settings.json to sqlite or redis")
+    if args.shard is not None and args.role == "notifier":
+        arg_parser.error("--shard applies to scanners")
+    if args.replica is not None and args.role == "notifier":
+        arg_parser.error("--replica applies to scanners")
+    return args
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    args = parse_args()
+    asyncio.run(main(args.role, args.shard, args.metrics_port, args.replica))
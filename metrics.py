@@ -0,0 +1,260 @@
+import threading
+import time
+
+# Default latency buckets in seconds, from a fast HTTP poll up to a stuck browser
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def _format_labels(self, key: tuple, extra: dict = None) -> str:
+        pairs = list(zip(self.labelnames, key))
+        if extra:
+            pairs.extend(extra.items())
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{name}="{value}"' for name, value in pairs) + "}"
+
+    def samples(self):
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        for key, value in list(self._values.items()):
+            yield f"{self.name}{self._format_labels(key)}", value
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values: dict[tuple, float] = {}
+        self._function = None
+
+    def set_function(self, function):
+        """
+        Reads the value from function() at render time instead, e.g. for a queue size.
+        """
+        self._function = function
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def value(self, **labels) -> float:
+        if self._function is not None:
+            return self._function()
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        if self._function is not None:
+            yield self.name, self._function()
+            return
+        for key, value in list(self._values.items()):
+            yield f"{self.name}{self._format_labels(key)}", value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # key -> [bucket counts..., count, sum]
+        self._values: dict[tuple, list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            row = self._values.get(key)
+            if row is None:
+                row = self._values[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    row[i] += 1
+            row[-2] += 1
+            row[-1] += value
+
+    def time(self, **labels):
+        return _Timer(self, labels)
+
+    def count(self, **labels) -> int:
+        row = self._values.get(self._key(labels))
+        return row[-2] if row else 0
+
+    def mean(self, **labels) -> float:
+        row = self._values.get(self._key(labels))
+        return row[-1] / row[-2] if row and row[-2] else 0.0
+
+    def series(self):
+        """
+        Yields (labels, count, sum) for every label set observed so far.
+        """
+        for key, row in list(self._values.items()):
+            yield dict(zip(self.labelnames, key)), row[-2], row[-1]
+
+    def samples(self):
+        for key, row in list(self._values.items()):
+            for bound, bucket_count in zip(self.buckets, row):
+                yield f"{self.name}_bucket{self._format_labels(key, {'le': bound})}", bucket_count
+            yield f"{self.name}_bucket{self._format_labels(key, {'le': '+Inf'})}", row[-2]
+            yield f"{self.name}_count{self._format_labels(key)}", row[-2]
+            yield f"{self.name}_sum{self._format_labels(key)}", row[-1]
+
+
+class _Timer:
+    def __init__(self, histogram: Histogram, labels: dict):
+        self.histogram = histogram
+        self.labels = labels
+        self.elapsed = 0.0
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.elapsed = time.perf_counter() - self._start
+        self.histogram.observe(self.elapsed, **self.labels)
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: dict[str, Metric] = {}
+
+    def _register(self, cls, name, documentation, labelnames=(), **kwargs):
+        metric = self._metrics.get(name)
+        if metric is None:
+            metric = self._metrics[name] = cls(name, documentation, labelnames, **kwargs)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()) -> Counter:
+        return self._register(Counter, name, documentation, labelnames)
+
+    def gauge(self, name, documentation, labelnames=()) -> Gauge:
+        return self._register(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def render(self) -> str:
+        """
+        Renders every metric in the Prometheus text exposition format.
+        """
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for sample, value in metric.samples():
+                lines.append(f"{sample} {value}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> str:
+        """
+        Renders a short human-readable digest: counter and gauge values, histogram counts and means.
+        """
+        lines = []
+        for metric in self._metrics.values():
+            if isinstance(metric, Histogram):
+                for labels, count, total in metric.series():
+                    if count:
+                        lines.append(f"{metric.name}{_plain_labels(labels)}: n={count} avg={total / count:.3g}")
+            else:
+                for sample, value in metric.samples():
+                    sample = sample.replace('"', "")
+                    lines.append(f"{sample}: {value:.4g}")
+        return "\n".join(lines)
+
+
+def _plain_labels(labels: dict) -> str:
+    return "{" + ",".join(f"{name}={value}" for name, value in labels.items()) + "}" if labels else ""
+
+
+async def start_http_server(port: int, host: str = "127.0.0.1"):
+    """
+    Serves the registry at http://host:port/metrics for Prometheus. Returns the aiohttp runner to clean up.
+    """
+    from aiohttp import web
+
+    async def handle_metrics(request):
+        return web.Response(text=registry.render(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+
+registry = Registry()
+
+poll_latency = registry.histogram(
+    "funda_poll_latency_seconds", "Time to fetch and parse one result page", ("backend",)
+)
+http_fallbacks = registry.counter(
+    "funda_http_fallbacks_total", "HTTP polls that fell back to the browser", ("reason",)
+)
+fetch_errors = registry.counter(
+    "funda_fetch_errors_total", "Failed browser page loads", ("kind",)
+)
+fetch_phase = registry.histogram(
+    "funda_fetch_phase_seconds", "Browser page load time by phase: driver.get, selector wait, page_source",
+    ("phase",)
+)
+parse_skips = registry.counter(
+    "funda_parse_skips_total", "Result pages by whether they were parsed or unchanged since the last poll",
+    ("result",)
+)
+parse_time_saved = registry.counter(
+    "funda_parse_saved_seconds_total", "Parse time saved by skipping unchanged result pages, estimated"
+)
+parse_time = registry.histogram(
+    "funda_parse_seconds", "Time to parse one result page in the parser pool", ("engine",),
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+)
+listings_per_poll = registry.histogram(
+    "funda_listings_per_poll", "Listings found by one poll of a search",
+    buckets=(0, 1, 5, 10, 15, 20, 30, 50, 100)
+)
+detection_lag = registry.histogram(
+    "funda_detection_lag_seconds",
+    "Upper bound of the time a new listing went unnoticed: time since the previous successful poll",
+    buckets=(1, 2.5, 5, 10, 15, 30, 60, 120, 300, 600)
+)
+queue_depth = registry.gauge(
+    "funda_message_queue_depth", "Notifications waiting to be handed to the delivery engine"
+)
@@ -0,0 +1,208 @@
+import re
+import time
+
+LISTING_ID_RE = re.compile(r"/(\d+)/?(?:[?#].*)?$")
+NUMBER_RE = re.compile(r"\d[\d.,]*")
+POSTCODE_RE = re.compile(r"\s*(\d{4})")
+ENERGY_LABEL_RE = re.compile(r"[A-G]\+*")
+
+
+def parse_listing_id(url) -> int | None:
+    """
+    Returns the numeric Funda id at the end of a listing URL, e.g. 43000000 for '.../appartement-x/43000000/'.
+    """
+    match = LISTING_ID_RE.search(url or "")
+    return int(match.group(1)) if match else None
+
+
+def parse_number(text) -> int | None:
+    """
+    Returns the first whole number in text, e.g. 1450 for '€ 1.450 /month', or None.
+    Dots and commas are read as thousands separators, as on Funda.
+    """
+    match = NUMBER_RE.search(text or "")
+    return int(match.group().replace(".", "").replace(",", "")) if match else None
+
+
+def parse_postcode(text) -> int | None:
+    """
+    Returns the four digits of a Dutch postcode at the start of text, e.g. 1181 for '1181 GA Amstelveen'.
+    """
+    match = POSTCODE_RE.match(text or "")
+    return int(match.group(1)) if match else None
+
+
+def parse_energy_label(text) -> str | None:
+    label = (text or "").strip().upper()
+    return label if ENERGY_LABEL_RE.fullmatch(label) else None
+
+
+def format_euros(amount: int) -> str:
+    return f"€ {amount:,}".replace(",", ".")
+
+
+class Home:
+    """
+    One listing from a result page.
+
+    The card fields are kept as the display strings Funda shows, next to typed
+    values parsed from them for filtering and comparisons. Slots keep the many
+    homes held by the seen, history and dedup stores small.
+    """
+
+    __slots__ = (
+        'url', 'map_url', 'street_house', 'postal_code_city', 'price', 'size', 'bedrooms', 'energy_rating',
+        'makelaar_url', 'makelaar_text', 'details',
+        'listing_id', 'price_value', 'size_value', 'bedrooms_value', 'energy_label', 'postcode',
+        '_info',
+    )
+
+    def __init__(self, **kwargs):
+        self.url = kwargs.get('url')
+        self.map_url = kwargs.get('map_url')
+        self.street_house = kwargs.get('street_house')
+        self.postal_code_city = kwargs.get('postal_code_city')
+        self.price = kwargs.get('price')
+        self.size = kwargs.get('size')
+        self.bedrooms = kwargs.get('bedrooms')
+        self.energy_rating = kwargs.get('energy_rating', 'N/A')
+        self.makelaar_url = kwargs.get('makelaar_url')
+        self.makelaar_text = kwargs.get('makelaar_text')
+        # Filled in from the detail page after the card was announced
+        self.details = kwargs.get('details')
+        # Typed values of the card fields, for filtering and comparisons
+        self.listing_id = parse_listing_id(self.url)
+        self.price_value = parse_number(self.price)
+        self.size_value = parse_number(self.size)
+        self.bedrooms_value = parse_number(self.bedrooms)
+        self.energy_label = parse_energy_label(self.energy_rating)
+        self.postcode = parse_postcode(self.postal_code_city)
+        self._info = None
+
+    def __getstate__(self):
+        # A plain tuple keeps homes small on their way out of the parser processes
+        return tuple(getattr(self, name) for name in self.__slots__[:-1])
+
+    def __setstate__(self, state):
+        for name, value in zip(self.__slots__, state):
+            setattr(self, name, value)
+        self._info = None
+
+    def __eq__(self, other):
+        if not isinstance(other, Home):
+            return NotImplemented
+        return self.key == other.key
+
+    def __hash__(self):
+        return hash(self.key)
+
+    @property
+    def key(self):
+        """
+        Stable identity of the listing: its Funda id, or the URL if it has none.
+        """
+        return self.listing_id if self.listing_id is not None else self.url
+
+    def __repr__(self):
+        return (
+            f"<Home street_house={self.street_house}, "
+            f"price={self.price}, "
+            f"size={self.size}, "
+            f"bedrooms={self.bedrooms}, "
+            f"energy_rating={self.energy_rating}>"
+        )
+
+    @property
+    def beautified_info(self):
+        # Rendered once, the card fields never change after parsing
+        if self._info is None:
+            self._info = self._render_info()
+        return self._info
+
+    def _render_info(self):
+        return (
+            f"📍 <a href='{self.url}'>{self.street_house}</a>\n"
+            f"     \t{self.postal_code_city}\n\n"
+            f"💰 {self.price}\n"
+            f"🏠 {self.size}\n"
+            f"🛏️ {self.bedrooms}\n"
+            f"⚡️ {self.energy_rating}\n"
+            f'👤 {self.makelaar_text}\n'
+        )
+
+    @property
+    def beautified_details(self):
+        details = self.details or {}
+        lines = [f"ℹ️ <a href='{self.url}'>{self.street_house}</a>"]
+        if details.get('available_from'):
+            lines.append(f"📅 Available: {details['available_from']}")
+        if details.get('deposit'):
+            lines.append(f"🔐 Deposit: {details['deposit']}")
+        if details.get('service_costs'):
+            lines.append(f"🧾 Service costs: {details['service_costs']}")
+        if details.get('interior'):
+            lines.append(f"🛋️ Interior: {details['interior']}")
+        return "\n".join(lines) + "\n"
+
+    def beautified_price_change(self, old_price: int):
+        arrow = "📉" if self.price_value < old_price else "📈"
+        return (
+            f"{arrow} Price changed: {format_euros(old_price)} → {format_euros(self.price_value)}\n\n"
+            + self.beautified_info
+        )
+
+    @property
+    def beautified_relisted(self):
+        return "🔁 Back on the market\n\n" + self.beautified_info
+
+
+class Notification:
+    # What the message is about, see FundaParser.scan_search
+    NEW = "new"
+    DETAILS = "details"
+    PRICE_CHANGE = "price_change"
+    RELISTED = "relisted"
+
+    def __init__(self, text: str, chat_ids: list[int] = None, home: Home = None, search_id: int = None,
+                 kind: str = NEW):
+        self.text = text
+        self.kind = kind
+        # None means every known chat
+        self.chat_ids = chat_ids
+        self.home = home
+        self.search_id = search_id
+        self.created_at = time.monotonic()
+
+    def to_dict(self) -> dict:
+        """
+        JSON-serialisable form, for the pending notifications file.
+        """
+        return {
+            "text": self.text,
+            "kind": self.kind,
+            "chat_ids": self.chat_ids,
+            "search_id": self.search_id,
+            "home": list(self.home.__getstate__()) if self.home is not None else None,
+            # Wall clock, so the age survives a restart
+            "queued_at": time.time() - (time.monotonic() - self.created_at),
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Notification":
+        home = None
+        if data.get("home") is not None:
+            home = Home.__new__(Home)
+            home.__setstate__(data["home"])
+        notification = cls(
+            data["text"], chat_ids=data.get("chat_ids"), home=home, search_id=data.get("search_id"),
+            kind=data.get("kind", cls.NEW),
+        )
+        if data.get("queued_at"):
+            notification.created_at = time.monotonic() - max(0.0, time.time() - data["queued_at"])
+        return notification
+
+    def __repr__(self):
+        return (
+            f"<Notification kind={self.kind}, search_id={self.search_id}, "
+            f"chat_ids={self.chat_ids}, home={self.home}>"
+        )
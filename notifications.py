@@ -0,0 +1,538 @@
+"""
+The queue between the scanner and the Telegram delivery engine.
+
+NotificationQueue holds structured notifications instead of rendered strings. It
+is bounded: when Telegram cannot keep up, the scanner waits in put() instead of
+memory growing without limit. A notification for a listing that is still waiting
+replaces the queued one, so a listing matched by several searches, or changing
+price twice, is sent once. Pending notifications are saved write-behind to disk
+and reloaded on startup.
+
+Under backpressure, once DIGEST_AFTER notifications are waiting, the consumer
+takes them all at once and sends each chat digests of several homes, split to
+stay under Telegram's message length limit.
+
+The queue has three transports. "local" lives in the bot's own process. "sqlite"
+and "redis" are shared, so scanners and the notifier can run as separate
+processes (see main.py). Shared transports also remember for a day which
+listing went to which chat, so scanner replicas never cause duplicate messages.
+"""
+import abc
+import asyncio
+import json
+import os
+import sqlite3
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from loguru import logger
+
+import metrics
+from models import Notification
+from persistence import WriteBehind
+
+MAX_MESSAGE_LENGTH = 4092
+MAX_PENDING = 1000
+# Waiting notifications from which on they are sent as digests
+DIGEST_AFTER = 5
+DIGEST_SEPARATOR = "\n➖➖➖\n\n"
+# Messages a chat may have waiting in the delivery engine before the consumer stops taking notifications
+DELIVERY_BACKLOG = 3
+
+QUEUE_TRANSPORTS = ("local", "sqlite", "redis")
+DEFAULT_SQLITE_PATH = "notifications.sqlite3"
+DEFAULT_REDIS_URL = "redis://localhost:6379/0"
+# How often a shared queue is checked for room or for new notifications
+POLL_INTERVAL = 0.2
+# How long a shared queue remembers that a chat got a listing
+SENT_TTL = 24 * 3600
+
+queue_events = metrics.registry.counter(
+    "funda_notification_queue_total", "Notifications by what the queue did with them", ("event",)
+)
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS pending (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    dedup_key TEXT NOT NULL UNIQUE,
+    notification TEXT NOT NULL,
+    queued_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS sent (
+    sent_key TEXT PRIMARY KEY,
+    sent_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sent_at ON sent (sent_at);
+"""
+
+# KEYS: order list, pending hash, queued at hash. ARGV: dedup key, notification, queued at, maxsize.
+# Returns the outcome and the queue length.
+REDIS_PUSH = """
+if redis.call('HEXISTS', KEYS[2], ARGV[1]) == 1 then
+    redis.call('HSET', KEYS[2], ARGV[1], ARGV[2])
+    return {'duplicate', redis.call('LLEN', KEYS[1])}
+end
+local size = redis.call('LLEN', KEYS[1])
+if size >= tonumber(ARGV[4]) then
+    return {'full', size}
+end
+redis.call('RPUSH', KEYS[1], ARGV[1])
+redis.call('HSET', KEYS[2], ARGV[1], ARGV[2])
+redis.call('HSET', KEYS[3], ARGV[1], ARGV[3])
+return {'queued', size + 1}
+"""
+# KEYS as above. ARGV: digest after, maxsize.
+# Returns the remaining queue length, then notification and queued at of each taken item.
+REDIS_POP = """
+local size = redis.call('LLEN', KEYS[1])
+local count = 1
+if size >= tonumber(ARGV[1]) then
+    count = math.min(size, tonumber(ARGV[2]))
+end
+local keys = redis.call('LRANGE', KEYS[1], 0, count - 1)
+redis.call('LTRIM', KEYS[1], count, -1)
+local result = {size - #keys}
+for _, key in ipairs(keys) do
+    local notification = redis.call('HGET', KEYS[2], key)
+    if notification then
+        table.insert(result, notification)
+        table.insert(result, redis.call('HGET', KEYS[3], key))
+    end
+    redis.call('HDEL', KEYS[2], key)
+    redis.call('HDEL', KEYS[3], key)
+end
+return result
+"""
+
+
+def truncate(text: str, limit: int = MAX_MESSAGE_LENGTH) -> str:
+    return text[:limit] + '...' if len(text) > limit else text
+
+
+def build_digests(texts: list[str], limit: int = MAX_MESSAGE_LENGTH) -> list[str]:
+    """
+    Packs messages into as few digests as possible, in order, each under limit characters.
+    """
+    digests, current = [], []
+    length = 0
+    for text in texts:
+        text = truncate(text, limit)
+        added = len(text) + (len(DIGEST_SEPARATOR) if current else 0)
+        if current and length + added > limit:
+            digests.append(DIGEST_SEPARATOR.join(current))
+            current, length = [], 0
+            added = len(text)
+        current.append(text)
+        length += added
+    if current:
+        digests.append(DIGEST_SEPARATOR.join(current))
+    return digests
+
+
+def plan_messages(notifications: list[Notification], recipients) -> list[tuple[str, list[int], float]]:
+    """
+    Turns a batch from the queue into (text, chat ids, submitted at) messages.
+    recipients(notification) returns the chats that should get a notification.
+    A single notification is sent as it is; a larger batch becomes digests, per
+    set of chats that get the same notifications.
+    """
+    if len(notifications) == 1:
+        notification = notifications[0]
+        chat_ids = recipients(notification)
+        return [(truncate(notification.text), chat_ids, notification.created_at)] if chat_ids else []
+
+    per_chat: dict[int, list[Notification]] = {}
+    for notification in notifications:
+        for chat_id in recipients(notification):
+            per_chat.setdefault(chat_id, []).append(notification)
+    groups: dict[tuple, list[int]] = {}
+    for chat_id, chat_notifications in per_chat.items():
+        groups.setdefault(tuple(chat_notifications), []).append(chat_id)
+    messages = []
+    for group, chat_ids in groups.items():
+        oldest = min(notification.created_at for notification in group)
+        for digest in build_digests([notification.text for notification in group]):
+            messages.append((digest, chat_ids, oldest))
+    return messages
+
+
+def sent_key(notification: Notification, chat_id: int) -> str | None:
+    """
+    Identity of a notification as delivered to one chat: kind, listing and chat,
+    plus the new price for price changes. None for messages without a listing.
+    """
+    if notification.home is None:
+        return None
+    parts = [notification.kind, str(notification.home.key), str(chat_id)]
+    if notification.kind == Notification.PRICE_CHANGE:
+        parts.append(str(notification.home.price_value))
+    return ":".join(parts)
+
+
+class BaseNotificationQueue(abc.ABC):
+    """
+    What the scanner and the consumer use, whatever the transport.
+    """
+    # Whether other processes can put to and take from the same queue
+    shared = False
+    maxsize: int
+
+    @staticmethod
+    def dedup_key(notification: Notification) -> tuple:
+        if notification.home is None:
+            # Nothing to coalesce, e.g. admin messages
+            return ("text", uuid.uuid4().hex)
+        chats = tuple(sorted(notification.chat_ids)) if notification.chat_ids else None
+        return (notification.kind, str(notification.home.key), chats)
+
+    @abc.abstractmethod
+    def qsize(self) -> int:
+        ...
+
+    def empty(self) -> bool:
+        return self.qsize() == 0
+
+    def full(self) -> bool:
+        return self.qsize() >= self.maxsize
+
+    @abc.abstractmethod
+    async def put(self, notification: Notification):
+        ...
+
+    @abc.abstractmethod
+    async def get_batch(self, digest_after: int = DIGEST_AFTER) -> list[Notification]:
+        ...
+
+    async def get(self) -> Notification:
+        return (await self.get_batch(digest_after=self.maxsize + 1))[0]
+
+    async def claim(self, keys: list[str]) -> set[str]:
+        """
+        Marks the sent keys as delivered and returns those that were not delivered before.
+        Only shared queues remember deliveries; a single scanner never repeats itself.
+        """
+        return set(keys)
+
+    async def unsent_recipients(self, notifications: list[Notification], recipients):
+        """
+        Wraps recipients(notification) for plan_messages() so that chats which already
+        got the same notification, e.g. from another scanner replica or earlier in the
+        batch, are left out. The chats it returns are claimed as delivered.
+        """
+        chats = {id(notification): recipients(notification) for notification in notifications}
+        keys = {
+            (id(notification), chat_id): sent_key(notification, chat_id)
+            for notification in notifications for chat_id in chats[id(notification)]
+        }
+        fresh = await self.claim([key for key in keys.values() if key is not None])
+        unsent = {}
+        for notification in notifications:
+            unsent[id(notification)] = []
+            for chat_id in chats[id(notification)]:
+                key = keys[(id(notification), chat_id)]
+                if key is None or key in fresh:
+                    fresh.discard(key)
+                    unsent[id(notification)].append(chat_id)
+                else:
+                    queue_events.inc(event="already_sent")
+        return lambda notification: unsent[id(notification)]
+
+    def flush(self):
+        pass
+
+    async def close(self):
+        self.flush()
+
+
+class NotificationQueue(BaseNotificationQueue):
+    """
+    Bounded FIFO of notifications, one per (kind, listing, recipients), persisted to path.
+    Meant for any number of producers and a single consumer, in one process.
+    """
+
+    def __init__(self, path: str = "pending_notifications.json", maxsize: int = MAX_PENDING):
+        self.path = path
+        self.maxsize = maxsize
+        self._pending: OrderedDict[tuple, Notification] = OrderedDict()
+        self._not_empty = asyncio.Event()
+        self._not_full = asyncio.Event()
+        self._not_full.set()
+        self._writer = WriteBehind(path, self._snapshot)
+        self.load()
+
+    def qsize(self) -> int:
+        return len(self._pending)
+
+    async def put(self, notification: Notification):
+        """
+        Queues the notification, waiting while the queue is full. A notification of
+        the same kind for the same listing and chats that is still waiting is
+        replaced, keeping its place in the queue.
+        """
+        key = self.dedup_key(notification)
+        queued = self._pending.get(key)
+        if queued is not None:
+            # The newer text is more accurate, the older timestamp keeps latency honest
+            notification.created_at = queued.created_at
+            self._pending[key] = notification
+            queue_events.inc(event="duplicate")
+            self._writer.mark_dirty()
+            return
+        while self.full():
+            queue_events.inc(event="backpressure")
+            self._not_full.clear()
+            await self._not_full.wait()
+        self._pending[key] = notification
+        queue_events.inc(event="queued")
+        self._not_empty.set()
+        self._writer.mark_dirty()
+
+    async def get_batch(self, digest_after: int = DIGEST_AFTER) -> list[Notification]:
+        """
+        Waits for notifications and returns the oldest one, or every waiting one once
+        digest_after or more have piled up.
+        """
+        while not self._pending:
+            self._not_empty.clear()
+            await self._not_empty.wait()
+        count = len(self._pending) if len(self._pending) >= digest_after else 1
+        batch = [self._pending.popitem(last=False)[1] for _ in range(count)]
+        if count > 1:
+            queue_events.inc(count, event="digested")
+        self._not_full.set()
+        self._writer.mark_dirty()
+        return batch
+
+    def _snapshot(self) -> list[dict]:
+        return [notification.to_dict() for notification in self._pending.values()]
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r") as f:
+                items = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.error(f"Failed to load pending notifications from {self.path}: {e}")
+            return
+        for item in items:
+            notification = Notification.from_dict(item)
+            self._pending[self.dedup_key(notification)] = notification
+        if self._pending:
+            self._not_empty.set()
+            logger.info(f"Loaded {len(self._pending)} pending notifications from {self.path}")
+
+    def flush(self):
+        """
+        Writes the pending notifications to disk right away, e.g. on shutdown.
+        """
+        self._writer.flush()
+
+
+class SharedNotificationQueue(BaseNotificationQueue):
+    """
+    A queue kept outside the process, so several scanners and a notifier can use it.
+    Subclasses store it; waiting for room or for notifications is done by polling.
+    qsize() is the length seen by this process's last put or take.
+    """
+    shared = True
+
+    def __init__(self, maxsize: int = MAX_PENDING):
+        self.maxsize = maxsize
+        self._size = 0
+
+    def qsize(self) -> int:
+        return self._size
+
+    @abc.abstractmethod
+    async def _push(self, key: str, notification: str, queued_at: float) -> tuple[str, int]:
+        """
+        Queues or replaces the notification unless the queue is full.
+        Returns "queued", "duplicate" or "full", and the queue length.
+        """
+
+    @abc.abstractmethod
+    async def _pop(self, digest_after: int) -> tuple[list[tuple[str, float]], int]:
+        """
+        Takes the oldest notification, or up to maxsize once digest_after are waiting.
+        Returns (notification, queued at) pairs and the remaining queue length.
+        """
+
+    async def put(self, notification: Notification):
+        key = json.dumps(self.dedup_key(notification))
+        data = notification.to_dict()
+        payload = json.dumps(data)
+        waited = False
+        while True:
+            status, self._size = await self._push(key, payload, data["queued_at"])
+            if status != "full":
+                break
+            if not waited:
+                queue_events.inc(event="backpressure")
+                waited = True
+            await asyncio.sleep(POLL_INTERVAL)
+        queue_events.inc(event=status)
+
+    async def get_batch(self, digest_after: int = DIGEST_AFTER) -> list[Notification]:
+        while True:
+            items, self._size = await self._pop(digest_after)
+            if items:
+                break
+            await asyncio.sleep(POLL_INTERVAL)
+        batch = []
+        for payload, queued_at in items:
+            data = json.loads(payload)
+            # A replaced notification keeps the time the first one was queued
+            data["queued_at"] = queued_at
+            batch.append(Notification.from_dict(data))
+        if len(batch) > 1:
+            queue_events.inc(len(batch), event="digested")
+        return batch
+
+
+class SqliteNotificationQueue(SharedNotificationQueue):
+    """
+    Queue in an SQLite file, for processes on one host. The database is only
+    touched from its own thread; processes take turns through SQLite's locking.
+    """
+
+    def __init__(self, path: str = DEFAULT_SQLITE_PATH, maxsize: int = MAX_PENDING):
+        super().__init__(maxsize)
+        self.path = path
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="notification-queue")
+        self._db: sqlite3.Connection | None = None
+        self._executor.submit(self._open).result()
+
+    def _open(self):
+        # Autocommit, transactions are opened explicitly; waits up to 30 s for other processes' locks
+        self._db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SQLITE_SCHEMA)
+        self._size = self._db.execute("SELECT COUNT(*) FROM pending").fetchone()[0]
+        logger.info(f"Opened notification queue {self.path} with {self._size} pending")
+
+    async def _run(self, function, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, function, *args)
+
+    def _transaction(self, function, *args):
+        # IMMEDIATE takes the write lock up front, so two processes cannot interleave
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            result = function(*args)
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+        self._db.execute("COMMIT")
+        return result
+
+    def _push_sync(self, key: str, notification: str, queued_at: float) -> tuple[str, int]:
+        if self._db.execute(
+            "UPDATE pending SET notification = ? WHERE dedup_key = ?", (notification, key)
+        ).rowcount:
+            status = "duplicate"
+        elif self._db.execute("SELECT COUNT(*) FROM pending").fetchone()[0] >= self.maxsize:
+            status = "full"
+        else:
+            self._db.execute(
+                "INSERT INTO pending (dedup_key, notification, queued_at) VALUES (?, ?, ?)",
+                (key, notification, queued_at),
+            )
+            status = "queued"
+        return status, self._db.execute("SELECT COUNT(*) FROM pending").fetchone()[0]
+
+    def _pop_sync(self, digest_after: int) -> tuple[list[tuple[str, float]], int]:
+        size = self._db.execute("SELECT COUNT(*) FROM pending").fetchone()[0]
+        count = min(size, self.maxsize) if size >= digest_after else 1
+        rows = self._db.execute(
+            "SELECT seq, notification, queued_at FROM pending ORDER BY seq LIMIT ?", (count,)
+        ).fetchall()
+        if rows:
+            self._db.execute("DELETE FROM pending WHERE seq <= ?", (rows[-1][0],))
+        return [(notification, queued_at) for _, notification, queued_at in rows], size - len(rows)
+
+    def _claim_sync(self, keys: list[str]) -> set[str]:
+        now = time.time()
+        self._db.execute("DELETE FROM sent WHERE sent_at < ?", (now - SENT_TTL,))
+        return {
+            key for key in keys
+            if self._db.execute("INSERT OR IGNORE INTO sent (sent_key, sent_at) VALUES (?, ?)", (key, now)).rowcount
+        }
+
+    async def _push(self, key: str, notification: str, queued_at: float) -> tuple[str, int]:
+        return await self._run(self._transaction, self._push_sync, key, notification, queued_at)
+
+    def _has_pending_sync(self) -> bool:
+        return bool(self._db.execute("SELECT EXISTS (SELECT 1 FROM pending)").fetchone()[0])
+
+    async def _pop(self, digest_after: int) -> tuple[list[tuple[str, float]], int]:
+        # Polling an empty queue only reads, the write lock is left to the scanners
+        if not await self._run(self._has_pending_sync):
+            return [], 0
+        return await self._run(self._transaction, self._pop_sync, digest_after)
+
+    async def claim(self, keys: list[str]) -> set[str]:
+        if not keys:
+            return set()
+        return await self._run(self._transaction, self._claim_sync, keys)
+
+    async def close(self):
+        await self._run(self._db.close)
+        self._executor.shutdown(wait=False)
+
+
+class RedisNotificationQueue(SharedNotificationQueue):
+    """
+    Queue in Redis, for processes on several hosts. Needs the redis package (5.0 or
+    newer), which is only imported when this transport is used.
+    """
+
+    def __init__(self, url: str = DEFAULT_REDIS_URL, maxsize: int = MAX_PENDING, prefix: str = "funda:notifications"):
+        super().__init__(maxsize)
+        try:
+            import redis.asyncio as redis
+        except ImportError as e:
+            raise RuntimeError("The redis queue transport needs the redis package: pip install 'redis>=5'") from e
+        self.url = url
+        self.prefix = prefix
+        self._redis = redis.from_url(url)
+        self._keys = [f"{prefix}:order", f"{prefix}:pending", f"{prefix}:queued_at"]
+        self._push_script = self._redis.register_script(REDIS_PUSH)
+        self._pop_script = self._redis.register_script(REDIS_POP)
+
+    async def _push(self, key: str, notification: str, queued_at: float) -> tuple[str, int]:
+        status, size = await self._push_script(keys=self._keys, args=[key, notification, queued_at, self.maxsize])
+        return status.decode(), int(size)
+
+    async def _pop(self, digest_after: int) -> tuple[list[tuple[str, float]], int]:
+        size, *items = await self._pop_script(keys=self._keys, args=[digest_after, self.maxsize])
+        return [(items[i].decode(), float(items[i + 1])) for i in range(0, len(items), 2)], int(size)
+
+    async def claim(self, keys: list[str]) -> set[str]:
+        if not keys:
+            return set()
+        pipeline = self._redis.pipeline(transaction=False)
+        for key in keys:
+            # SET NX succeeds for exactly one claimer; the key expires with the window
+            pipeline.set(f"{self.prefix}:sent:{key}", 1, nx=True, ex=SENT_TTL)
+        return {key for key, claimed in zip(keys, await pipeline.execute()) if claimed}
+
+    async def close(self):
+        await self._redis.aclose()
+
+
+def create_queue(transport: str = "local", url: str | None = None, maxsize: int = MAX_PENDING) -> BaseNotificationQueue:
+    """
+    The notification queue for a transport from QUEUE_TRANSPORTS. url is the SQLite
+    file or the Redis URL; None uses the default.
+    """
+    if transport == "local":
+        return NotificationQueue(maxsize=maxsize)
+    if transport == "sqlite":
+        return SqliteNotificationQueue(url or DEFAULT_SQLITE_PATH, maxsize)
+    if transport == "redis":
+        return RedisNotificationQueue(url or DEFAULT_REDIS_URL, maxsize)
+    raise ValueError(f"Unknown queue transport: {transport}. Expected one of {QUEUE_TRANSPORTS}")
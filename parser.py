@@ -1,111 +1,169 @@
 import asyncio
-import os
-import platform
-import re
+import functools
+import time
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urlsplit, urlunsplit
 
-from bs4 import BeautifulSoup
-from seleniumbase import Driver
 from selenium.common import TimeoutException, WebDriverException
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from loguru import logger
 
-from settings import message_queue, settings
+import metrics
+from browser import BrowserPool, BrowserWorker, block_resources, create_driver
+from enrichment import Enricher, TTLCache
+from history import HistoryStore
+from http_fetcher import HttpFetcher
+from models import Home, Notification
+from parsing import page_fingerprint, parse_details, parse_homes, start_parse_pool
+from replay import Recorder
+from scheduler import PollScheduler
+from seen import SeenIndex, seen_file
+from settings import DEFAULT_POLL_INTERVAL, message_queue, settings
 
 WEBDRIVER_WAIT_TIMEOUT = 10
+SCHEDULER_TICK = 0.5
+# Unchanged result pages reuse the previous parse, but are parsed in full at least this often
+PARSED_PAGE_TTL = 3600
+PARSED_PAGES = 64
+
+extra_pages = metrics.registry.counter(
+    "funda_extra_pages_total", "Result pages fetched beyond the first one", ("search",)
+)
+
+
+def page_url(url: str, page: int) -> str:
+    """
+    Returns the URL of the given result page of a search, page 1 being the URL itself.
+    """
+    if page <= 1:
+        return url
+    parts = urlsplit(url)
+    # Edit the raw query, so Funda's own encoding of the filters is kept as is
+    query = [param for param in parts.query.split("&") if param and not param.startswith("search_result=")]
+    query.append(f"search_result={page}")
+    return urlunsplit(parts._replace(query="&".join(query)))
+
+
+class SearchState:
+    def __init__(self, scheduler: PollScheduler):
+        self.latest_homes: list[Home] = []
+        self.next_poll: float = 0.0
+        self.last_success: float | None = None
+        self.task: asyncio.Task | None = None
+        self.scheduler = scheduler
 
 
-class Home:
-    def __init__(self, **kwargs):
-        self.url = kwargs.get('url')
-        self.map_url = kwargs.get('map_url')
-        self.street_house = kwargs.get('street_house')
-        self.postal_code_city = kwargs.get('postal_code_city')
-        self.price = kwargs.get('price')
-        self.size = kwargs.get('size')
-        self.bedrooms = kwargs.get('bedrooms')
-        self.energy_rating = kwargs.get('energy_rating', 'N/A')
-        self.makelaar_url = kwargs.get('makelaar_url')
-        self.makelaar_text = kwargs.get('makelaar_text')
-
-    def __repr__(self):
-        return (
-            f"<Home street_house={self.street_house}, "
-            f"price={self.price}, "
-            f"size={self.size}, "
-            f"bedrooms={self.bedrooms}, "
-            f"energy_rating={self.energy_rating}>"
+class FundaParser:
+    def __init__(self, driver_factory=create_driver, shard: tuple[int, int] | None = None,
+                 parse_pool: ProcessPoolExecutor | None = None, replica: str | None = None):
+        self.settings = settings
+        # (index, count): poll only the searches whose id % count == index, see main.py
+        self.shard = shard
+        # Parsing is CPU bound, so it runs in worker processes. They must be forked before
+        # the process runs any thread, so main() starts the pool early and passes it in.
+        self.parse_pool = parse_pool or start_parse_pool()
+        # Every browser has a dedicated thread for its driver calls. The pool
+        # recycles browsers before Chrome's memory use gets out of hand. The
+        # browsers are launched by start().
+        self.browsers = BrowserPool(
+            self.settings.browser_workers,
+            driver_factory,
+            on_start=self.prepare_driver,
+            max_pages=self.settings.browser_max_pages,
+            max_rss=self.settings.browser_max_rss_mb * 1024 * 1024,
+            max_age=self.settings.browser_max_age_hours * 3600,
         )
+        self.browser_monitor: asyncio.Task | None = None
+        # Browser-free client for the "http" backend, set up once a browser session has cookies
+        self.http: HttpFetcher | None = None
+        self.http_slots = asyncio.Semaphore(self.settings.http_workers)
+        # Listings announced so far, per search, kept across polls and restarts.
+        # Shards and replicas each keep their own log.
+        self.seen = SeenIndex(seen_file(shard, replica))
+        # Every sighting with its price, to spot price changes and relistings
+        self.history = HistoryStore()
+        self.states: dict[int, SearchState] = {}
+        # URL -> (fingerprint, engine, homes, parse time) of the last full parse of each result page
+        self.parsed_pages = TTLCache(PARSED_PAGES, PARSED_PAGE_TTL)
+        # Detail pages of new homes are looked up after the card has been announced
+        self.enricher = Enricher(self.fetch_details, self.parse_details, workers=self.settings.enrich_workers)
+        # Fetched pages are saved for replay.py when a record directory is set
+        self.recorder = Recorder(self.settings.record_dir) if self.settings.record_dir else None
 
     @property
-    def beautified_info(self):
-        return (
-            f"📍 <a href='{self.url}'>{self.street_house}</a>\n"
-            f"     \t{self.postal_code_city}\n\n"
-            f"💰 {self.price}\n"
-            f"🏠 {self.size}\n"
-            f"🛏️ {self.bedrooms}\n"
-            f"⚡️ {self.energy_rating}\n"
-            f'👤 {self.makelaar_text}\n'
-        )
+    def ready(self) -> bool:
+        return bool(self.browsers.workers)
 
+    async def start(self):
+        """
+        Launches the browsers, concurrently and without blocking the loop. Does nothing if they are up.
+        """
+        if not self.ready:
+            await self.browsers.start()
 
-class FundaParser:
-    def __init__(self):
-        # Check if the platform is Linux (for Ubuntu or similar systems)
-        if platform.system() == "Linux":
-            # Check if Chrome exists at the expected path
-            chrome_path = "/usr/bin/google-chrome-stable"
-            if not os.path.exists(chrome_path):
-                chrome_path = "/usr/bin/google-chrome"  # Default location
-                if not os.path.exists(chrome_path):
-                    raise Exception("Chrome not found at the expected locations.")
-        else:
-            chrome_path = None  # On other systems, rely on the default binary location
-
-        # Initialize the Driver with the correct Chrome binary location
-        self.driver: Driver = Driver(
-            uc=True,
-            headless=True,
-            binary_location=chrome_path  # Pass the Chrome path if found
-        )
-        self.previous_homes: list[Home] = []
-        self.latest_homes: list[Home] = []
-        self.settings = settings
+    def prepare_driver(self, driver):
+        """
+        Sets up a freshly started driver. Runs on its browser thread.
+        """
+        if self.settings.block_resources:
+            try:
+                block_resources(driver, self.settings.blocked_url_patterns)
+            except Exception as e:
+                logger.warning(f"Resource blocking is not available: {e}")
 
-    async def fetch_page(self, first_time=False):
+    async def fetch_page(self, browser: BrowserWorker, url: str):
+        """
+        Fetches the page on the browser's thread and returns its source, or None on failure.
         """
-        Fetches the Funda page and handles popups/captchas during the first fetch.
+        first_time = not browser.session_ready
+        page_source, redirected = await browser.run(self.load_page, url, first_time)
+        if redirected:
+            self.reset_search_url(url)
+        if page_source and first_time:
+            browser.session_ready = True
+        return page_source
+
+    def load_page(self, driver, url, first_time=False) -> tuple[str | None, bool]:
+        """
+        Loads the Funda page and handles popups/captchas during the first fetch.
+        Runs on the browser thread, so it leaves the settings alone: returns the page
+        source, or None on failure, and whether the browser ended up on another URL.
         """
         try:
-            logger.debug(f"Fetching data from {self.settings.funda_url}. Timeout: {WEBDRIVER_WAIT_TIMEOUT} sec")
+            logger.debug(f"Fetching data from {url}. Timeout: {WEBDRIVER_WAIT_TIMEOUT} sec")
             if first_time:
                 logger.debug(f"First time: {first_time}")
-            self.driver.get(self.settings.funda_url)
+            with metrics.fetch_phase.time(phase="get"):
+                driver.get(url)
 
             # Wait for page elements to load - updated selector to match new HTML structure
-            WebDriverWait(self.driver, WEBDRIVER_WAIT_TIMEOUT).until(
-                EC.presence_of_element_located((By.CSS_SELECTOR, 'div.flex.flex-col.sm\\:flex-row'))
-            )
+            with metrics.fetch_phase.time(phase="wait"):
+                WebDriverWait(driver, WEBDRIVER_WAIT_TIMEOUT).until(
+                    EC.presence_of_element_located((By.CSS_SELECTOR, 'div.flex.flex-col.sm\\:flex-row'))
+                )
 
             if first_time:
-                self.handle_initial_popups()
-            return True
+                self.handle_initial_popups(driver)
+            with metrics.fetch_phase.time(phase="page_source"):
+                return driver.page_source, False
         except TimeoutException:
             logger.warning("Timed out waiting for page to load")
+            metrics.fetch_errors.inc(kind="timeout")
         except WebDriverException:
             logger.error("WebDriverException encountered")
-            self.handle_driver_exception()
-        return False
+            metrics.fetch_errors.inc(kind="webdriver")
+            return None, driver.current_url != url
+        return None, False
 
-    def handle_initial_popups(self):
+    def handle_initial_popups(self, driver):
         """
         Handles cookies, captchas, or other initial popups on the first page load.
         """
         try:
             logger.info("Handling cookie consent and popups...")
-            cookie_button = WebDriverWait(self.driver, WEBDRIVER_WAIT_TIMEOUT).until(
+            cookie_button = WebDriverWait(driver, WEBDRIVER_WAIT_TIMEOUT).until(
                 EC.element_to_be_clickable((By.ID, "didomi-notice-agree-button"))
             )
             cookie_button.click()
@@ -113,7 +171,7 @@ class FundaParser:
 
             # Updated selector for closing popup
             try:
-                close_button = WebDriverWait(self.driver, WEBDRIVER_WAIT_TIMEOUT).until(
+                close_button = WebDriverWait(driver, WEBDRIVER_WAIT_TIMEOUT).until(
                     EC.element_to_be_clickable(
                         (
                             By.CSS_SELECTOR,
@@ -128,150 +186,348 @@ class FundaParser:
         except TimeoutException:
             logger.warning("Timed out handling initial popups.")
 
-    def handle_driver_exception(self):
+    def reset_search_url(self, url):
         """
-        Handles exceptions by resetting the URL to default if the page cannot load.
+        Resets the URL of the searches using url to the default, after it failed to load.
+        Runs on the loop, like every other settings change.
         """
-        if self.driver.current_url != self.settings.funda_url:
-            self.settings.funda_url = self.settings.funda_url_default
-            logger.info("Reset URL to default.")
+        for search in self.settings.searches:
+            if search["url"] == url:
+                self.settings.update_search(search["id"], url=self.settings.funda_url_default)
+                logger.info(f"Reset URL of search {search['id']} to default.")
 
-    async def extract_home_info(self):
+    def load_detail_page(self, driver, url):
         """
-        Extracts home information from the loaded page.
+        Loads a listing detail page and returns its source. Runs on the browser thread.
         """
-        soup = BeautifulSoup(self.driver.page_source, 'html.parser')
-
-        # Get all home container elements, skipping advertisements
-        container_divs = soup.find_all("div", {"class": "border-b pb-3"})
+        try:
+            driver.get(url)
+            WebDriverWait(driver, WEBDRIVER_WAIT_TIMEOUT).until(EC.presence_of_element_located((By.TAG_NAME, "dt")))
+            return driver.page_source
+        except TimeoutException:
+            logger.warning(f"Timed out waiting for detail page {url}")
+            metrics.fetch_errors.inc(kind="detail_timeout")
+        except WebDriverException as e:
+            logger.error(f"WebDriverException loading detail page {url}: {e.msg}")
+            metrics.fetch_errors.inc(kind="detail_webdriver")
+        return None
+
+    async def fetch_details(self, url: str):
+        """
+        Fetches a detail page over HTTP when a borrowed session is available, otherwise in a browser.
+        """
+        if self.http is not None:
+            async with self.http_slots:
+                page_source = await self.http.fetch(url)
+            if page_source:
+                self.record(url, page_source)
+                return page_source
+        browser = await self.browsers.acquire()
+        page_source = None
+        try:
+            page_source = await browser.run(self.load_detail_page, url)
+            if page_source:
+                self.record(url, page_source)
+            return page_source
+        finally:
+            self.browsers.release(browser, ok=bool(page_source))
 
-        homes = []
-        for container in container_divs:
-            # Skip advertisements by checking for ad-related classes or IDs
-            ad_element = container.find(["div"], {"id": re.compile(r'div-gpt-ad')})
-            if ad_element:
-                logger.debug("Skipping advertisement element")
-                continue
+    def record(self, url: str, page_source: str):
+        if self.recorder is not None:
+            self.recorder.record(url, page_source)
 
-            # Look for the main flex container that holds the home data
-            flex_container = container.find("div", {"class": "flex flex-col sm:flex-row"})
-            if not flex_container:
-                continue
+    async def parse_details(self, page_source):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.parse_pool, parse_details, page_source)
 
-            home = self.extract_home_data(flex_container)
-            if home.url:  # Only add if we have a valid URL
-                home.map_url = f"{home.url}/#kaart"
-                homes.append(home)
+    async def announce_details(self, search: dict, home: Home):
+        """
+        Queues the follow-up message with the detail page data of an announced home.
+        """
+        await message_queue.put(Notification(
+            home.beautified_details, chat_ids=search["chats"] or None, home=home, search_id=search["id"],
+            kind=Notification.DETAILS,
+        ))
 
+    async def extract_home_info(self, page_source, url=None):
+        """
+        Extracts home information from the page source in the parser process pool.
+        A result page whose listing links and prices are unchanged since its last
+        parse is not parsed again; the homes of that parse are returned instead.
+        """
+        engine = self.settings.parser_engine
+        fingerprint = page_fingerprint(page_source) if url is not None else None
+        if fingerprint is not None:
+            parsed = self.parsed_pages.get(url)
+            if parsed is not None and parsed[:2] == (fingerprint, engine):
+                metrics.parse_skips.inc(result="unchanged")
+                metrics.parse_time_saved.inc(parsed[3])
+                # A copy, callers extend the list with further pages
+                return list(parsed[2])
+
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        with metrics.parse_time.time(engine=engine):
+            homes = await loop.run_in_executor(self.parse_pool, parse_homes, page_source, engine)
+        metrics.parse_skips.inc(result="parsed")
+        if fingerprint is not None and homes:
+            self.parsed_pages.set(url, (fingerprint, engine, list(homes), time.perf_counter() - start))
         return homes
 
-    def extract_home_data(self, element):
-        """
-        Extracts home details from a single element.
-        """
-        # Find the home info container
-        info_container = element.find("div",
-                                      {"class": "relative flex w-full min-w-0 flex-col pl-0 pt-4 sm:pl-4 sm:pt-0"})
-        if not info_container:
-            return Home()
-
-        # Extract URL and address info
-        address_link = info_container.find("a", {"data-testid": "listingDetailsAddress"})
-        url = address_link['href'] if address_link else None
-        if url and not url.startswith('http'):
-            url = f"https://www.funda.nl{url}"
-
-        street_house_elem = address_link.find("span", {"class": "truncate"}) if address_link else None
-        street_house = street_house_elem.text.strip() if street_house_elem else None
-
-        postal_code_city_elem = address_link.find("div",
-                                                  {"class": "truncate text-neutral-80"}) if address_link else None
-        postal_code_city = postal_code_city_elem.text.strip() if postal_code_city_elem else None
-
-        # Extract price
-        price_elem = info_container.find("div", {"class": "truncate"}, text=re.compile(r'€'))
-        price = price_elem.text.strip() if price_elem else None
-
-        # Extract property info from list items
-        size = None
-        bedrooms = None
-        energy_rating = None
-
-        list_items = info_container.find_all("li", {"class": "flex items-center"})
-        for item in list_items:
-            item_text = item.text.strip()
-            svg = item.find("svg")
-            if svg:
-                svg_path = svg.find("path")
-                if svg_path:
-                    path_d = svg_path.get("d", "")
-                    # Identify what info this item represents by SVG path
-                    if "m²" in item_text:
-                        size = item_text
-                    elif path_d.startswith("M11 20") or "bed" in item_text.lower():  # Path for bedrooms
-                        bedrooms = item_text.strip()
-                    elif path_d.startswith("M23.675") or any(
-                            rating in item_text for rating in "ABCDEFG+"):  # Path for energy rating
-                        energy_rating = item_text
-
-        # Extract realtor info
-        makelaar_elem = info_container.find("a", {"class": re.compile(r"truncate.*text-secondary-70")})
-        makelaar_url = makelaar_elem['href'] if makelaar_elem else None
-        makelaar_text = makelaar_elem.text.strip() if makelaar_elem else None
-
-        return Home(
-            url=url,
-            street_house=street_house,
-            postal_code_city=postal_code_city,
-            price=price,
-            size=size,
-            bedrooms=bedrooms,
-            energy_rating=energy_rating,
-            makelaar_url=makelaar_url,
-            makelaar_text=makelaar_text
+    async def borrow_browser_session(self, browser: BrowserWorker):
+        """
+        Hands the browser cookies and user agent over to the HTTP client.
+        """
+        cookies, user_agent = await browser.run(
+            lambda driver: (driver.get_cookies(), driver.execute_script("return navigator.userAgent"))
         )
+        if self.http is None:
+            self.http = HttpFetcher()
+        self.http.load_browser_session(cookies, user_agent)
 
-    async def check_new_homes(self):
+    async def poll(self, url: str):
         """
-        Compares the latest homes with previously fetched homes and returns new ones.
+        Fetches and parses a result page with the configured backend.
+        Returns the list of homes, or None if the page could not be fetched.
         """
-        old_homes_urls = [home.url for home in self.previous_homes]
-        return [home for home in self.latest_homes if home.url not in old_homes_urls]
+        if self.settings.fetch_backend == "http" and self.http is not None:
+            async with self.http_slots:
+                start = time.perf_counter()
+                page_source = await self.http.fetch(url)
+                if page_source:
+                    self.record(url, page_source)
+                    homes = await self.extract_home_info(page_source, url)
+                    if homes:
+                        self.observe_poll("http", start, len(homes))
+                        return homes
+                    metrics.http_fallbacks.inc(reason="empty")
+                else:
+                    metrics.http_fallbacks.inc(reason="challenge")
+            logger.info("HTTP fetch was blocked or empty, falling back to the browser")
 
-    async def scan_funda(self):
+        browser = await self.browsers.acquire()
+        page_source = None
+        try:
+            start = time.perf_counter()
+            page_source = await self.fetch_page(browser, url)
+            if not page_source:
+                return None
+            self.record(url, page_source)
+            homes = await self.extract_home_info(page_source, url)
+            self.observe_poll("browser", start, len(homes))
+
+            if self.settings.fetch_backend == "http":
+                # The browser may have just passed a challenge, so refresh the borrowed cookies
+                await self.borrow_browser_session(browser)
+            return homes
+        finally:
+            self.browsers.release(browser, ok=bool(page_source))
+
+    @staticmethod
+    def observe_poll(backend, start, homes_count):
+        elapsed = time.perf_counter() - start
+        metrics.poll_latency.observe(elapsed, backend=backend)
+        logger.debug(
+            f"Poll via {backend} took {elapsed * 1000:.0f} ms, {homes_count} homes "
+            f"(avg {metrics.poll_latency.mean(backend=backend) * 1000:.0f} ms "
+            f"over {metrics.poll_latency.count(backend=backend)} polls)"
+        )
+
+    @staticmethod
+    def seen_key(search: dict, home: Home) -> str:
+        return f"{search['id']}:{home.url}"
+
+    def is_cold_start(self, search: dict) -> bool:
+        return f"search:{search['id']}" not in self.seen
+
+    async def poll_pages(self, search: dict):
         """
-        Periodically scans Funda for new homes and updates the queue.
+        Fetches the first result page and, while none of its listings were seen before, the following ones.
+        Results are sorted newest first, so a known listing on a page means everything
+        past it was already seen. The common case costs a single fetch. The first poll
+        of a search fetches every page up to max_result_pages, so they are all marked
+        as seen and listings moving up from later pages are not taken for new ones.
+        Returns the homes of all fetched pages, or None if the first page could not be fetched.
         """
+        homes = await self.poll(search["url"])
+        if not homes:
+            return homes
+        cold_start = self.is_cold_start(search)
+        page_homes = homes
+        for page in range(2, self.settings.max_result_pages + 1):
+            if not cold_start:
+                if any(self.seen_key(search, home) in self.seen for home in page_homes):
+                    break
+                logger.info(f"No listing on page {page - 1} of search {search['id']} was seen before, "
+                            f"fetching page {page}")
+            extra_pages.inc(search=search["id"])
+            page_homes = await self.poll(page_url(search["url"], page))
+            if not page_homes:
+                break
+            homes.extend(page_homes)
+        return homes
+
+    async def check_new_homes(self, search: dict, homes: list[Home]):
+        """
+        Returns the homes never seen before for this search and marks them all as seen.
+        On the first poll of a search only the latest home is returned, to show the search works.
+        """
+        marker = f"search:{search['id']}"
+        cold_start = self.is_cold_start(search)
+
+        new_homes = []
+        new_urls = set()
+        for home in homes:
+            if self.seen_key(search, home) not in self.seen and home.url not in new_urls:
+                new_urls.add(home.url)
+                new_homes.append(home)
+        self.seen.add_many([marker, *(self.seen_key(search, home) for home in homes)])
+        return homes[:1] if cold_start else new_homes
+
+    async def scan_search(self, search: dict, state: SearchState):
+        """
+        Polls one saved search and queues notifications for its new homes.
+        """
+        logger.debug(f"Checking search {search['id']} for new homes...")
+        new_count = None
         try:
-            if not await self.fetch_page(first_time=True):
+            homes = await self.poll_pages(search)
+            if homes is None:
+                return
+            metrics.listings_per_poll.observe(len(homes))
+            if not homes:
+                logger.warning(f"No homes found for search {search['id']}")
+                new_count = 0
                 return
 
-            self.previous_homes = await self.extract_home_info()
-            logger.debug(f"Initial data fetched: {self.previous_homes}")
-            if self.previous_homes:
-                last_home = self.previous_homes[0]
-                await message_queue.put(last_home.beautified_info)
+            state.latest_homes = homes
+            cold_start = self.is_cold_start(search)
+            new_homes = await self.check_new_homes(search, homes)
+            new_count = len(new_homes)
+            now = time.monotonic()
+            if state.last_success is not None and not cold_start:
+                # Each new listing appeared at some point since the previous successful poll
+                for _ in new_homes:
+                    metrics.detection_lag.observe(now - state.last_success)
+            state.last_success = now
+            price_changes, relisted = self.history.observe(search["id"], homes)
+            if cold_start:
+                # Changes picked up by a brand new search would only flood its chats
+                price_changes, relisted = [], []
+            relisted_homes = set(relisted)
+            # A home announced as new already shows its current price
+            price_changes = [(home, old_price) for home, old_price in price_changes if home not in new_homes]
+
+            chat_ids = search["chats"] or None
+            if new_homes:
+                logger.info(f"{len(new_homes)} new homes found for search {search['id']}.")
+                for home in new_homes:
+                    if home in relisted_homes:
+                        # Forgotten by the seen index, but the history knows it
+                        relisted_homes.discard(home)
+                        text, kind = home.beautified_relisted, Notification.RELISTED
+                    else:
+                        text, kind = home.beautified_info, Notification.NEW
+                    await message_queue.put(Notification(
+                        text, chat_ids=chat_ids, home=home, search_id=search["id"], kind=kind
+                    ))
+                    if self.settings.enrich_details:
+                        self.enricher.enrich(home, functools.partial(self.announce_details, search))
             else:
-                logger.warning("No homes found in initial fetch")
-
-            while True:
-                logger.debug("Checking for new homes...")
-                if not await self.fetch_page():
-                    continue
-
-                self.latest_homes = await self.extract_home_info()
-                new_homes = await self.check_new_homes()
+                logger.debug(f"No new homes found for search {search['id']}.")
+
+            for home in relisted:
+                if home in relisted_homes:
+                    logger.info(f"Relisted home found for search {search['id']}: {home}")
+                    await message_queue.put(Notification(
+                        home.beautified_relisted, chat_ids=chat_ids, home=home, search_id=search["id"],
+                        kind=Notification.RELISTED,
+                    ))
+            for home, old_price in price_changes:
+                logger.info(f"Price of {home} changed from {old_price} for search {search['id']}")
+                await message_queue.put(Notification(
+                    home.beautified_price_change(old_price), chat_ids=chat_ids, home=home, search_id=search["id"],
+                    kind=Notification.PRICE_CHANGE,
+                ))
+        except Exception as e:
+            logger.exception(f"Scanning search {search['id']} failed: {e}")
+        finally:
+            # Cleared first, a failing delay computation must not stop the search from being polled again
+            state.task = None
+            state.next_poll = time.monotonic() + self.next_delay(search, state, new_count)
 
-                if new_homes:
-                    logger.info(f"{len(new_homes)} new homes found.")
-                    for home in new_homes:
-                        await message_queue.put(home.beautified_info)
-                else:
-                    logger.debug("No new homes found.")
+    @staticmethod
+    def next_delay(search: dict, state: SearchState, new_count: int | None) -> float:
+        """
+        Returns the delay before the next poll of a search, new_count being None after a failed poll.
+        """
+        min_interval = search.get("interval", DEFAULT_POLL_INTERVAL)
+        try:
+            if new_count is None:
+                # Timeouts and WebDriver errors back off instead of hot-looping
+                return state.scheduler.after_failure(min_interval)
+            return state.scheduler.after_success(new_count, min_interval)
+        except Exception as e:
+            logger.exception(f"Scheduling the next poll of search {search['id']} failed: {e}")
+            return DEFAULT_POLL_INTERVAL
+
+    def own_searches(self) -> list[dict]:
+        if self.shard is None:
+            return self.settings.searches
+        index, count = self.shard
+        return [search for search in self.settings.searches if search["id"] % count == index]
 
-                self.previous_homes = self.latest_homes
-                await asyncio.sleep(10)
+    async def scan_funda(self):
+        """
+        Periodically scans every saved search for new homes and updates the queue.
+        Due searches run concurrently, bounded by the browser and HTTP worker pools.
+        Can be awaited again after it failed; the browsers and other resources are
+        only released by close().
+        """
+        await self.start()
+        if self.browser_monitor is None or self.browser_monitor.done():
+            self.browser_monitor = asyncio.create_task(self.browsers.monitor(), name="browser-monitor")
+        try:
+            while True:
+                now = time.monotonic()
+                active_ids = set()
+                for search in self.own_searches():
+                    active_ids.add(search["id"])
+                    state = self.states.get(search["id"])
+                    if state is None:
+                        state = self.states[search["id"]] = SearchState(PollScheduler(
+                            search["id"],
+                            self.settings.poll_max_interval,
+                            self.settings.poll_quiet_max_interval,
+                            self.settings.quiet_hours,
+                        ))
+                    if state.task is None and now >= state.next_poll:
+                        state.task = asyncio.create_task(self.scan_search(search, state))
+                for search_id in set(self.states) - active_ids:
+                    # The search was removed, let an in-flight poll finish on its own
+                    self.states.pop(search_id)
+                await asyncio.sleep(SCHEDULER_TICK)
         except KeyboardInterrupt:
             logger.info("Stopping the script.")
         finally:
-            self.driver.quit()
\ No newline at end of file
+            tasks = [state.task for state in self.states.values() if state.task is not None]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def close(self):
+        """
+        Stops the browsers and releases the HTTP client, parser pool and seen index.
+        """
+        if self.browser_monitor is not None:
+            self.browser_monitor.cancel()
+            await asyncio.gather(self.browser_monitor, return_exceptions=True)
+        await self.enricher.close()
+        await self.history.close()
+        await self.browsers.stop()
+        if self.http is not None:
+            await self.http.close()
+        self.parse_pool.shutdown(wait=False, cancel_futures=True)
+        self.seen.close()
+        if self.recorder is not None:
+            self.recorder.close()
\ No newline at end of file
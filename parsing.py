@@ -0,0 +1,372 @@
+"""
+Pure page parsing helpers.
+
+Kept free of selenium and settings imports so that they can run inside
+the parser process pool without dragging the browser stack along.
+"""
+import hashlib
+import multiprocessing
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from bs4 import BeautifulSoup
+from loguru import logger
+from lxml import etree, html
+
+from models import ENERGY_LABEL_RE, Home
+
+PARSE_WORKERS = 2
+
+AD_ID_RE = re.compile(r'div-gpt-ad')
+PRICE_RE = re.compile(r'€')
+MAKELAAR_CLASS_RE = re.compile(r"truncate.*text-secondary-70")
+
+# Start of the first listing container, everything before it is skipped by the lxml engine
+CONTAINER_MARKER = 'class="border-b pb-3"'
+# What a poll acts on: listing links (new listings) and prices (price changes)
+FINGERPRINT_LINK_RE = re.compile(r'href="[^"]*/detail/[^"]*"')
+FINGERPRINT_PRICE_RE = re.compile(r'€[^<]*')
+
+
+def _has_class(name: str) -> str:
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+
+# Precompiled XPath selectors mirroring the BeautifulSoup lookups below
+XP_CONTAINERS = etree.XPath("//div[@class='border-b pb-3']")
+XP_AD = etree.XPath(".//div[contains(@id, 'div-gpt-ad')]")
+XP_FLEX = etree.XPath("(.//div[@class='flex flex-col sm:flex-row'])[1]")
+XP_INFO = etree.XPath(
+    "(.//div[@class='relative flex w-full min-w-0 flex-col pl-0 pt-4 sm:pl-4 sm:pt-0'])[1]"
+)
+XP_ADDRESS = etree.XPath("(.//a[@data-testid='listingDetailsAddress'])[1]")
+XP_STREET = etree.XPath(f"(.//span[{_has_class('truncate')}])[1]")
+XP_POSTAL = etree.XPath("(.//div[@class='truncate text-neutral-80'])[1]")
+XP_TRUNCATE_DIVS = etree.XPath(f".//div[{_has_class('truncate')}]")
+XP_LIST_ITEMS = etree.XPath(".//li[@class='flex items-center']")
+XP_SVG_PATH = etree.XPath("(.//svg)[1]/descendant::path[1]")
+XP_MAKELAAR = etree.XPath(
+    "(.//a[re:test(@class, 'truncate.*text-secondary-70')])[1]",
+    namespaces={"re": "http://exslt.org/regular-expressions"}
+)
+# Listing card facts (<li> with an icon) -> Home field, by the start of the icon's SVG path.
+# Only paths seen on live result pages belong here; the bench corpus icons are made up.
+LIST_ITEM_ICONS = {
+    "M11 20": "bedrooms",
+    "M23.675": "energy_rating",
+}
+LIST_ITEM_ICON_RE = re.compile("|".join(re.escape(prefix) for prefix in LIST_ITEM_ICONS))
+# Fallbacks by the text itself, for icons not in the table, in order of precedence.
+# Energy labels must be the whole text, so other facts such as "Furnished" are not taken for one.
+LIST_ITEM_PATTERNS = (
+    ("size", re.compile(r"m²")),
+    ("bedrooms", re.compile(r"bed|slaapkamer", re.IGNORECASE)),
+    ("energy_rating", re.compile(rf"^{ENERGY_LABEL_RE.pattern}$")),
+)
+
+# Detail pages list their features as <dt>label</dt><dd>value</dd> pairs
+XP_DETAIL_TERMS = etree.XPath("//dt")
+
+# Detail page labels (English and Dutch pages) -> detail field
+DETAIL_LABELS = {
+    "available": "available_from",
+    "available from": "available_from",
+    "acceptance": "available_from",
+    "aanvaarding": "available_from",
+    "beschikbaar": "available_from",
+    "beschikbaar vanaf": "available_from",
+    "deposit": "deposit",
+    "waarborgsom": "deposit",
+    "borg": "deposit",
+    "interior": "interior",
+    "interieur": "interior",
+    "service costs": "service_costs",
+    "servicekosten": "service_costs",
+    "offered since": "offered_since",
+    "aangeboden sinds": "offered_since",
+}
+
+
+def start_parse_pool() -> ProcessPoolExecutor:
+    """
+    Creates the parser process pool and forks its workers right away.
+
+    A fork copies only the calling thread, and a lock some other thread holds at
+    that moment (loguru's, an executor's) stays held in the workers forever. So
+    the pool is started before the process runs any thread: main() does it first
+    thing and hands it to the parser. The workers inherit this module, so they
+    are ready to parse without importing anything.
+    """
+    if threading.active_count() > 1:
+        logger.warning(f"Forking the parse pool while {threading.active_count()} threads run")
+    start_method = "fork" if "fork" in multiprocessing.get_all_start_methods() else None
+    pool = ProcessPoolExecutor(max_workers=PARSE_WORKERS, mp_context=multiprocessing.get_context(start_method))
+    # The first submit forks every worker at once, before the pool starts its own threads
+    pool.submit(int).result()
+    return pool
+
+
+def parse_homes(page_source: str, engine: str = "lxml") -> list[Home]:
+    """
+    Extracts home information from the page source with the given parser engine.
+    """
+    return PARSER_ENGINES[engine](page_source)
+
+
+def page_fingerprint(page_source: str) -> bytes | None:
+    """
+    Returns a digest of the listing links and prices of a result page, or None if it has no listings.
+    Costs two regex scans, a fraction of a full parse. Pages with the same digest
+    hold the same listings at the same prices.
+    """
+    start = page_source.find(CONTAINER_MARKER)
+    if start < 0:
+        return None
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update("\0".join(FINGERPRINT_LINK_RE.findall(page_source, start)).encode())
+    digest.update(b"\1")
+    digest.update("\0".join(FINGERPRINT_PRICE_RE.findall(page_source, start)).encode())
+    return digest.digest()
+
+
+def parse_homes_bs4(page_source: str) -> list[Home]:
+    """
+    Extracts home information from the page source of a results page with BeautifulSoup.
+    """
+    soup = BeautifulSoup(page_source, 'html.parser')
+
+    # Get all home container elements, skipping advertisements
+    container_divs = soup.find_all("div", {"class": "border-b pb-3"})
+
+    homes = []
+    for container in container_divs:
+        # Skip advertisements by checking for ad-related classes or IDs
+        ad_element = container.find(["div"], {"id": AD_ID_RE})
+        if ad_element:
+            logger.debug("Skipping advertisement element")
+            continue
+
+        # Look for the main flex container that holds the home data
+        flex_container = container.find("div", {"class": "flex flex-col sm:flex-row"})
+        if not flex_container:
+            continue
+
+        home = extract_home_data(flex_container)
+        if home.url:  # Only add if we have a valid URL
+            home.map_url = f"{home.url}/#kaart"
+            homes.append(home)
+
+    return homes
+
+
+def extract_home_data(element) -> Home:
+    """
+    Extracts home details from a single element.
+    """
+    # Find the home info container
+    info_container = element.find("div",
+                                  {"class": "relative flex w-full min-w-0 flex-col pl-0 pt-4 sm:pl-4 sm:pt-0"})
+    if not info_container:
+        return Home()
+
+    # Extract URL and address info
+    address_link = info_container.find("a", {"data-testid": "listingDetailsAddress"})
+    url = address_link['href'] if address_link else None
+    if url and not url.startswith('http'):
+        url = f"https://www.funda.nl{url}"
+
+    street_house_elem = address_link.find("span", {"class": "truncate"}) if address_link else None
+    street_house = street_house_elem.text.strip() if street_house_elem else None
+
+    postal_code_city_elem = address_link.find("div",
+                                              {"class": "truncate text-neutral-80"}) if address_link else None
+    postal_code_city = postal_code_city_elem.text.strip() if postal_code_city_elem else None
+
+    # Extract price
+    price_elem = info_container.find("div", {"class": "truncate"}, text=PRICE_RE)
+    price = price_elem.text.strip() if price_elem else None
+
+    # Extract property info from list items
+    list_items = []
+    for item in info_container.find_all("li", {"class": "flex items-center"}):
+        svg = item.find("svg")
+        svg_path = svg.find("path") if svg else None
+        if svg_path:
+            list_items.append((item.text.strip(), svg_path.get("d", "")))
+    facts = classify_list_items(list_items)
+
+    # Extract realtor info
+    makelaar_elem = info_container.find("a", {"class": MAKELAAR_CLASS_RE})
+    makelaar_url = makelaar_elem['href'] if makelaar_elem else None
+    makelaar_text = makelaar_elem.text.strip() if makelaar_elem else None
+
+    return Home(
+        url=url,
+        street_house=street_house,
+        postal_code_city=postal_code_city,
+        price=price,
+        size=facts.get("size"),
+        bedrooms=facts.get("bedrooms"),
+        energy_rating=facts.get("energy_rating"),
+        makelaar_url=makelaar_url,
+        makelaar_text=makelaar_text
+    )
+
+
+def classify_list_item(item_text: str, path_d: str):
+    """
+    Identifies what info a listing list item represents by its SVG path, or failing that its text.
+    """
+    icon = LIST_ITEM_ICON_RE.match(path_d)
+    if icon:
+        return LIST_ITEM_ICONS[icon.group()]
+    for field, pattern in LIST_ITEM_PATTERNS:
+        if pattern.search(item_text):
+            return field
+    return None
+
+
+def classify_list_items(items: list[tuple[str, str]]) -> dict:
+    """
+    Maps the (text, SVG path) of a listing's list items to {field: text}. The first item of a field wins.
+    """
+    facts = {}
+    for item_text, path_d in items:
+        field = classify_list_item(item_text, path_d)
+        if field is not None and field not in facts:
+            facts[field] = item_text
+    return facts
+
+
+def _text(element) -> str:
+    return element.text_content().strip()
+
+
+def _single_string(element):
+    """
+    Mirrors BeautifulSoup's Tag.string: the text of an element with exactly one child node.
+    """
+    children = [element.text] if element.text else []
+    for child in element:
+        children.append(child)
+        if child.tail:
+            children.append(child.tail)
+    if len(children) != 1:
+        return None
+    child = children[0]
+    return child if isinstance(child, str) else _single_string(child)
+
+
+def parse_homes_lxml(page_source: str) -> list[Home]:
+    """
+    Extracts home information from the page source of a results page with lxml.
+
+    Only the markup from the first listing container onwards is handed to the parser,
+    so the head, navigation and filters are never turned into nodes.
+    """
+    marker = page_source.find(CONTAINER_MARKER)
+    if marker == -1:
+        return []
+    start = page_source.rfind("<div", 0, marker)
+    root = html.fromstring(page_source[start:])
+
+    homes = []
+    for container in XP_CONTAINERS(root):
+        # Skip advertisements by checking for ad-related IDs
+        if XP_AD(container):
+            logger.debug("Skipping advertisement element")
+            continue
+
+        flex_container = XP_FLEX(container)
+        if not flex_container:
+            continue
+
+        home = extract_home_data_lxml(flex_container[0])
+        if home.url:  # Only add if we have a valid URL
+            home.map_url = f"{home.url}/#kaart"
+            homes.append(home)
+
+    return homes
+
+
+def extract_home_data_lxml(element) -> Home:
+    """
+    Extracts home details from a single lxml element.
+    """
+    info_container = XP_INFO(element)
+    if not info_container:
+        return Home()
+    info_container = info_container[0]
+
+    # Extract URL and address info
+    address_link = XP_ADDRESS(info_container)
+    address_link = address_link[0] if address_link else None
+    url = address_link.get("href") if address_link is not None else None
+    if url and not url.startswith('http'):
+        url = f"https://www.funda.nl{url}"
+
+    street_house = postal_code_city = None
+    if address_link is not None:
+        street_house_elem = XP_STREET(address_link)
+        street_house = _text(street_house_elem[0]) if street_house_elem else None
+        postal_code_city_elem = XP_POSTAL(address_link)
+        postal_code_city = _text(postal_code_city_elem[0]) if postal_code_city_elem else None
+
+    # Extract price
+    price = None
+    for candidate in XP_TRUNCATE_DIVS(info_container):
+        string = _single_string(candidate)
+        if string is not None and PRICE_RE.search(string):
+            price = _text(candidate)
+            break
+
+    # Extract property info from list items
+    list_items = []
+    for item in XP_LIST_ITEMS(info_container):
+        svg_path = XP_SVG_PATH(item)
+        if svg_path:
+            list_items.append((_text(item), svg_path[0].get("d", "")))
+    facts = classify_list_items(list_items)
+
+    # Extract realtor info
+    makelaar_elem = XP_MAKELAAR(info_container)
+    makelaar_url = makelaar_elem[0].get("href") if makelaar_elem else None
+    makelaar_text = _text(makelaar_elem[0]) if makelaar_elem else None
+
+    return Home(
+        url=url,
+        street_house=street_house,
+        postal_code_city=postal_code_city,
+        price=price,
+        size=facts.get("size"),
+        bedrooms=facts.get("bedrooms"),
+        energy_rating=facts.get("energy_rating"),
+        makelaar_url=makelaar_url,
+        makelaar_text=makelaar_text
+    )
+
+
+def parse_details(page_source: str) -> dict:
+    """
+    Extracts availability, deposit, interior and service costs from a listing detail page.
+    Fields missing from the page are left out.
+    """
+    if not page_source:
+        return {}
+    details = {}
+    for term in XP_DETAIL_TERMS(html.fromstring(page_source)):
+        field = DETAIL_LABELS.get(_text(term).lower())
+        value = term.getnext()
+        if field is None or field in details or value is None or value.tag != "dd":
+            continue
+        text = " ".join(_text(value).split())
+        if text:
+            details[field] = text
+    return details
+
+
+PARSER_ENGINES = {
+    "bs4": parse_homes_bs4,
+    "lxml": parse_homes_lxml,
+}
@@ -0,0 +1,232 @@
+"""
+Write-behind persistence for small JSON state files.
+
+Containers are wrapped in TrackedList/TrackedDict, which report in-place
+mutations, so `settings.known_chats.append(...)` is persisted like an assignment.
+Changes are coalesced for a short debounce, serialised on the event loop and
+written by a background thread, atomically: temporary file, fsync, rename.
+Temporary files left behind by a crash are removed when the writer is created.
+"""
+import asyncio
+import glob
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from loguru import logger
+
+DEBOUNCE = 0.5
+# Temporary files older than this were left by a crash, not by a write in progress
+STALE_TEMP_AGE = 60
+
+
+def atomic_write(path: str, data: bytes):
+    """
+    Replaces the file with data so that readers and crashes only ever see the old or the new content.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=f".{os.path.basename(path)}.", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+    # Persist the rename itself
+    if hasattr(os, "O_DIRECTORY"):
+        dir_fd = os.open(directory, os.O_DIRECTORY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+
+def remove_stale_temp_files(path: str):
+    """
+    Deletes the temporary files atomic_write() left behind for path when a process died mid-write.
+    Recent ones may belong to another process writing right now, so they are kept.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    cutoff = time.time() - STALE_TEMP_AGE
+    for tmp_path in glob.glob(os.path.join(glob.escape(directory), f".{glob.escape(os.path.basename(path))}.*.tmp")):
+        try:
+            if os.path.getmtime(tmp_path) < cutoff:
+                os.unlink(tmp_path)
+                logger.info(f"Removed stale temporary file {tmp_path}")
+        except OSError:
+            pass
+
+
+def track(value, on_change):
+    """
+    Wraps lists and dicts, nested ones included, so that mutations call on_change().
+    Other values are returned as they are.
+    """
+    if isinstance(value, (TrackedList, TrackedDict)) and value.on_change == on_change:
+        return value
+    if isinstance(value, list):
+        return TrackedList(value, on_change)
+    if isinstance(value, dict):
+        return TrackedDict(value, on_change)
+    return value
+
+
+def _mutator(base, name):
+    method = getattr(base, name)
+
+    def wrapper(self, *args, **kwargs):
+        result = method(self, *args, **kwargs)
+        self.on_change()
+        return result
+
+    wrapper.__name__ = name
+    return wrapper
+
+
+class TrackedList(list):
+    def __init__(self, items, on_change):
+        self.on_change = on_change
+        super().__init__(track(item, on_change) for item in items)
+
+    def __setitem__(self, index, value):
+        if isinstance(index, slice):
+            value = [track(item, self.on_change) for item in value]
+        else:
+            value = track(value, self.on_change)
+        super().__setitem__(index, value)
+        self.on_change()
+
+    def append(self, value):
+        super().append(track(value, self.on_change))
+        self.on_change()
+
+    def insert(self, index, value):
+        super().insert(index, track(value, self.on_change))
+        self.on_change()
+
+    def extend(self, values):
+        super().extend(track(value, self.on_change) for value in values)
+        self.on_change()
+
+    def __iadd__(self, values):
+        self.extend(values)
+        return self
+
+    def __reduce__(self):
+        # Copies and pickles are plain lists, detached from the settings
+        return list, (list(self),)
+
+    __delitem__ = _mutator(list, "__delitem__")
+    __imul__ = _mutator(list, "__imul__")
+    remove = _mutator(list, "remove")
+    pop = _mutator(list, "pop")
+    clear = _mutator(list, "clear")
+    sort = _mutator(list, "sort")
+    reverse = _mutator(list, "reverse")
+
+
+class TrackedDict(dict):
+    def __init__(self, items, on_change):
+        self.on_change = on_change
+        super().__init__((key, track(value, on_change)) for key, value in items.items())
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, track(value, self.on_change))
+        self.on_change()
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            super().__setitem__(key, track(value, self.on_change))
+        self.on_change()
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    def __reduce__(self):
+        return dict, (dict(self),)
+
+    __delitem__ = _mutator(dict, "__delitem__")
+    pop = _mutator(dict, "pop")
+    popitem = _mutator(dict, "popitem")
+    clear = _mutator(dict, "clear")
+
+
+class WriteBehind:
+    """
+    Debounced, atomic writer of a JSON snapshot.
+
+    mark_dirty() can be called after every change. Inside a running event loop the
+    changes of the next `debounce` seconds are coalesced into one snapshot, written
+    by a single background thread, so writes never reorder. Without a loop the
+    file is written right away.
+    """
+
+    def __init__(self, path: str, snapshot, debounce: float = DEBOUNCE):
+        self.path = path
+        self.snapshot = snapshot  # returns the JSON-serialisable state
+        self.debounce = debounce
+        self.generation = 0  # bumped on every change
+        self.written = 0  # generation of the last completed write
+        self._timer: asyncio.TimerHandle | None = None
+        self._lock = threading.Lock()
+        # Named after the file, e.g. writer-settings.json, as every state file has its own writer
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"writer-{os.path.basename(path)}")
+        remove_stale_temp_files(path)
+
+    def mark_dirty(self):
+        self.generation += 1
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.flush()
+            return
+        # A fixed window from the first change, so a stream of changes cannot postpone the write forever
+        if self._timer is None:
+            self._timer = loop.call_later(self.debounce, self._write_behind)
+
+    def _serialise(self) -> tuple[int, bytes]:
+        return self.generation, json.dumps(self.snapshot()).encode("utf-8")
+
+    def _write_behind(self):
+        self._timer = None
+        # Serialised on the loop thread, so no mutation can interleave with the snapshot
+        generation, data = self._serialise()
+        self._executor.submit(self._write, generation, data)
+
+    def _write(self, generation: int, data: bytes):
+        with self._lock:
+            if generation <= self.written:
+                return  # A newer snapshot is already on disk
+            try:
+                atomic_write(self.path, data)
+            except Exception as e:
+                logger.error(f"Failed to write {self.path}: {e}")
+                return
+            self.written = generation
+        logger.debug(f"Saved {self.path} ({len(data)} bytes, change {generation})")
+
+    def flush(self):
+        """
+        Writes pending changes now and waits until they are on disk.
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self.generation > self.written:
+            generation, data = self._serialise()
+            self._executor.submit(self._write, generation, data).result()
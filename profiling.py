@@ -0,0 +1,193 @@
+"""
+On-demand profiling of the running bot, for /profile, /memsnap and SIGUSR1.
+
+The profiler samples instead of tracing: a background thread reads the stack of
+every thread from sys._current_frames() at a fixed rate, so the event loop is
+never paused or instrumented, and the scan and send loops keep their timing.
+It only sees this process; the parse pool workers and Chrome are processes of
+their own.
+
+Memory snapshots use tracemalloc. Tracing starts with the first snapshot and
+slows allocations down while it is on, so it stays off until asked for. Taking
+a snapshot holds the interpreter for a moment, like a garbage collection.
+"""
+import collections
+import os
+import resource
+import sys
+import sysconfig
+import threading
+import time
+import tracemalloc
+
+DEFAULT_PROFILE_SECONDS = 30
+MAX_PROFILE_SECONDS = 600
+SAMPLE_INTERVAL = 0.01
+TOP = 15
+# Frames kept per allocation by tracemalloc
+MEMORY_FRAMES = 5
+# Leaf functions of a thread that is waiting for work rather than running
+IDLE_FUNCTIONS = {
+    ("selectors.py", "select"),
+    ("threading.py", "wait"),
+    ("thread.py", "_worker"),
+    ("queue.py", "get"),
+    ("socketserver.py", "serve_forever"),
+}
+
+# The standard library, left out of the "on the stack" table as every stack passes through asyncio
+STDLIB = sysconfig.get_paths()["stdlib"]
+
+_profile_lock = threading.Lock()
+_labels: dict = {}  # code object -> label
+_library_labels: set[str] = set()
+_memory_baseline: tracemalloc.Snapshot | None = None
+
+
+def parse_duration(text: str) -> float:
+    """
+    Parses "60", "60s" or "2m" into seconds, within 1 and MAX_PROFILE_SECONDS.
+    """
+    text = text.strip().lower()
+    scale = 60 if text.endswith("m") else 1
+    seconds = float(text.rstrip("sm")) * scale
+    if not 1 <= seconds <= MAX_PROFILE_SECONDS:
+        raise ValueError(f"Duration must be between 1 and {MAX_PROFILE_SECONDS} seconds")
+    return seconds
+
+
+def _frame_label(code) -> str:
+    label = _labels.get(code)
+    if label is None:
+        label = _labels[code] = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+        if code.co_filename.startswith((STDLIB, "<frozen")):
+            _library_labels.add(label)
+    return label
+
+
+def _is_idle(frame) -> bool:
+    return (os.path.basename(frame.f_code.co_filename), frame.f_code.co_name) in IDLE_FUNCTIONS
+
+
+def sample_stacks(seconds: float, interval: float = SAMPLE_INTERVAL) -> tuple[collections.Counter, int]:
+    """
+    Samples the stacks of all other threads for the given time.
+    Returns {(thread name, frame labels from the outermost): samples} and the number of sampling rounds.
+    """
+    if not _profile_lock.acquire(blocking=False):
+        raise RuntimeError("A profile is already running")
+    try:
+        own = threading.get_ident()
+        stacks = collections.Counter()
+        rounds = 0
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                idle = _is_idle(frame)
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame.f_code))
+                    frame = frame.f_back
+                stack.reverse()
+                if idle:
+                    stack.append("<idle>")
+                stacks[names.get(ident, str(ident)), tuple(stack)] += 1
+            rounds += 1
+            time.sleep(interval)
+        return stacks, rounds
+    finally:
+        _profile_lock.release()
+
+
+def profile(seconds: float, top: int = TOP) -> tuple[str, bytes]:
+    """
+    Samples the process for the given time. Blocks, so it is meant for a thread.
+    Returns a summary of the busiest functions and the samples in the folded stack
+    format of flamegraph.pl and speedscope.
+    """
+    stacks, rounds = sample_stacks(seconds)
+    main_thread = threading.main_thread().name
+    own_time = collections.Counter()
+    total_time = collections.Counter()
+    threads = collections.Counter()
+    busy = collections.Counter()
+    for (thread, stack), count in stacks.items():
+        threads[thread] += count
+        if stack[-1] == "<idle>":
+            continue
+        busy[thread] += count
+        own_time[thread, stack[-1]] += count
+        for label in set(stack) - _library_labels:
+            total_time[thread, label] += count
+
+    def table(counter: collections.Counter) -> list[str]:
+        return [f"{count / rounds:>6.1%}  {label}  [{thread}]" for (thread, label), count in counter.most_common(top)]
+
+    lines = [
+        f"Profile of {seconds:g} s, {rounds} samples taken about every {SAMPLE_INTERVAL * 1000:g} ms. "
+        f"Shares are of the samples; the parse pool and Chrome are not included.",
+        f"Event loop busy: {busy[main_thread] / rounds if rounds else 0:.0%}",
+        "Busy threads: " + (", ".join(f"{thread} {count / rounds:.0%}" for thread, count in busy.most_common(top))
+                            or "none"),
+        f"Idle threads: {len(threads) - len(busy)}",
+        "",
+        "Running (own time):",
+        *table(own_time),
+        "",
+        "On the stack (including callees, without the standard library):",
+        *table(total_time),
+    ]
+    folded = "\n".join(f"{thread};{';'.join(stack)} {count}" for (thread, stack), count in stacks.items())
+    return "\n".join(lines), folded.encode("utf-8")
+
+
+def _take_snapshot() -> tracemalloc.Snapshot:
+    return tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    ))
+
+
+def memory_snapshot(top: int = TOP) -> str:
+    """
+    Starts tracing allocations on the first call. Later calls summarise where
+    traced memory is held, and what grew since the previous call.
+    """
+    global _memory_baseline
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss  # KiB on Linux
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(MEMORY_FRAMES)
+        _memory_baseline = _take_snapshot()
+        return (f"Started tracing allocations (peak RSS {peak_rss / 1024:.0f} MiB). "
+                f"Send /memsnap again later to see what grew, /memsnap stop to stop tracing.")
+    snapshot = _take_snapshot()
+    current, peak = tracemalloc.get_traced_memory()
+    lines = [
+        f"Traced memory {current / 2 ** 20:.1f} MiB (peak {peak / 2 ** 20:.1f} MiB), "
+        f"process peak RSS {peak_rss / 1024:.0f} MiB",
+        "",
+        "Largest by line:",
+        *(f"{stat.size / 1024:>9.0f} KiB {stat.count:>7}  {stat.traceback[0]}"
+          for stat in snapshot.statistics("lineno")[:top]),
+    ]
+    if _memory_baseline is not None:
+        grown = [stat for stat in snapshot.compare_to(_memory_baseline, "lineno") if stat.size_diff > 0][:top]
+        lines += [
+            "",
+            "Grown since the previous snapshot:",
+            *(f"{stat.size_diff / 1024:>+9.0f} KiB {stat.count_diff:>+7}  {stat.traceback[0]}" for stat in grown),
+        ]
+    _memory_baseline = snapshot
+    return "\n".join(lines)
+
+
+def stop_memory_tracing() -> str:
+    global _memory_baseline
+    if not tracemalloc.is_tracing():
+        return "Allocations are not being traced."
+    tracemalloc.stop()
+    _memory_baseline = None
+    return "Stopped tracing allocations."
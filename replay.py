@@ -0,0 +1,351 @@
+"""
+Record and replay of fetched pages.
+
+Recording: set `_record_dir` in settings.json and every result and detail page
+the bot fetches is saved there, gzipped, with its URL and fetch time in
+index.jsonl.
+
+Replay: drives the whole pipeline (scheduler, browser pool, parser, seen index,
+message queue, delivery engine) from a recording, without Funda or Telegram.
+A ReplayDriver serves, for every URL, the latest page recorded at the current
+virtual time, and a FakeBot captures what would have been sent. Reports
+listing-to-message latency in virtual time, throughput, and which listings were
+announced, which can be checked against a saved baseline after parser changes.
+
+    python replay.py <recording dir> [--speed 10] [--load-time 1.0] [--save-baseline | --check]
+
+Replays run in a scratch directory with a copy of settings.json, so the real
+settings, seen index and history are never touched.
+"""
+import argparse
+import asyncio
+import gzip
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from loguru import logger
+
+ROOT = Path(__file__).resolve().parent
+INDEX_FILE = "index.jsonl"
+BASELINE_FILE = "replay_baseline.json"
+# Markers of the elements the scraper waits for; other lookups (popups) always succeed
+CONTENT_MARKERS = {
+    "div.flex.flex-col.sm\\:flex-row": 'class="flex flex-col sm:flex-row"',
+    "dt": "<dt",
+}
+
+
+class Recorder:
+    """
+    Saves fetched pages with their URL and fetch time. Files are written on a background thread.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.started = time.time()
+        self.count = sum(1 for _ in self.directory.glob("*.html.gz"))
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="recorder")
+
+    def record(self, url: str, page_source: str):
+        self.count += 1
+        name = f"{self.count:06d}.html.gz"
+        entry = {"file": name, "url": url, "t": time.time(), "offset": time.time() - self.started}
+        self._executor.submit(self._write, name, page_source, entry)
+
+    def _write(self, name: str, page_source: str, entry: dict):
+        try:
+            with gzip.open(self.directory / name, "wt", encoding="utf-8") as f:
+                f.write(page_source)
+            with open(self.directory / INDEX_FILE, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry) + "\n")
+        except OSError as e:
+            logger.error(f"Failed to record {entry['url']}: {e}")
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+
+class Recording:
+    """
+    A recorded session: for every URL, its pages sorted by the time they were fetched.
+    Offsets are re-based so the first page is at 0, also across appended sessions.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = Path(directory)
+        with open(self.directory / INDEX_FILE, encoding="utf-8") as f:
+            entries = [json.loads(line) for line in f if line.strip()]
+        if not entries:
+            raise ValueError(f"Empty recording: {directory}")
+        start = min(entry["t"] for entry in entries)
+        self.pages: dict[str, list[tuple[float, str]]] = {}
+        for entry in sorted(entries, key=lambda entry: entry["t"]):
+            self.pages.setdefault(entry["url"], []).append((entry["t"] - start, entry["file"]))
+        self.duration = max(entry["t"] for entry in entries) - start
+        self._cache: dict[str, str] = {}
+
+    def read(self, name: str) -> str:
+        page_source = self._cache.get(name)
+        if page_source is None:
+            with gzip.open(self.directory / name, "rt", encoding="utf-8") as f:
+                page_source = self._cache[name] = f.read()
+        return page_source
+
+    def page_at(self, url: str, offset: float) -> str | None:
+        """
+        Returns the latest page of the URL recorded at or before offset, or its first one.
+        """
+        pages = self.pages.get(url)
+        if not pages:
+            return None
+        name = pages[0][1]
+        for page_offset, page_name in pages:
+            if page_offset > offset:
+                break
+            name = page_name
+        return self.read(name)
+
+
+class ReplayClock:
+    """
+    Virtual time of the recording, running `speed` times faster than the wall clock.
+    """
+
+    def __init__(self, speed: float = 1.0):
+        self.speed = speed
+        self.started = time.monotonic()
+
+    def now(self, at: float = None) -> float:
+        return ((at if at is not None else time.monotonic()) - self.started) * self.speed
+
+
+class _Element:
+    def is_displayed(self):
+        return True
+
+    def is_enabled(self):
+        return True
+
+    def click(self):
+        pass
+
+
+class ReplayDriver:
+    """
+    Stands in for the Selenium driver and serves pages from a recording.
+    """
+
+    def __init__(self, recording: Recording, clock: ReplayClock, load_time: float = 1.0):
+        self.recording = recording
+        self.clock = clock
+        self.load_time = load_time  # seconds of virtual time per page load
+        self.current_url = ""
+        self.page_source = ""
+        self.recorded = False
+
+    def get(self, url: str):
+        time.sleep(self.load_time / self.clock.speed)
+        self.current_url = url
+        page_source = self.recording.page_at(url, self.clock.now())
+        # A URL that was never fetched while recording loads as an empty page
+        self.recorded = page_source is not None
+        self.page_source = page_source or "<html><body></body></html>"
+
+    def find_element(self, by, value):
+        from selenium.common import NoSuchElementException
+
+        marker = CONTENT_MARKERS.get(value)
+        if self.recorded and marker is not None and marker not in self.page_source:
+            raise NoSuchElementException(f"{value} not in replayed page")
+        return _Element()
+
+    def execute_cdp_cmd(self, cmd, params):
+        return {}
+
+    def execute_script(self, script, *args):
+        return "Mozilla/5.0 (replay)"
+
+    def get_cookies(self):
+        return []
+
+    def quit(self):
+        pass
+
+
+class FakeBot:
+    """
+    Captures send_message calls instead of talking to Telegram.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.sent: list[tuple[float, int, str]] = []  # (monotonic time, chat id, text)
+
+    async def send_message(self, chat_id: int, text: str, **kwargs):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self.sent.append((time.monotonic(), chat_id, text))
+
+
+def is_search_url(url: str) -> bool:
+    """
+    Tells the first result page of a search apart from further pages and detail pages.
+    """
+    return "/detail/" not in url and "search_result=" not in url
+
+
+def first_appearances(recording: Recording) -> dict[str, float]:
+    """
+    Maps every listing URL to the offset of the first recorded page showing it.
+    """
+    from parsing import parse_homes
+
+    appearances = {}
+    for pages in recording.pages.values():
+        for offset, name in pages:
+            for home in parse_homes(recording.read(name)):
+                if home.url and (home.url not in appearances or offset < appearances[home.url]):
+                    appearances[home.url] = offset
+    return appearances
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+async def replay(recording: Recording, speed: float, load_time: float, interval: float):
+    """
+    Runs the scanner and delivery pipeline against the recording and returns the FakeBot.
+    """
+    import delivery as delivery_module
+    from notifications import DELIVERY_BACKLOG, plan_messages
+    from parser import FundaParser
+    from settings import message_queue, settings
+
+    settings._searches = [
+        settings._new_search(i, url, interval=interval / speed)
+        for i, url in enumerate(sorted(url for url in recording.pages if is_search_url(url)), 1)
+    ]
+    # Adaptive polling bounds run on the replay clock too; quiet hours would follow the wall clock
+    settings._poll_max_interval = settings.poll_max_interval / speed
+    settings._poll_quiet_max_interval = settings.poll_quiet_max_interval / speed
+    settings._quiet_hours = [0, 0]
+    settings._known_chats = [-1]
+    settings._metrics_port = 0
+    settings._record_dir = None
+
+    # Telegram's rate limits too, so messages queue up as they would live
+    delivery_module.PRIVATE_CHAT_RATE *= speed
+    delivery_module.GROUP_CHAT_RATE *= speed
+
+    clock = ReplayClock(speed)
+    bot = FakeBot()
+    delivery = delivery_module.DeliveryEngine(bot, global_rate=delivery_module.GLOBAL_RATE * speed)
+    parser = FundaParser(driver_factory=lambda: ReplayDriver(recording, clock, load_time))
+    clock.started = time.monotonic()
+
+    async def deliver():
+        # As check_and_send_new_messages in main.py, without chat filters
+        while True:
+            await delivery.wait_for_capacity(DELIVERY_BACKLOG)
+            notifications = await message_queue.get_batch()
+            recipients = await message_queue.unsent_recipients(
+                notifications, lambda notification: notification.chat_ids or settings.known_chats
+            )
+            messages = plan_messages(notifications, recipients)
+            for text, chat_ids, submitted_at in messages:
+                delivery.submit(text, chat_ids, submitted_at=submitted_at)
+
+    tasks = [asyncio.create_task(parser.scan_funda()), asyncio.create_task(deliver())]
+    await asyncio.sleep(recording.duration / speed + interval / speed + load_time)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    await delivery.join()
+    await delivery.close()
+    await parser.close()
+    bot.started, bot.clock = clock.started, clock
+    return bot
+
+
+def report(recording: Recording, bot: FakeBot, speed: float) -> set[str]:
+    import metrics
+
+    appearances = first_appearances(recording)
+    announced, latencies = set(), []
+    for sent_at, chat_id, text in bot.sent:
+        for url, appeared in appearances.items():
+            if f"href='{url}'" in text and url not in announced:
+                announced.add(url)
+                latencies.append(bot.clock.now(sent_at) - appeared)
+    wall = (max(sent_at for sent_at, _, _ in bot.sent) - bot.started) if bot.sent else 0.0
+
+    print(f"Recording: {recording.duration:.0f} s, {sum(map(len, recording.pages.values()))} pages, "
+          f"{len(appearances)} listings; replayed at {speed:g}x")
+    print(f"Messages: {len(bot.sent)} ({len(bot.sent) / wall if wall else 0:.1f}/s wall), "
+          f"listings announced: {len(announced)}")
+    parsed, unchanged = metrics.parse_skips.value(result="parsed"), metrics.parse_skips.value(result="unchanged")
+    if parsed + unchanged:
+        print(f"Result pages: {parsed + unchanged:.0f}, unchanged and not parsed: {unchanged:.0f} "
+              f"({unchanged / (parsed + unchanged):.0%}), parse time saved: {metrics.parse_time_saved.value() * 1000:.0f} ms")
+    if latencies:
+        print(f"Listing-to-message latency (virtual s): p50 {percentile(latencies, 0.5):.1f}, "
+              f"p95 {percentile(latencies, 0.95):.1f}, max {max(latencies):.1f}, "
+              f"mean {statistics.mean(latencies):.1f}")
+    return announced
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    arg_parser.add_argument("recording", help="directory written by the recorder")
+    arg_parser.add_argument("--speed", type=float, default=10.0, help="virtual seconds per wall second")
+    arg_parser.add_argument("--load-time", type=float, default=1.0, help="virtual seconds per page load")
+    arg_parser.add_argument("--interval", type=float, default=10.0, help="virtual poll interval per search")
+    group = arg_parser.add_mutually_exclusive_group()
+    group.add_argument("--save-baseline", action="store_true", help=f"store announced listings in {BASELINE_FILE}")
+    group.add_argument("--check", action="store_true", help=f"fail if announced listings differ from {BASELINE_FILE}")
+    args = arg_parser.parse_args()
+
+    recording_dir = os.path.abspath(args.recording)
+    recording = Recording(recording_dir)
+    logger.remove()
+    logger.add(sys.stderr, level="WARNING")
+
+    with tempfile.TemporaryDirectory(prefix="funda-replay-") as workdir:
+        with open(ROOT / "settings.json") as f:
+            settings = json.load(f)
+        # The queue is loaded with the settings, so it is kept local before the import
+        settings["_queue_transport"] = "local"
+        with open(os.path.join(workdir, "settings.json"), "w") as f:
+            json.dump(settings, f)
+        os.chdir(workdir)
+        bot = asyncio.run(replay(recording, args.speed, args.load_time, args.interval))
+    announced = report(recording, bot, args.speed)
+
+    baseline_path = os.path.join(recording_dir, BASELINE_FILE)
+    if args.save_baseline:
+        with open(baseline_path, "w") as f:
+            json.dump(sorted(announced), f, indent=1)
+        print(f"Baseline saved to {baseline_path}")
+    elif args.check:
+        with open(baseline_path) as f:
+            baseline = set(json.load(f))
+        missing, extra = baseline - announced, announced - baseline
+        print(f"Baseline check: {len(missing)} missing, {len(extra)} unexpected")
+        for url in sorted(missing):
+            print(f"  missing {url}")
+        for url in sorted(extra):
+            print(f"  unexpected {url}")
+        sys.exit(1 if missing or extra else 0)
+
+
+if __name__ == "__main__":
+    main()
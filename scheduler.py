@@ -0,0 +1,109 @@
+import math
+import random
+import time
+from datetime import datetime
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from loguru import logger
+
+import metrics
+
+try:
+    FUNDA_TZ = ZoneInfo("Europe/Amsterdam")
+except ZoneInfoNotFoundError:
+    FUNDA_TZ = None  # No tz database available, fall back to local time
+
+RATE_HALF_LIFE = 3600  # New-listing rate forgets the past with a one hour half-life
+TARGET_NEW_PER_POLL = 0.1  # Poll often enough to expect a new listing every ten polls
+HOT_POLLS = 5  # Polls kept at the minimum interval after new listings show up
+MAX_BACKOFF = 300
+
+poll_interval = metrics.registry.gauge(
+    "funda_poll_interval_seconds", "Delay chosen before the next poll of a search", ("search",)
+)
+poll_decisions = metrics.registry.counter(
+    "funda_poll_decisions_total", "Reasons behind the chosen poll delays", ("search", "reason")
+)
+new_listing_rate = metrics.registry.gauge(
+    "funda_new_listing_rate_per_hour", "Smoothed rate of new listings of a search", ("search",)
+)
+
+
+def check_interval(min_interval: float):
+    """
+    Rejects an interval that would poll in a hot loop, e.g. 0 in a hand-edited settings.json.
+    The one second minimum for users is enforced by the commands; replay.py polls faster.
+    """
+    if not min_interval > 0:
+        raise ValueError(f"Poll interval must be positive, got {min_interval}")
+
+
+class PollScheduler:
+    """
+    Picks the delay before the next poll of one search.
+
+    After a successful poll the delay follows the smoothed new-listing rate. It
+    stays at the search's own interval while listings keep appearing, and it
+    stretches up to max_interval when the search is quiet, or up to
+    quiet_max_interval during the quiet hours of the night. Failed polls back off
+    exponentially with jitter so a broken browser is not hammered.
+    """
+
+    def __init__(self, search_id: int, max_interval: float, quiet_max_interval: float, quiet_hours: tuple):
+        self.search_id = search_id
+        self.max_interval = max_interval
+        self.quiet_max_interval = quiet_max_interval
+        self.quiet_hours = tuple(quiet_hours)
+        self.rate: float | None = None  # new listings per second
+        self.failures = 0
+        self.hot_polls = 0
+        self._last_success: float | None = None
+
+    def is_quiet_hour(self, now: datetime = None) -> bool:
+        hour = (now or datetime.now(FUNDA_TZ)).hour
+        start, end = self.quiet_hours
+        return start <= hour < end if start <= end else hour >= start or hour < end
+
+    def after_success(self, new_count: int, min_interval: float) -> float:
+        """
+        Updates the listing rate with the outcome of a poll and returns the next delay.
+        """
+        check_interval(min_interval)
+        now = time.monotonic()
+        self.failures = 0
+        if self.rate is None:
+            # Start out assuming a busy search, so a restart never slows detection down
+            self.rate = TARGET_NEW_PER_POLL / min_interval
+        if self._last_success is not None:
+            elapsed = max(now - self._last_success, 1e-3)
+            alpha = 1 - math.exp(-elapsed * math.log(2) / RATE_HALF_LIFE)
+            self.rate += alpha * (new_count / elapsed - self.rate)
+        self._last_success = now
+        new_listing_rate.set(self.rate * 3600, search=self.search_id)
+
+        if new_count:
+            self.hot_polls = HOT_POLLS
+        if self.hot_polls:
+            self.hot_polls -= 1
+            return self._decide(min_interval, "new_listings")
+        delay = TARGET_NEW_PER_POLL / self.rate if self.rate > 0 else math.inf
+        upper, reason = self.max_interval, "rate"
+        if self.is_quiet_hour():
+            upper, reason = self.quiet_max_interval, "quiet_hours"
+        return self._decide(min(max(delay, min_interval), max(upper, min_interval)), reason)
+
+    def after_failure(self, min_interval: float) -> float:
+        """
+        Returns an exponential backoff delay with jitter for a failed poll.
+        """
+        check_interval(min_interval)
+        self.failures += 1
+        ceiling = min(MAX_BACKOFF, min_interval * 2 ** self.failures)
+        # Equal jitter: at least half the ceiling, so retries never bunch up near zero
+        return self._decide(ceiling / 2 + random.uniform(0, ceiling / 2), "backoff")
+
+    def _decide(self, delay: float, reason: str) -> float:
+        poll_interval.set(delay, search=self.search_id)
+        poll_decisions.inc(search=self.search_id, reason=reason)
+        logger.debug(f"Search {self.search_id}: next poll in {delay:.1f} sec ({reason})")
+        return delay
@@ -0,0 +1,139 @@
+import fcntl
+import os
+import time
+
+from loguru import logger
+
+SEEN_FILE = "seen_listings.log"
+SEEN_TTL = 30 * 24 * 3600  # Forget listings not seen for a month
+SEEN_MAX_ENTRIES = 200_000
+
+
+def seen_file(shard: tuple[int, int] | None = None, replica: str | None = None) -> str:
+    """
+    The seen log of a scanner. A log has a single writer, so every shard and replica keeps its own,
+    e.g. seen_listings.0of2.a.log for replica "a" of shard 0/2.
+    """
+    parts = ([f"{shard[0]}of{shard[1]}"] if shard else []) + ([replica] if replica else [])
+    return f"seen_listings.{'.'.join(parts)}.log" if parts else SEEN_FILE
+
+
+class SeenIndex:
+    """
+    Persistent set of listing keys with TTL eviction.
+
+    Keys live in a dict (key -> last seen timestamp) kept in last-seen order, so
+    lookups are O(1) and eviction only touches the oldest entries. Every change is
+    appended to a tab separated log which is replayed on startup and compacted once
+    it holds too many stale lines. The log belongs to one process: a second index on
+    the same path fails to start instead of losing the first one's writes.
+    """
+
+    def __init__(self, path: str = SEEN_FILE, ttl: float = SEEN_TTL, max_entries: int = SEEN_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._seen: dict[str, float] = {}
+        self._log_lines = 0
+        self._log = None
+        self._lock = open(f"{path}.lock", "a")
+        try:
+            fcntl.flock(self._lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self._lock.close()
+            raise RuntimeError(
+                f"{path} is in use by another scanner. Replicas sharing a working directory need --replica NAME"
+            )
+        self.load()
+
+    def load(self):
+        """
+        Replays the log into memory, skipping expired and malformed lines.
+        """
+        start = time.perf_counter()
+        cutoff = time.time() - self.ttl
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    self._log_lines += 1
+                    timestamp, _, key = line.rstrip("\n").partition("\t")
+                    try:
+                        timestamp = float(timestamp)
+                    except ValueError:
+                        continue
+                    if key and timestamp >= cutoff:
+                        self._seen.pop(key, None)
+                        self._seen[key] = timestamp
+        self.evict()
+        logger.info(
+            f"Loaded {len(self._seen)} seen listings from {self.path} "
+            f"in {(time.perf_counter() - start) * 1000:.0f} ms"
+        )
+        if self._log_lines > 2 * len(self._seen) + 1000:
+            self.compact()
+
+    def __contains__(self, key: str) -> bool:
+        timestamp = self._seen.get(key)
+        return timestamp is not None and time.time() - timestamp < self.ttl
+
+    def __len__(self) -> int:
+        return len(self._seen)
+
+    def add_many(self, keys):
+        """
+        Marks keys as seen now. Only new keys and ones not refreshed for a while hit the disk.
+        """
+        now = time.time()
+        refresh_before = now - self.ttl / 4
+        lines = []
+        for key in keys:
+            timestamp = self._seen.pop(key, None)
+            if timestamp is None or timestamp < refresh_before:
+                timestamp = now
+                lines.append(f"{now:.0f}\t{key}\n")
+            self._seen[key] = timestamp
+        if lines:
+            self._append(lines)
+        self.evict()
+
+    def evict(self):
+        """
+        Drops expired entries and the oldest ones beyond max_entries.
+        """
+        cutoff = time.time() - self.ttl
+        overflow = len(self._seen) - self.max_entries
+        for key, timestamp in list(self._seen.items()):
+            if timestamp >= cutoff and overflow <= 0:
+                break
+            del self._seen[key]
+            overflow -= 1
+
+    def compact(self):
+        """
+        Rewrites the log with the live entries only.
+        """
+        self._close_log()
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.writelines(f"{timestamp:.0f}\t{key}\n" for key, timestamp in self._seen.items())
+        os.replace(tmp_path, self.path)
+        self._log_lines = len(self._seen)
+        logger.debug(f"Compacted {self.path} to {self._log_lines} entries")
+
+    def _append(self, lines: list[str]):
+        if self._log is None:
+            self._log = open(self.path, "a", encoding="utf-8")
+        self._log.writelines(lines)
+        self._log.flush()
+        self._log_lines += len(lines)
+        if self._log_lines > 2 * len(self._seen) + 1000:
+            self.compact()
+
+    def _close_log(self):
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+
+    def close(self):
+        self._close_log()
+        self._lock.close()
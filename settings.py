@@ -1,11 +1,37 @@
 import json
-from asyncio import Queue
+import os
 
 from loguru import logger
 
+from notifications import QUEUE_TRANSPORTS, create_queue
+from persistence import WriteBehind, track
+
+FETCH_BACKENDS = ("browser", "http")
+PARSER_ENGINES = ("lxml", "bs4")
+DEFAULT_POLL_INTERVAL = 10
+# Requests the scraper never needs: listing photos, web fonts, ad slots and trackers.
+# Patterns use Chrome's Network.setBlockedURLs wildcard syntax.
+DEFAULT_BLOCKED_URL_PATTERNS = [
+    "*.jpg", "*.jpeg", "*.png", "*.gif", "*.webp", "*.avif", "*.ico",
+    "*.woff", "*.woff2", "*.ttf", "*.otf",
+    "*.mp4", "*.webm",
+    "*cloud.funda.nl/valentina_media*",
+    "*doubleclick.net*", "*googlesyndication.com*", "*adservice.google.*", "*gpt.js*",
+    "*googletagmanager.com*", "*google-analytics.com*", "*hotjar.com*",
+    "*facebook.net*", "*bat.bing.com*", "*tiktok.com*", "*clarity.ms*",
+]
+
+
+# Attributes of Settings that are not saved to settings.json
+RUNTIME_ATTRIBUTES = ("_writer", "_loaded_mtime")
+
 
 class Settings:
     def __init__(self):
+        # Saves are coalesced and written atomically off the event loop
+        self._writer = WriteBehind("settings.json", self._snapshot)
+        # Modification time of settings.json when it was last loaded, see reload_if_changed()
+        self._loaded_mtime: int | None = None
         self.funda_url_default: str = (
             "https://www.funda.nl/en/zoeken/huur"
             "?selected_area=%5B%22amsterdam,50km%22%5D&sort=%22date_down%22"
@@ -13,29 +39,121 @@ class Settings:
         self._funda_url: str = self.funda_url_default
         self._known_chats: list[int] = []
         self._admins_ids: list[int] = []
+        self._fetch_backend: str = "browser"
+        self._parser_engine: str = "lxml"
+        # Saved searches: {"id": int, "url": str, "interval": seconds, "chats": [chat ids, empty for all]}
+        self._searches: list[dict] = []
+        # Per-chat listing filters, see filters.py. JSON keys are chat ids as strings.
+        self._chat_filters: dict[str, dict] = {}
+        self._browser_workers: int = 1
+        self._http_workers: int = 4
+        # Browsers are recycled after this many pages, megabytes of RSS or hours, whichever comes first
+        self._browser_max_pages: int = 500
+        self._browser_max_rss_mb: int = 1500
+        self._browser_max_age_hours: int = 6
+        # Adaptive polling: a search's own interval is the lower bound
+        self._poll_max_interval: int = 60
+        self._poll_quiet_max_interval: int = 300
+        self._quiet_hours: list[int] = [1, 6]
+        # Result pages fetched per poll at most, when a burst of listings overflows the first page
+        self._max_result_pages: int = 5
+        # Follow-up messages with availability, deposit, interior and service costs from detail pages
+        self._enrich_details: bool = True
+        self._enrich_workers: int = 2
+        self._block_resources: bool = True
+        # Prometheus metrics on http://127.0.0.1:<port>/metrics, 0 turns the endpoint off
+        self._metrics_port: int = 9108
+        # Directory to record fetched pages to for replay.py, None turns recording off
+        self._record_dir: str | None = None
+        # Queue between scanner and notifier, see notifications.py. The URL is the SQLite
+        # file or the Redis URL, None for the transport's default.
+        self._queue_transport: str = "local"
+        self._queue_url: str | None = None
+        self._blocked_url_patterns: list[str] = list(DEFAULT_BLOCKED_URL_PATTERNS)
         self.load()
 
     def load(self):
         with open("settings.json", "r") as f:
+            self._loaded_mtime = os.fstat(f.fileno()).st_mtime_ns
             _settings = json.load(f)
         self._funda_url = _settings.get("_funda_url") or self._funda_url
         self._known_chats = _settings.get("_known_chats") or self._known_chats
         self._admins_ids = _settings.get("_admins_ids") or self._admins_ids
+        self._fetch_backend = _settings.get("_fetch_backend") or self._fetch_backend
+        self._parser_engine = _settings.get("_parser_engine") or self._parser_engine
+        self._searches = _settings.get("_searches") or self._searches
+        self._chat_filters = _settings.get("_chat_filters") or self._chat_filters
+        self._browser_workers = _settings.get("_browser_workers") or self._browser_workers
+        self._http_workers = _settings.get("_http_workers") or self._http_workers
+        self._browser_max_pages = _settings.get("_browser_max_pages") or self._browser_max_pages
+        self._browser_max_rss_mb = _settings.get("_browser_max_rss_mb") or self._browser_max_rss_mb
+        self._browser_max_age_hours = _settings.get("_browser_max_age_hours") or self._browser_max_age_hours
+        self._poll_max_interval = _settings.get("_poll_max_interval") or self._poll_max_interval
+        self._poll_quiet_max_interval = _settings.get("_poll_quiet_max_interval") or self._poll_quiet_max_interval
+        self._quiet_hours = _settings.get("_quiet_hours") or self._quiet_hours
+        self._max_result_pages = _settings.get("_max_result_pages") or self._max_result_pages
+        self._enrich_details = _settings.get("_enrich_details", self._enrich_details)
+        self._enrich_workers = _settings.get("_enrich_workers") or self._enrich_workers
+        self._block_resources = _settings.get("_block_resources", self._block_resources)
+        self._blocked_url_patterns = _settings.get("_blocked_url_patterns") or self._blocked_url_patterns
+        self._metrics_port = _settings.get("_metrics_port", self._metrics_port)
+        self._record_dir = _settings.get("_record_dir", self._record_dir)
+        self._queue_transport = _settings.get("_queue_transport") or self._queue_transport
+        self._queue_url = _settings.get("_queue_url", self._queue_url)
+        if self._queue_transport not in QUEUE_TRANSPORTS:
+            raise ValueError(f"Unknown queue transport: {self._queue_transport}. Expected one of {QUEUE_TRANSPORTS}")
+        if not self._searches:
+            # Settings from before saved searches: the single URL becomes search #1
+            self._searches = [self._new_search(1, self._funda_url)]
         logger.debug(f"Loaded settings: {self.__dict__}")
 
+    def __setattr__(self, name, value):
+        # Lists and dicts report in-place changes, e.g. settings.known_chats.append(...)
+        if name not in RUNTIME_ATTRIBUTES:
+            value = track(value, self.save)
+        super().__setattr__(name, value)
+
+    def _snapshot(self) -> dict:
+        return {name: value for name, value in self.__dict__.items() if name not in RUNTIME_ATTRIBUTES}
+
     def save(self):
-        with open("settings.json", "w") as f:
-            logger.debug(f"Saving settings: {self.__dict__}")
-            json.dump(self.__dict__, f)
+        self._writer.mark_dirty()
+
+    def flush(self):
+        """
+        Writes pending changes to settings.json right away, e.g. on shutdown.
+        """
+        self._writer.flush()
+
+    def reload_if_changed(self) -> bool:
+        """
+        Loads settings.json again if another process changed it, e.g. the notifier
+        after a command, and this one has no unsaved changes. Returns whether it did.
+        """
+        try:
+            mtime = os.stat("settings.json").st_mtime_ns
+        except OSError:
+            return False
+        if mtime == self._loaded_mtime or self._writer.generation > self._writer.written:
+            return False
+        self.load()
+        return True
 
     @property
     def funda_url(self):
-        return self._funda_url
+        """
+        URL of the primary (first) saved search.
+        """
+        return self._searches[0]["url"] if self._searches else self._funda_url
 
     @funda_url.setter
     def funda_url(self, value):
         logger.info(f"New url set: {value}")
         self._funda_url: str = value
+        if self._searches:
+            self._searches[0]["url"] = value
+        else:
+            self._searches.append(self._new_search(1, value))
         self.save()
 
     @funda_url.deleter
@@ -70,15 +188,166 @@ class Settings:
     def admins_ids(self):
         del self._admins_ids
 
+    @property
+    def fetch_backend(self):
+        return self._fetch_backend
+
+    @fetch_backend.setter
+    def fetch_backend(self, value):
+        if value not in FETCH_BACKENDS:
+            raise ValueError(f"Unknown fetch backend: {value}. Expected one of {FETCH_BACKENDS}")
+        logger.info(f"New fetch backend set: {value}")
+        self._fetch_backend: str = value
+        self.save()
+
+    @property
+    def parser_engine(self):
+        return self._parser_engine
+
+    @parser_engine.setter
+    def parser_engine(self, value):
+        if value not in PARSER_ENGINES:
+            raise ValueError(f"Unknown parser engine: {value}. Expected one of {PARSER_ENGINES}")
+        logger.info(f"New parser engine set: {value}")
+        self._parser_engine: str = value
+        self.save()
+
+    @property
+    def searches(self):
+        return self._searches
+
+    @property
+    def browser_workers(self):
+        return self._browser_workers
+
+    @property
+    def http_workers(self):
+        return self._http_workers
+
+    @property
+    def browser_max_pages(self):
+        return self._browser_max_pages
+
+    @property
+    def browser_max_rss_mb(self):
+        return self._browser_max_rss_mb
+
+    @property
+    def browser_max_age_hours(self):
+        return self._browser_max_age_hours
+
+    @property
+    def poll_max_interval(self):
+        return self._poll_max_interval
+
+    @property
+    def poll_quiet_max_interval(self):
+        return self._poll_quiet_max_interval
+
+    @property
+    def quiet_hours(self):
+        return self._quiet_hours
+
+    @property
+    def max_result_pages(self):
+        return self._max_result_pages
+
+    @property
+    def enrich_details(self):
+        return self._enrich_details
+
+    @property
+    def enrich_workers(self):
+        return self._enrich_workers
+
+    @property
+    def block_resources(self):
+        return self._block_resources
+
+    @property
+    def blocked_url_patterns(self):
+        return self._blocked_url_patterns
+
+    @property
+    def metrics_port(self):
+        return self._metrics_port
+
+    @property
+    def record_dir(self):
+        return self._record_dir
+
+    @property
+    def queue_transport(self):
+        return self._queue_transport
+
+    @property
+    def queue_url(self):
+        return self._queue_url
+
+    @staticmethod
+    def _new_search(search_id: int, url: str, interval: int = DEFAULT_POLL_INTERVAL, chats: list = None) -> dict:
+        return {"id": search_id, "url": url, "interval": interval, "chats": list(chats or [])}
+
+    def get_search(self, search_id: int):
+        return next((search for search in self._searches if search["id"] == search_id), None)
+
+    def add_search(self, url: str, interval: int = DEFAULT_POLL_INTERVAL, chats: list = None) -> dict:
+        search_id = max((search["id"] for search in self._searches), default=0) + 1
+        search = self._new_search(search_id, url, interval, chats)
+        logger.info(f"New search added: {search}")
+        self._searches.append(search)
+        self.save()
+        return search
+
+    def update_search(self, search_id: int, **changes):
+        search = self.get_search(search_id)
+        if search is None:
+            return None
+        logger.info(f"Search {search_id} updated: {changes}")
+        search.update(changes)
+        if search is self._searches[0] and "url" in changes:
+            self._funda_url = changes["url"]
+        self.save()
+        return search
+
+    def remove_search(self, search_id: int) -> bool:
+        search = self.get_search(search_id)
+        if search is None:
+            return False
+        logger.info(f"Search removed: {search}")
+        self._searches.remove(search)
+        self.save()
+        return True
+
+    @property
+    def chat_filters(self) -> dict[int, dict]:
+        return {int(chat_id): rule for chat_id, rule in self._chat_filters.items()}
+
+    def set_chat_filter(self, chat_id: int, rule: dict):
+        logger.info(f"Filter of chat {chat_id} set: {rule}")
+        self._chat_filters[str(chat_id)] = rule
+        self.save()
+
+    def remove_chat_filter(self, chat_id: int) -> bool:
+        if self._chat_filters.pop(str(chat_id), None) is None:
+            return False
+        logger.info(f"Filter of chat {chat_id} removed")
+        self.save()
+        return True
+
     def __repr__(self):
         return (
             f"<Settings funda_url={self.funda_url}, "
             f"known_chats={self.known_chats}, "
-            f"admins_ids={self.admins_ids}>"
+            f"admins_ids={self.admins_ids}, "
+            f"fetch_backend={self.fetch_backend}, "
+            f"parser_engine={self.parser_engine}, "
+            f"searches={len(self.searches)}>"
         )
 
 
 settings = Settings()
 
-message_queue = Queue()
+# Notifications waiting for delivery, bounded and kept across restarts
+message_queue = create_queue(settings.queue_transport, settings.queue_url)
 
@@ -0,0 +1,19 @@
+"""
+The bot's modules read and write settings.json, the seen index and the history
+in the working directory, so the tests run in a temporary one with a copy of
+the settings.
+"""
+import os
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+WORKDIR = tempfile.mkdtemp(prefix="funda-tests-")
+shutil.copy(ROOT / "settings.json", WORKDIR)
+os.chdir(WORKDIR)
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123456:test")
+os.environ.setdefault("OWNER_ID", "1000")
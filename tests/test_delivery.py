@@ -0,0 +1,87 @@
+import asyncio
+import sys
+import threading
+import time
+from pathlib import Path
+
+import pytest
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+
+import delivery
+from delivery import DeliveryEngine
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "bench"))
+
+from loadtest import TOKEN, Bucket, RateLimitedTelegram, telegram_url  # noqa: E402
+
+
+@pytest.fixture
+def telegram():
+    server = RateLimitedTelegram()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def deliver(telegram: RateLimitedTelegram, messages: list[tuple[str, int]], **engine_options):
+    """
+    Sends (text, chat id) messages through a DeliveryEngine and waits for them.
+    """
+
+    async def run():
+        bot = Bot(token=TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(telegram_url(telegram))))
+        engine = DeliveryEngine(bot, **engine_options)
+        try:
+            for text, chat_id in messages:
+                engine.submit(text, [chat_id])
+            await asyncio.wait_for(engine.join(), timeout=30)
+        finally:
+            await engine.close()
+            await bot.session.close()
+
+    asyncio.run(run())
+    return telegram.delivered
+
+
+def test_private_chat_gets_one_message_per_second(telegram):
+    started = time.monotonic()
+    delivered = deliver(telegram, [(f"message {i}", 1) for i in range(3)])
+    assert [text for _, _, text in delivered] == ["message 0", "message 1", "message 2"]
+    assert all(at - started >= i for i, (at, _, _) in enumerate(delivered))
+    assert telegram.rejected == 0
+
+
+def test_global_rate_spreads_a_fan_out(telegram):
+    started = time.monotonic()
+    delivered = deliver(telegram, [("listing", chat_id) for chat_id in range(1, 11)], global_rate=5)
+    assert sorted(chat_id for _, chat_id, _ in delivered) == list(range(1, 11))
+    # A burst of 5, then the other 5 at 5 per second
+    assert max(at for at, _, _ in delivered) - started >= 1
+    assert telegram.rejected == 0
+
+
+def test_retry_after_waits_without_using_up_attempts(telegram, monkeypatch):
+    # Any failure would drop the message, so it must get through on the RetryAfter alone
+    monkeypatch.setattr(delivery, "MAX_ATTEMPTS", 1)
+    telegram.chat_buckets[7] = Bucket(0.5, 1)
+    started = time.monotonic()
+    delivered = deliver(telegram, [("first", 7), ("second", 7)])
+    assert [text for _, _, text in delivered] == ["first", "second"]
+    assert telegram.rejected >= 1
+    # Rejected after a second, then blocked for the retry_after of one more
+    assert delivered[1][0] - started >= 2
+
+
+def test_retry_after_beyond_the_limit_drops_the_message(telegram, monkeypatch):
+    monkeypatch.setattr(delivery, "MAX_RETRY_AFTER_WAIT", 5)
+    telegram.chat_buckets[7] = Bucket(0.01, 1)
+    started = time.monotonic()
+    delivered = deliver(telegram, [("first", 7), ("second", 7)])
+    # The second is answered with a retry_after of 100 sec and dropped instead of waiting
+    assert [text for _, _, text in delivered] == ["first"]
+    assert telegram.rejected == 1
+    assert time.monotonic() - started < 5
@@ -0,0 +1,27 @@
+import json
+from pathlib import Path
+
+import pytest
+
+from parsing import parse_homes
+
+CORPUS_DIR = Path(__file__).resolve().parent.parent / "bench" / "corpus"
+EXPECTED = json.loads((CORPUS_DIR / "expected.json").read_text(encoding="utf-8"))
+# The card fields recorded in expected.json, as in bench/bench_parser.py
+FIELDS = (
+    "url", "street_house", "postal_code_city", "price",
+    "size", "bedrooms", "energy_rating", "makelaar_text",
+)
+
+
+def fields(homes) -> list[dict]:
+    return [{field: getattr(home, field) for field in FIELDS} for home in homes]
+
+
+@pytest.mark.parametrize("page", sorted(EXPECTED))
+def test_engines_agree_with_each_other_and_the_golden_fields(page):
+    source = (CORPUS_DIR / page).read_text(encoding="utf-8")
+    from_bs4 = fields(parse_homes(source, "bs4"))
+    from_lxml = fields(parse_homes(source, "lxml"))
+    assert from_bs4 == from_lxml
+    assert from_lxml == EXPECTED[page]
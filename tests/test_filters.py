@@ -0,0 +1,15 @@
+from types import SimpleNamespace
+
+from filters import FilterIndex, merge_intervals, parse_rule
+
+
+def test_merge_intervals_treats_open_bounds_as_infinite():
+    assert merge_intervals([(None, 1019), (None, 1050)]) == [(None, 1050)]
+    assert merge_intervals([(1100, None), (1011, 1019), (1181, None)]) == [(1011, 1019), (1100, None)]
+    assert merge_intervals([(1011, 1019), (1020, 1030), (1050, 1050)]) == [(1011, 1030), (1050, 1050)]
+
+
+def test_postcode_rule_with_two_open_ranges_matches_the_wider_one():
+    index = FilterIndex({1: parse_rule(["postcode=-1019,-1050"])})
+    assert index.match(SimpleNamespace(postcode=1030)) == {1}
+    assert index.match(SimpleNamespace(postcode=1051)) == set()
@@ -0,0 +1,52 @@
+import asyncio
+import sqlite3
+import time
+
+from history import RETENTION, HistoryStore
+from models import Home
+
+URL = "https://www.funda.nl/detail/huur/amsterdam/appartement-a/43000001/"
+
+
+def test_listings_past_the_retention_are_pruned(tmp_path):
+    path = str(tmp_path / "history.sqlite3")
+    old = time.time() - RETENTION - 3600
+
+    async def record():
+        history = HistoryStore(path)
+        history.observe(1, [Home(url=URL, price="€ 1.500 /maand")])
+        await history.close()
+
+    asyncio.run(record())
+    with sqlite3.connect(path) as db:
+        db.execute("INSERT INTO listings (listing_key, price, first_seen, last_seen) VALUES ('gone', 900, ?, ?)",
+                   (old, old))
+        db.execute("INSERT INTO sightings (listing_key, seen_at, price) VALUES ('gone', ?, 900)", (old,))
+        db.execute("INSERT INTO search_listings (search_id, listing_key, price, last_seen) "
+                   "VALUES (1, 'gone', 900, ?)", (old,))
+
+    async def reopen():
+        history = HistoryStore(path)
+        latest = set(history._latest)
+        await history.close()
+        return latest
+
+    assert asyncio.run(reopen()) == {(1, "43000001")}
+    with sqlite3.connect(path) as db:
+        assert db.execute("SELECT listing_key FROM listings").fetchall() == [("43000001",)]
+        assert db.execute("SELECT COUNT(*) FROM sightings WHERE listing_key = 'gone'").fetchone() == (0,)
+
+
+def test_every_search_showing_a_listing_reports_its_price_change(tmp_path):
+    path = str(tmp_path / "history.sqlite3")
+
+    async def run():
+        history = HistoryStore(path)
+        for search_id in (1, 2):
+            history.observe(search_id, [Home(url=URL, price="€ 1.500 /maand")])
+        changes = [history.observe(search_id, [Home(url=URL, price="€ 1.400 /maand")])[0] for search_id in (1, 2)]
+        await history.close()
+        return changes
+
+    changes = asyncio.run(run())
+    assert [[old_price for _, old_price in search_changes] for search_changes in changes] == [[1500], [1500]]
@@ -0,0 +1,64 @@
+import asyncio
+import time
+from pathlib import Path
+
+from parser import FundaParser
+from replay import ReplayDriver
+from settings import settings
+
+CORPUS_PAGE = Path(__file__).resolve().parent.parent / "bench" / "corpus" / "results_01.html"
+LOAD_TIME = 1.0
+SCAN_TIME = 4.0
+MAX_LAG = 0.1
+
+
+class SlowDriver(ReplayDriver):
+    """
+    Serves a corpus page for every URL, taking LOAD_TIME seconds like a slow Chrome.
+    """
+
+    def __init__(self):
+        self.current_url = ""
+        self.page_source = ""
+        self.recorded = False
+        self.loads = 0
+
+    def get(self, url: str):
+        time.sleep(LOAD_TIME)
+        self.current_url = url
+        self.page_source = CORPUS_PAGE.read_text(encoding="utf-8")
+        self.recorded = True
+        self.loads += 1
+
+
+def test_loop_keeps_running_while_the_driver_fetches(monkeypatch):
+    monkeypatch.setattr(settings, "_enrich_details", False)
+    monkeypatch.setattr(settings, "_browser_workers", 1)
+    drivers = []
+
+    def driver_factory():
+        drivers.append(SlowDriver())
+        return drivers[-1]
+
+    async def run():
+        parser = FundaParser(driver_factory=driver_factory)
+        lags = []
+
+        async def watch_loop():
+            while True:
+                started = time.monotonic()
+                await asyncio.sleep(0.01)
+                lags.append(time.monotonic() - started - 0.01)
+
+        watcher = asyncio.create_task(watch_loop())
+        scan = asyncio.create_task(parser.scan_funda())
+        await asyncio.sleep(SCAN_TIME)
+        for task in (scan, watcher):
+            task.cancel()
+        await asyncio.gather(scan, watcher, return_exceptions=True)
+        await parser.close()
+        return lags
+
+    lags = asyncio.run(run())
+    assert sum(driver.loads for driver in drivers) >= 2
+    assert max(lags) < MAX_LAG
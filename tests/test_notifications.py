@@ -0,0 +1,17 @@
+import pytest
+
+from notifications import NotificationQueue, SharedNotificationQueue, SqliteNotificationQueue
+
+
+def test_transports_implement_the_queue(tmp_path):
+    NotificationQueue(str(tmp_path / "pending.json"))
+    SqliteNotificationQueue(str(tmp_path / "notifications.sqlite3"))
+
+
+def test_incomplete_transport_fails_when_created():
+    class PushOnly(SharedNotificationQueue):
+        async def _push(self, key, notification, queued_at):
+            return "queued", 1
+
+    with pytest.raises(TypeError, match="_pop"):
+        PushOnly()
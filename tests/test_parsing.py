@@ -0,0 +1,15 @@
+from bench.make_corpus import BED_PATH_NEW, BED_PATH_OLD, FURNISHING_PATH, SIZE_PATH
+from parsing import classify_list_item
+
+
+def test_list_items_are_classified_by_known_icons_or_their_text():
+    assert classify_list_item("2", BED_PATH_OLD) == "bedrooms"
+    assert classify_list_item("72 m²", SIZE_PATH) == "size"
+    assert classify_list_item("2 bedrooms", BED_PATH_NEW) == "bedrooms"
+
+
+def test_text_fallback_takes_energy_labels_like_the_model():
+    assert classify_list_item("A++++", "") == "energy_rating"
+    assert classify_list_item("Furnished", FURNISHING_PATH) is None
+    # A bare number under an unknown icon could be anything
+    assert classify_list_item("3", BED_PATH_NEW) is None
@@ -0,0 +1,29 @@
+import os
+import threading
+import time
+
+from persistence import STALE_TEMP_AGE, WriteBehind
+
+
+def test_writer_removes_temp_files_left_by_a_crash(tmp_path):
+    path = tmp_path / "settings.json"
+    stale = tmp_path / ".settings.json.abc123.tmp"
+    fresh = tmp_path / ".settings.json.def456.tmp"
+    other = tmp_path / ".other.json.abc123.tmp"
+    for tmp in (stale, fresh, other):
+        tmp.write_text("{}")
+    old = time.time() - STALE_TEMP_AGE - 1
+    os.utime(stale, (old, old))
+    os.utime(other, (old, old))
+
+    writer = WriteBehind(str(path), lambda: {"a": 1})
+    writer.mark_dirty()
+    assert not stale.exists()
+    assert fresh.exists() and other.exists()
+    assert path.read_text() == '{"a": 1}'
+
+
+def test_writer_thread_is_named_after_its_file(tmp_path):
+    writer = WriteBehind(str(tmp_path / "pending_notifications.json"), lambda: [])
+    writer.mark_dirty()
+    assert any(thread.name.startswith("writer-pending_notifications.json") for thread in threading.enumerate())
@@ -0,0 +1,65 @@
+import asyncio
+from types import SimpleNamespace
+
+from models import Home
+from parser import FundaParser, page_url
+from seen import SeenIndex
+
+PER_PAGE = 15
+SEARCH = {"id": 1, "url": "https://www.funda.nl/zoeken/huur?sort=%22date_down%22", "interval": 10, "chats": []}
+
+
+def make_parser(tmp_path, feed: list[Home], fetched: list[str], max_result_pages: int = 5) -> FundaParser:
+    """
+    A FundaParser without browsers or a parse pool, polling pages of the feed.
+    """
+    parser = FundaParser.__new__(FundaParser)
+    parser.settings = SimpleNamespace(max_result_pages=max_result_pages)
+    parser.seen = SeenIndex(str(tmp_path / "seen.log"))
+
+    async def poll(url):
+        fetched.append(url)
+        page = next(page for page in range(1, 100) if page_url(SEARCH["url"], page) == url)
+        return feed[(page - 1) * PER_PAGE:page * PER_PAGE]
+
+    parser.poll = poll
+    return parser
+
+
+async def scan(parser: FundaParser) -> list[Home]:
+    homes = await parser.poll_pages(SEARCH)
+    return await parser.check_new_homes(SEARCH, homes)
+
+
+def test_listing_dropping_off_page_one_announces_nothing(tmp_path):
+    feed = [Home(url=f"https://www.funda.nl/detail/huur/amsterdam/{43000000 + n}/") for n in range(100)]
+    fetched = []
+    parser = make_parser(tmp_path, feed, fetched)
+
+    async def run():
+        first = await scan(parser)
+        assert len(first) == 1  # Cold start: only the latest, to show the search works
+        assert len(fetched) == 5  # Every page is seeded
+
+        fetched.clear()
+        del feed[3]
+        assert await scan(parser) == []
+        assert fetched == [SEARCH["url"]]
+
+    asyncio.run(run())
+
+
+def test_burst_overflowing_page_one_fetches_next_page(tmp_path):
+    feed = [Home(url=f"https://www.funda.nl/detail/huur/amsterdam/{43000000 + n}/") for n in range(100)]
+    fetched = []
+    parser = make_parser(tmp_path, feed, fetched)
+
+    async def run():
+        await scan(parser)
+        fetched.clear()
+        burst = [Home(url=f"https://www.funda.nl/detail/huur/amsterdam/{43100000 + n}/") for n in range(20)]
+        feed[:0] = burst
+        assert await scan(parser) == burst
+        assert fetched == [SEARCH["url"], page_url(SEARCH["url"], 2)]
+
+    asyncio.run(run())
@@ -0,0 +1,44 @@
+import asyncio
+import time
+
+import pytest
+
+from parser import FundaParser, SearchState
+from scheduler import PollScheduler
+
+
+def make_scheduler() -> PollScheduler:
+    return PollScheduler(1, max_interval=60, quiet_max_interval=300, quiet_hours=(0, 0))
+
+
+def test_zero_interval_is_rejected():
+    scheduler = make_scheduler()
+    with pytest.raises(ValueError):
+        scheduler.after_success(0, 0)
+    with pytest.raises(ValueError):
+        scheduler.after_failure(-1)
+
+
+def test_sub_second_intervals_are_kept_for_replay():
+    scheduler = make_scheduler()
+    assert scheduler.after_success(1, 0.1) == 0.1
+
+
+def test_failing_scheduler_does_not_leave_a_stale_task():
+    parser = FundaParser.__new__(FundaParser)
+
+    async def poll_pages(search):
+        raise RuntimeError("browser gone")
+
+    parser.poll_pages = poll_pages
+    state = SearchState(make_scheduler())
+    state.scheduler.after_failure = lambda min_interval: 1 / 0
+    search = {"id": 1, "url": "https://www.funda.nl/zoeken/huur", "interval": 10, "chats": []}
+
+    async def run():
+        state.task = asyncio.create_task(parser.scan_search(search, state))
+        await state.task
+
+    asyncio.run(run())
+    assert state.task is None
+    assert state.next_poll > time.monotonic()
@@ -0,0 +1,20 @@
+import pytest
+
+from seen import SeenIndex, seen_file
+
+
+def test_shards_and_replicas_get_their_own_log():
+    assert seen_file() == "seen_listings.log"
+    assert len({seen_file(), seen_file((0, 2)), seen_file((1, 2)), seen_file((0, 2), "b"), seen_file(None, "b")}) == 5
+
+
+def test_second_index_on_a_log_refuses_to_start(tmp_path):
+    path = str(tmp_path / "seen.log")
+    first = SeenIndex(path)
+    with pytest.raises(RuntimeError, match="--replica"):
+        SeenIndex(path)
+    first.add_many(["1"])
+    first.close()
+    second = SeenIndex(path)
+    assert "1" in second
+    second.close()